@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """In-memory cache of answers keyed by question embedding.
+
+    A new question reuses a stored answer when its cosine similarity to a
+    previous question, asked in the same scope (role and retrieval mode)
+    against the same index version, is at least ``threshold``. Least
+    recently used entries across all scopes are dropped once
+    ``max_entries`` is reached, and answers from an older index version are
+    dropped as soon as a newer version is seen.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (scope, index_version, question) -> answer, least recently used first
+        self._buckets = {}  # (scope, index_version) -> {question: unit vector}
+        self._version = None  # Newest index version seen; older answers are dropped
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        """Drop answers from older index versions; False if this version is itself stale."""
+        if self._version is not None and index_version < self._version:
+            return False
+        if index_version != self._version:
+            self._entries.clear()
+            self._buckets.clear()
+            self._version = index_version
+        return True
+
+    def _remove(self, key):
+        scope, index_version, question = key
+        del self._entries[key]
+        bucket = self._buckets[(scope, index_version)]
+        del bucket[question]
+        if not bucket:
+            del self._buckets[(scope, index_version)]
+
+    def lookup(self, embedding, scope, index_version):
+        """Return the cached answer closest to the embedding, or None."""
+        with self._lock:
+            bucket = self._buckets.get((scope, index_version)) if self._check_version(index_version) else None
+            if bucket:
+                questions = list(bucket)
+                scores = np.stack(list(bucket.values())) @ self._normalize(embedding)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = (scope, index_version, questions[best])
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+            self.misses += 1
+            return None
+
+    def store(self, question, embedding, scope, index_version, answer):
+        """Remember the answer given to a question."""
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            key = (scope, index_version, question)
+            self._buckets.setdefault((scope, index_version), {})[question] = self._normalize(embedding)
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Drop every stored answer, e.g. after the documents changed."""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,207 @@
+"""Recall@k, query latency and resident memory of HNSW settings and int8 quantization.
+
+Generates ``--vectors`` unit vectors around ``--clusters`` centres and
+``--queries`` queries near random corpus vectors, and finds their exact
+top-k by brute force. Each ``--m`` x ``--ef-construction`` pair builds a
+Chroma collection, searched with every ``--ef-search``. The int8 index is
+searched with every ``--probes`` (0 = scan every vector) and ``--rescore``
+(candidates rescored with their float32 vectors read from disk, 0 = none).
+Both are searched through the collection API ChromaVectorStore uses. Every
+build and search runs in a fresh process, so "RSS MB" is the memory taken
+by opening the index and answering the queries:
+
+    python -m benchmarks.ann_tuning --vectors 1000000 --m 16,32 --ef-search 10,50,100,200
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+BATCH_SIZE = 5000  # Below Chroma's maximum batch size
+CHUNKS_PER_DOCUMENT = 100
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def rss_mb():
+    """Resident memory of this process; the peak where the current value cannot be read (macOS)."""
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def make_corpus(path, count, dim, clusters, seed=0):
+    """Write ``count`` unit vectors scattered around random centres to a .npy file, block by block."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    corpus = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(count, dim))
+    for start in range(0, count, BATCH_SIZE * 10):
+        size = min(BATCH_SIZE * 10, count - start)
+        block = centres[rng.integers(0, clusters, size)] + 0.7 * rng.standard_normal((size, dim), dtype=np.float32)
+        corpus[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    corpus.flush()
+
+
+def exact_neighbours(corpus, queries, top_k, block=65536):
+    """Indices of the ``top_k`` nearest corpus vectors of each query (squared L2)."""
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(corpus), block):
+        vectors = np.asarray(corpus[start:start + block])
+        distances = np.einsum("ij,ij->i", vectors, vectors) - 2 * queries @ vectors.T
+        ids = np.concatenate((best_ids, np.broadcast_to(np.arange(start, start + len(vectors)), distances.shape)), 1)
+        distances = np.concatenate((best_distances, distances), 1)
+        keep = np.argsort(distances, axis=1)[:, :top_k]
+        best_ids = np.take_along_axis(ids, keep, 1)
+        best_distances = np.take_along_axis(distances, keep, 1)
+    return best_ids
+
+
+def node_id(i):
+    return f"chunk-{i}"
+
+
+def build_collection(workdir, corpus_path, m, ef_construction):
+    """Add the corpus to a new Chroma collection; return build seconds."""
+    import chromadb
+    corpus = np.load(corpus_path, mmap_mode="r")
+    client = chromadb.PersistentClient(os.path.join(workdir, f"chroma_m{m}_efc{ef_construction}"))
+    collection = client.create_collection(
+        "bench", configuration={"hnsw": {"max_neighbors": m, "ef_construction": ef_construction}}
+    )
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), BATCH_SIZE):
+        ids = range(offset, min(offset + BATCH_SIZE, len(corpus)))
+        collection.add(
+            ids=[node_id(i) for i in ids], embeddings=np.asarray(corpus[offset:offset + len(ids)]),
+            documents=[f"Chunk {i}" for i in ids],
+            metadatas=[{"file_name": f"document_{i // CHUNKS_PER_DOCUMENT}.pdf"} for i in ids],
+        )
+    return time.perf_counter() - start
+
+
+def build_quantized(workdir, corpus_path):
+    """Add the corpus to a QuantizedCollection and partition it; return build seconds."""
+    from quantized_store import QuantizedCollection
+    corpus = np.load(corpus_path, mmap_mode="r")
+    collection = QuantizedCollection(os.path.join(workdir, "quantized.sqlite3"))
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), BATCH_SIZE):
+        ids = range(offset, min(offset + BATCH_SIZE, len(corpus)))
+        collection.add(
+            ids=[node_id(i) for i in ids], embeddings=np.asarray(corpus[offset:offset + len(ids)]),
+            documents=[f"Chunk {i}" for i in ids],
+            metadatas=[{"file_name": f"document_{i // CHUNKS_PER_DOCUMENT}.pdf"} for i in ids],
+        )
+    collection.train()
+    return time.perf_counter() - start
+
+
+def measure(search, queries, truth, top_k):
+    """Run every query through ``search(query) -> node ids``; return (recall@k, p50 ms, p95 ms)."""
+    search(queries[0])  # Load the index
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found) & {node_id(i) for i in expected})
+    latencies.sort()
+    return hits / truth.size, statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def search_collection(collection, queries, truth, top_k, baseline):
+    def search(query):
+        # Documents, metadatas and distances, as ChromaVectorStore asks for them
+        return collection.query(query_embeddings=[query], n_results=top_k)["ids"][0]
+
+    return (*measure(search, queries, truth, top_k), rss_mb() - baseline)
+
+
+def search_hnsw(workdir, m, ef_construction, ef_search, queries, truth, top_k):
+    import chromadb
+    baseline = rss_mb()
+    client = chromadb.PersistentClient(os.path.join(workdir, f"chroma_m{m}_efc{ef_construction}"))
+    collection = client.get_collection("bench")
+    collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+    return search_collection(collection, queries, truth, top_k, baseline)
+
+
+def search_quantized(workdir, probes, rescore_candidates, queries, truth, top_k):
+    from quantized_store import QuantizedCollection
+    baseline = rss_mb()
+    collection = QuantizedCollection(
+        os.path.join(workdir, "quantized.sqlite3"), probes=probes, rescore_candidates=rescore_candidates
+    )
+    return search_collection(collection, queries, truth, top_k, baseline)
+
+
+def report(label, build_seconds, recall, p50, p95, rss):
+    build = f"{build_seconds:.1f}" if build_seconds is not None else ""
+    print(f"{label:>26} {build:>8} {recall:>7.3f} {p50:>8.2f} {p95:>8.2f} {rss:>8.0f}")
+
+
+def in_process(fn, *args):
+    """Run ``fn(*args)`` in a fresh process and return its result."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--m", type=int_list, default=[16, 32], help="HNSW_M values")
+    parser.add_argument("--ef-construction", type=int_list, default=[100], help="HNSW_EF_CONSTRUCTION values")
+    parser.add_argument("--ef-search", type=int_list, default=[10, 50, 100, 200], help="HNSW_EF_SEARCH values")
+    parser.add_argument("--probes", type=int_list, default=[4, 16, 64], help="QUANTIZED_PROBES values")
+    parser.add_argument("--rescore", type=int_list, default=[0, 50, 200], help="QUANTIZED_RESCORE values")
+    parser.add_argument("--workdir", help="Directory for the corpus and indexes (default: a temporary one)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        corpus_path = os.path.join(workdir, "corpus.npy")
+        make_corpus(corpus_path, args.vectors, args.dim, args.clusters)
+        corpus = np.load(corpus_path, mmap_mode="r")
+        rng = np.random.default_rng(1)
+        queries = np.asarray(corpus[np.sort(rng.choice(args.vectors, args.queries, replace=False))])
+        queries = queries + 0.3 * rng.standard_normal(queries.shape, dtype=np.float32) / np.sqrt(args.dim)
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+        truth = exact_neighbours(corpus, queries, args.top_k)
+        print(f"{args.vectors} vectors, dim {args.dim}, {args.clusters} clusters, {args.queries} queries, "
+              f"recall@{args.top_k}; float32 vectors take {corpus.nbytes / 2 ** 20:.0f} MB")
+        del corpus
+
+        builds = [(m, ef_construction) for m in args.m for ef_construction in args.ef_construction]
+        print(f"{'index':>26} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+        for m, ef_construction in builds:
+            seconds = in_process(build_collection, workdir, corpus_path, m, ef_construction)
+            for ef_search in args.ef_search:
+                results = in_process(search_hnsw, workdir, m, ef_construction, ef_search, queries, truth, args.top_k)
+                report(f"hnsw M={m} efc={ef_construction} ef={ef_search}", seconds, *results)
+                seconds = None
+
+        seconds = in_process(build_quantized, workdir, corpus_path)
+        for probes in args.probes:
+            for rescore_candidates in args.rescore:
+                results = in_process(search_quantized, workdir, probes, rescore_candidates, queries, truth, args.top_k)
+                report(f"int8 probes={probes} rescore={rescore_candidates}", seconds, *results)
+                seconds = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Prompt tokens per turn of a long conversation: full pasted history vs the budgeted chat memory.
+
+"pasted" is a user who pastes every earlier turn into the next question,
+so the answer prompt grows linearly. "memory" is ChatMemory: the condense
+prompt holds the summary and the newest turns within the budget, and the
+answer prompt only holds the standalone question. The retrieved context is
+the same in both and left out. Tokens are counted as words, and the
+summarizer is stubbed with an extract of the requested length, so no model
+is needed.
+
+    python -m benchmarks.chat_memory_tokens --turns 40 --budget 1500
+"""
+import argparse
+from chat_memory import ChatMemory, CONDENSE_PROMPT
+
+ANSWER = ("The marketing mix combines product, price, place and promotion decisions for a target segment. " * 20).strip()
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def fake_complete(prompt):
+    # Return as many words as the summary prompt asks for
+    words = int(prompt.split("in at most ", 1)[1].split(" words", 1)[0])
+    return " ".join(prompt.split("New turns:", 1)[1].split()[:words])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--summary", type=int, default=300)
+    args = parser.parse_args()
+
+    memory = ChatMemory(fake_complete, count_tokens, token_budget=args.budget, summary_tokens=args.summary)
+    history = []
+    print(f"{'turn':>5} {'pasted':>8} {'memory':>8}")
+    for turn in range(1, args.turns + 1):
+        question = f"Follow-up question {turn}: how does that apply to pricing?"
+        pasted = count_tokens("\n".join(history + [question]))
+        condense_prompt = memory.condense_prompt(question)
+        # Without history the question is used as is; otherwise the condense prompt plus a standalone question
+        used = count_tokens(question) * (2 if condense_prompt else 1) + (count_tokens(condense_prompt or ""))
+        if turn in (1, 2, 5) or turn % 10 == 0:
+            print(f"{turn:>5} {pasted:>8} {used:>8}")
+        history += [question, ANSWER]
+        memory.add_turn(question, ANSWER)
+        memory.wait_for_summary()
+    print(f"Condense prompt overhead without history: {count_tokens(CONDENSE_PROMPT)} tokens")
+
+
+if __name__ == "__main__":
+    main()
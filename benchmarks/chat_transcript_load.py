@@ -0,0 +1,114 @@
+"""Time and memory to open a long chat session: QLabel-per-message layout vs the QListView transcript.
+
+Load time runs until the first frame has been processed. Each variant runs
+in its own process so resident memory is comparable. The session
+alternates short questions and long answers.
+
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.chat_transcript_load --messages 5000
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (
+    QApplication, QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSizePolicy, QListView
+)
+
+ANSWER = "The marketing mix is usually described as the four Ps: product, price, place and promotion. " * 8
+
+
+def make_session(count):
+    return [(i, "user" if i % 2 == 0 else "model", f"Question {i}?" if i % 2 == 0 else ANSWER) for i in range(count)]
+
+
+def rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def load_widgets(session):
+    """The previous layout: one QLabel + container widget + QHBoxLayout per message."""
+    scroll_area = QScrollArea()
+    scroll_area.setWidgetResizable(True)
+    container = QWidget()
+    layout = QVBoxLayout(container)
+    layout.setAlignment(Qt.AlignTop)
+    scroll_area.setWidget(container)
+    scroll_area.resize(1400, 900)
+    scroll_area.show()
+    for _, sender, text in session:
+        label = QLabel(text)
+        label.setWordWrap(True)
+        label.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
+        label.setStyleSheet("background-color: white; border-radius: 10px; padding: 10px;")
+        max_width = 500 if sender == "user" else 1300
+        desired_width = label.fontMetrics().boundingRect(label.text()).width() + 40
+        if desired_width < max_width:
+            label.setFixedWidth(desired_width)
+        else:
+            label.setMaximumWidth(max_width)
+        label.adjustSize()
+        label.setFixedHeight(label.sizeHint().height())
+        row = QWidget()
+        row_layout = QHBoxLayout(row)
+        row_layout.addWidget(label)
+        row_layout.setAlignment(Qt.AlignRight if sender == "user" else Qt.AlignLeft)
+        layout.addWidget(row)
+    scroll_area.verticalScrollBar().setValue(scroll_area.verticalScrollBar().maximum())
+    return scroll_area
+
+
+def load_view(session):
+    """The model/view transcript used by MainWindow."""
+    from chat_transcript import ChatMessageModel, ChatBubbleDelegate
+    view = QListView()
+    view.setVerticalScrollMode(QListView.ScrollPerPixel)
+    view.setResizeMode(QListView.Adjust)
+    view.setLayoutMode(QListView.Batched)
+    view.setBatchSize(200)
+    model = ChatMessageModel(view)
+    view.setModel(model)
+    view.setItemDelegate(ChatBubbleDelegate(view))
+    view.resize(1400, 900)
+    view.show()
+    model.set_messages(session)
+    view.scrollToBottom()
+    return view
+
+
+def run_variant(variant, count):
+    app = QApplication(sys.argv)
+    session = make_session(count)
+    baseline = rss_mb()
+    start = time.perf_counter()
+    widget = (load_widgets if variant == "widgets" else load_view)(session)  # Held so it is not garbage collected
+    app.processEvents()
+    elapsed = time.perf_counter() - start
+    print(f"{variant:>8} {count:>8} {elapsed:>10.2f} {rss_mb() - baseline:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--variant", choices=["widgets", "view"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.messages)
+        return
+    print(f"{'variant':>8} {'messages':>8} {'load s':>10} {'+RSS MB':>10}")
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    for variant in ("widgets", "view"):
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.chat_transcript_load", "--messages", str(args.messages),
+             "--variant", variant],
+            env=env, check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Startup and persist cost of the JSON and SQLite docstore backends.
+
+For each corpus size the benchmark stores N nodes, then measures:
+
+* persist: write the store after adding 100 more nodes (an incremental ingest)
+* startup: open the persisted store and fetch one node by id
+* size: bytes on disk
+
+    python -m benchmarks.docstore_backends --sizes 1000 10000 100000
+"""
+import os
+import time
+import argparse
+import tempfile
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from sqlite_docstore import SQLiteKVStore, SQLiteDocumentStore
+
+INCREMENT = 100
+
+
+def make_nodes(count, start=0):
+    return [
+        TextNode(
+            id_=f"node-{i}",
+            text=f"Chunk {i} of the lecture notes. " + "Course material on supply and demand. " * 12,
+            metadata={"file_name": f"course-{i // 200}.pdf", "page_label": str(i % 200)},
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def bench_json(workdir, nodes, extra):
+    path = os.path.join(workdir, "docstore.json")
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    docstore.persist(path)
+
+    start = time.perf_counter()
+    docstore.add_documents(extra)
+    docstore.persist(path)
+    persist_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    SimpleDocumentStore.from_persist_path(path).get_node(nodes[len(nodes) // 2].node_id)
+    startup_ms = (time.perf_counter() - start) * 1000
+    return persist_ms, startup_ms, os.path.getsize(path)
+
+
+def bench_sqlite(workdir, nodes, extra):
+    path = os.path.join(workdir, "docstore.sqlite3")
+    kvstore = SQLiteKVStore(path)
+    docstore = SQLiteDocumentStore(kvstore)
+    docstore.add_documents(nodes)
+
+    start = time.perf_counter()
+    docstore.add_documents(extra)  # Written as it is added; persist() is a no-op
+    persist_ms = (time.perf_counter() - start) * 1000
+    kvstore.close()
+
+    start = time.perf_counter()
+    reopened = SQLiteKVStore(path)
+    SQLiteDocumentStore(reopened).get_node(nodes[len(nodes) // 2].node_id)
+    startup_ms = (time.perf_counter() - start) * 1000
+    reopened.close()
+    size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    return persist_ms, startup_ms, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'nodes':>8} {'backend':>8} {'persist ms':>11} {'startup ms':>11} {'size MB':>8}")
+    for size in args.sizes:
+        nodes = make_nodes(size)
+        extra = make_nodes(INCREMENT, start=size)
+        for backend, bench in (("json", bench_json), ("sqlite", bench_sqlite)):
+            with tempfile.TemporaryDirectory() as workdir:
+                persist_ms, startup_ms, size_bytes = bench(workdir, nodes, extra)
+            print(f"{size:>8} {backend:>8} {persist_ms:>11.1f} {startup_ms:>11.1f} {size_bytes / 1024 / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
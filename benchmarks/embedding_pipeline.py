@@ -0,0 +1,46 @@
+"""Chunks-per-second of the ingestion embedding pipeline against a stub server.
+
+    python -m benchmarks.embedding_pipeline --chunks 512 --latency 0.05
+"""
+import time
+import argparse
+import chromadb
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from embedding_pipeline import EmbeddingPipeline, InferenceAPIBatchEmbedding
+from benchmarks.stub_server import start_stub_server
+
+CONFIGURATIONS = [(1, 1), (32, 1), (32, 4), (32, 8), (64, 8)]  # (batch_size, max_in_flight)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub response latency in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Stub answers 429 above this")
+    args = parser.parse_args()
+
+    server, url = start_stub_server("embedding", args.latency, args.max_concurrency)
+    client = chromadb.EphemeralClient()
+
+    print(f"{'batch':>6} {'in_flight':>9} {'seconds':>8} {'chunks/s':>9}")
+    for batch_size, max_in_flight in CONFIGURATIONS:
+        collection = client.get_or_create_collection(f"bench_{batch_size}_{max_in_flight}")
+        embed_model = InferenceAPIBatchEmbedding(model_name=url, embed_batch_size=batch_size)
+        pipeline = EmbeddingPipeline(
+            embed_model, ChromaVectorStore(chroma_collection=collection),
+            batch_size=batch_size, max_in_flight=max_in_flight, backoff=0.05,
+        )
+        nodes = (TextNode(text=f"Synthetic chunk {i} about course material.") for i in range(args.chunks))
+
+        start = time.perf_counter()
+        pipeline.run(nodes)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>6} {max_in_flight:>9} {elapsed:>8.2f} {args.chunks / elapsed:>9.1f}")
+
+    print(f"stub requests: {server.requests}, rejected with 429: {server.rejected}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
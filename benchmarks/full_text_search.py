@@ -0,0 +1,94 @@
+"""Search-bar latency of the FTS5 index over chat sessions and document chunks.
+
+Builds an index of synthetic sessions (alternating questions and longer
+answers) plus document chunks, then times FullTextIndex.search for common,
+rare, multi-word and prefix (as-you-type) queries. Every match is ranked,
+so a word found in most messages costs the most; the GUI searches off its
+thread.
+
+Words are drawn from a Zipf distribution over ``--vocabulary`` words, with
+the domain words below as the most frequent ones. ``--vocabulary 0`` uses
+only those 50 words, a worst case in which every query word occurs in
+about one message in six.
+
+    python -m benchmarks.full_text_search --sessions 5000 --messages 40
+"""
+import os
+import time
+import random
+import itertools
+import argparse
+import tempfile
+import statistics
+from search_index import FullTextIndex
+
+WORDS = (
+    "market price product promotion place demand supply elasticity revenue cost margin segment brand "
+    "customer channel retail wholesale distribution strategy budget forecast growth share competitor "
+    "survey analysis consumer behaviour pricing discount loyalty campaign advertising digital social "
+    "media launch lifecycle innovation quality service value proposition positioning target research"
+).split()
+QUERIES = ["market", "price elasticity", "loyalty campaign digital", "promo", "positioning research value", "zebra"]
+
+
+def make_vocabulary(size):
+    """Return (words, cumulative weights): the domain words first, then filler words, weighted 1/rank."""
+    words = WORDS + [f"w{i}x" for i in range(max(0, size - len(WORDS)))]
+    if size == 0:
+        return words, None
+    return words, list(itertools.accumulate(1.0 / rank for rank in range(1, len(words) + 1)))
+
+
+def make_text(rng, vocabulary, count):
+    words, cum_weights = vocabulary
+    return " ".join(rng.choices(words, cum_weights=cum_weights, k=count)).capitalize() + "."
+
+
+def build(index, sessions, messages, chunks, rng, vocabulary):
+    for session in range(sessions):
+        entries = [
+            (position, "user" if position % 2 == 0 else "model",
+             make_text(rng, vocabulary, 12 if position % 2 == 0 else 80))
+            for position in range(messages)
+        ]
+        index.index_session(f"chat_{session:06d}", entries, size=0)
+    for start in range(0, chunks, 1000):
+        index.add_chunks(
+            (f"node-{i}", f"course-{i // 200}.pdf", make_text(rng, vocabulary, 120))
+            for i in range(start, min(start + 1000, chunks))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=40, help="Messages per session")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--vocabulary", type=int, default=20000, help="Distinct words; 0 = the 50 domain words only")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        index = FullTextIndex(os.path.join(workdir, "search_index.sqlite3"))
+        start = time.perf_counter()
+        build(index, args.sessions, args.messages, args.chunks, rng, make_vocabulary(args.vocabulary))
+        print(f"Indexed {args.sessions * args.messages} messages and {args.chunks} chunks "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        print(f"{'query':>28} {'results':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                results = index.search(query, limit=args.limit)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{query:>28} {len(results):>8} {statistics.median(timings):>8.1f} {p95:>8.1f} {timings[-1]:>8.1f}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
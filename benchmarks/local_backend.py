@@ -0,0 +1,84 @@
+"""Latency and throughput of the local (llama.cpp) backend against a stubbed remote backend.
+
+The remote side is the Hugging Face Inference API client pointed at the stub
+server, so it pays a simulated round trip per request. The local side runs
+GGUF weights in-process; pass the files to compare against:
+
+    python -m benchmarks.local_backend --embedding-model models/bge-small-en-v1.5-q8_0.gguf \\
+        --llm-model models/qwen2.5-0.5b-instruct-q4_k_m.gguf --threads 4 --latency 0.15
+"""
+import time
+import argparse
+import statistics
+from llama_index.llms.huggingface_api import HuggingFaceInferenceAPI
+from embedding_pipeline import InferenceAPIBatchEmbedding
+from local_models import LocalEmbedding, LocalLLM
+from benchmarks.stub_server import start_stub_server
+
+QUESTIONS = [
+    "What is the product marketing mix?",
+    "How is the final exam weighted?",
+    "Explain supply and demand with an example.",
+    "When is the assignment deadline?",
+    "What does the syllabus say about late submissions?",
+]
+
+
+def bench_embedding(name, embed_model, texts, batch_size):
+    latencies = []
+    for question in QUESTIONS * 4:
+        start = time.perf_counter()
+        embed_model.get_query_embedding(question)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        embed_model.get_text_embedding_batch(texts[offset:offset + batch_size])
+    throughput = len(texts) / (time.perf_counter() - start)
+    print(f"{name:>18} {statistics.median(latencies):>10.1f} {max(latencies):>10.1f} {throughput:>12.1f}")
+
+
+def bench_llm(name, llm):
+    latencies = []
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        llm.complete(f"Answer in one sentence. {question}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"{name:>18} {statistics.median(latencies):>10.1f} {max(latencies):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedding-model", help="Local GGUF embedding weights")
+    parser.add_argument("--llm-model", help="Local GGUF generative weights")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for the local backend")
+    parser.add_argument("--latency", type=float, default=0.15, help="Stub round-trip latency in seconds")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    texts = [f"Chunk {i}: lecture notes on pricing, promotion, place and product." for i in range(args.texts)]
+
+    embedding_server, embedding_url = start_stub_server("embedding", args.latency)
+    print(f"{'embedding':>18} {'query p50':>10} {'query max':>10} {'texts/s':>12}")
+    bench_embedding(
+        "remote (stub)", InferenceAPIBatchEmbedding(model_name=embedding_url, embed_batch_size=args.batch_size),
+        texts, args.batch_size,
+    )
+    if args.embedding_model:
+        bench_embedding(
+            "local", LocalEmbedding(args.embedding_model, n_threads=args.threads, embed_batch_size=args.batch_size),
+            texts, args.batch_size,
+        )
+    embedding_server.shutdown()
+
+    generation_server, generation_url = start_stub_server("generation", args.latency)
+    print(f"\n{'generation':>18} {'p50 ms':>10} {'max ms':>10}")
+    bench_llm("remote (stub)", HuggingFaceInferenceAPI(model_name=generation_url))
+    if args.llm_model:
+        bench_llm("local", LocalLLM(args.llm_model, n_threads=args.threads, max_new_tokens=64))
+    generation_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
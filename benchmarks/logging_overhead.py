@@ -0,0 +1,69 @@
+"""Caller-thread cost per log message: the old synchronous FileHandler vs the queued pipeline.
+
+The GUI thread pays whatever logging costs in the calling thread, so this
+times only the logging call itself, for a short status line and for a
+full-response-sized payload.
+
+    python -m benchmarks.logging_overhead --messages 20000
+"""
+import os
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+from log_pipeline import setup_logging, stop_logging, LOG_FORMAT
+
+PAYLOADS = {
+    "short": "Adding message from user",
+    "response": "The marketing mix consists of product, price, place and promotion. " * 60,  # ~4 KB
+}
+
+
+def setup_sync(path):
+    """The previous configuration: root at DEBUG with a synchronous FileHandler."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+def time_calls(messages, payload, level):
+    logger = logging.getLogger("bench")
+    timings = []
+    for i in range(messages):
+        start = time.perf_counter()
+        logger.log(level, f"Handling response {i}: {payload}")
+        timings.append((time.perf_counter() - start) * 1e6)
+    return statistics.mean(timings), statistics.quantiles(timings, n=100)[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'setup':>22} {'payload':>9} {'mean us':>9} {'p99 us':>9}")
+        for name, payload in PAYLOADS.items():
+            setup_sync(os.path.join(workdir, "sync.log"))
+            mean, p99 = time_calls(args.messages, payload, logging.DEBUG)
+            print(f"{'sync FileHandler':>22} {name:>9} {mean:>9.1f} {p99:>9.1f}")
+
+            # Rate limiting is off so every record still reaches the queue
+            setup_logging(os.path.join(workdir, "queued.log"), level="DEBUG", rate_limit=0, console=False)
+            mean, p99 = time_calls(args.messages, payload, logging.DEBUG)
+            print(f"{'queued (DEBUG)':>22} {name:>9} {mean:>9.1f} {p99:>9.1f}")
+
+            setup_logging(os.path.join(workdir, "queued.log"), level="INFO", console=False)
+            mean, p99 = time_calls(args.messages, payload, logging.DEBUG)
+            print(f"{'queued, INFO default':>22} {name:>9} {mean:>9.1f} {p99:>9.1f}")
+            stop_logging()
+
+
+if __name__ == "__main__":
+    main()
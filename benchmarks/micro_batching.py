@@ -0,0 +1,108 @@
+"""Throughput of concurrent query embeddings and generations with and without micro-batching.
+
+Each of ``--threads`` callers embeds a different question as soon as its
+previous one returns, against a stub embedding endpoint that takes
+``--embed-latency`` seconds per request whatever its size and rejects
+requests over ``--max-concurrency`` with 429. "direct" sends a request per
+query; "batched N ms" collects the queries arriving within N ms into one.
+The LLM runs compare the plain client with CoalescingLLM on prompts drawn
+from ``--pool`` questions, so identical concurrent prompts share a call:
+
+    python -m benchmarks.micro_batching --threads 32 --duration 5
+"""
+import time
+import random
+import argparse
+import threading
+from llama_index.embeddings.huggingface_api import HuggingFaceInferenceAPIEmbedding
+from llama_index.llms.huggingface_api import HuggingFaceInferenceAPI
+from benchmarks.stub_server import start_stub_server
+from micro_batching import BatchedEmbedding, CoalescingLLM, hf_query_embedder
+
+
+def run(call, threads, duration, pool):
+    """Call ``call(text)`` from ``threads`` threads for ``duration`` seconds; return (latencies, errors, elapsed)."""
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker(index):
+        rng = random.Random(index)
+        i = 0
+        while time.perf_counter() < deadline:
+            question = rng.randrange(pool) if pool else f"{index}-{i}"
+            i += 1
+            started = time.perf_counter()
+            try:
+                call(f"Question {question}: how is the final exam weighted?")
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+
+def report(label, stub, requests_before, latencies, errors, elapsed, extra=""):
+    latencies = [seconds * 1000 for seconds in latencies]
+    print(f"{label:>15} {len(latencies) / elapsed:>8.1f} {percentile(latencies, 0.5):>8.1f} "
+          f"{percentile(latencies, 0.95):>8.1f} {stub.requests - requests_before:>9} {len(errors):>7}  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Stub embedding latency in seconds")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub LLM latency in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Requests the stubs serve at once")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--pool", type=int, default=8, help="Distinct prompts of the LLM runs")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    embedding_stub, embedding_url = start_stub_server("embedding", args.embed_latency, args.max_concurrency)
+    generation_stub, generation_url = start_stub_server("generation", args.latency, args.max_concurrency)
+    try:
+        print(f"{args.threads} threads, {args.duration:g} s per run, stubs serve {args.max_concurrency} at once")
+        print(f"{'run':>15} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'requests':>9} {'errors':>7}")
+
+        embed_model = HuggingFaceInferenceAPIEmbedding(model_name=embedding_url, timeout=30)
+        runs = [("direct", embed_model)]
+        for window in (10, 20):
+            batched = BatchedEmbedding(
+                embed_model, hf_query_embedder(embed_model, timeout=30),
+                max_batch_size=args.batch_size, max_wait_ms=window,
+            )
+            runs.append((f"batched {window} ms", batched))
+        for label, model in runs:
+            before = embedding_stub.requests
+            latencies, errors, elapsed = run(model.get_query_embedding, args.threads, args.duration, 0)
+            extra = f"mean batch {model.batch_stats()['mean_batch']:.1f}" if isinstance(model, BatchedEmbedding) else ""
+            report(label, embedding_stub, before, latencies, errors, elapsed, extra)
+
+        llm = HuggingFaceInferenceAPI(model_name=generation_url, timeout=30)
+        coalescing = CoalescingLLM(llm, max_in_flight=args.llm_concurrency)
+        for label, model in (("direct LLM", llm), ("coalescing LLM", coalescing)):
+            before = generation_stub.requests
+            latencies, errors, elapsed = run(model.complete, args.threads, args.duration, args.pool)
+            extra = f"shared {model.shared_calls}" if model is coalescing else ""
+            report(label, generation_stub, before, latencies, errors, elapsed, extra)
+    finally:
+        embedding_stub.shutdown()
+        generation_stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
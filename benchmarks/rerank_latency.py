@@ -0,0 +1,125 @@
+"""Net latency of two-stage retrieval: rerank a wide pool and send fewer chunks vs stuffing the top-k.
+
+"top-k" sends the ``--top-k`` first candidates to the LLM, like a plain
+vector query with a large top-k. "rerank" scores ``--candidates`` chunks
+with the cross-encoder and sends the best ``--top-n`` that fit
+``--token-budget``; "rerank (cached)" repeats the questions so the scores
+come from the (query hash, node id) cache. Every prompt gets the same
+number of new tokens, so the difference is prompt processing plus the
+rerank step.
+
+With ``--llm-model`` the LLM runs in-process:
+
+    python -m benchmarks.rerank_latency --llm-model models/qwen2.5-0.5b-instruct-q4_k_m.gguf --threads 4
+
+Without it, the Inference API client calls the stub server, which answers
+after ``--latency`` seconds plus ``--ms-per-prompt-token`` for each prompt
+token, a stand-in for an endpoint whose prompt processing is the cost:
+
+    python -m benchmarks.rerank_latency --ms-per-prompt-token 1.0
+"""
+import time
+import random
+import argparse
+import statistics
+from llama_index.core import Settings
+from llama_index.core.schema import TextNode, NodeWithScore, MetadataMode
+from llama_index.llms.huggingface_api import HuggingFaceInferenceAPI
+from local_models import LocalLLM
+from reranker import CrossEncoderReranker, RerankScoreCache, load_cross_encoder, DEFAULT_RERANK_MODEL
+from role_profiles import STUDENT_QA_TEMPLATE
+from benchmarks.stub_server import start_stub_server
+
+QUESTIONS = [
+    "What is the product marketing mix?",
+    "How is the final exam weighted?",
+    "Explain supply and demand with an example.",
+    "When is the assignment deadline?",
+    "What does the syllabus say about late submissions?",
+]
+SENTENCES = [
+    "The marketing mix combines product, price, place and promotion.",
+    "The final exam counts for forty percent of the course grade.",
+    "When prices rise, the quantity demanded usually falls while supply increases.",
+    "Assignments are due at noon on the Friday of week ten.",
+    "Late submissions lose ten percent per day unless an extension was approved.",
+    "Lectures are recorded and posted on the course page within a day.",
+]
+
+
+def make_candidates(count, words, rng):
+    nodes = []
+    for i in range(count):
+        text = []
+        while len(" ".join(text).split()) < words:
+            text.append(rng.choice(SENTENCES))
+        nodes.append(NodeWithScore(node=TextNode(id_=f"node-{i}", text=" ".join(text)), score=1.0 - i / count))
+    return nodes
+
+
+def count_tokens(text):
+    return len(Settings.tokenizer(text))
+
+
+def answer(llm, question, nodes):
+    context = "\n\n".join(result.node.get_content(metadata_mode=MetadataMode.LLM) for result in nodes)
+    prompt = STUDENT_QA_TEMPLATE.format(context_str=context, query_str=question)
+    start = time.perf_counter()
+    llm.complete(prompt)
+    return count_tokens(prompt), (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-model", help="GGUF file for the in-process LLM; omitted: the stub server")
+    parser.add_argument("--rerank-model", default=DEFAULT_RERANK_MODEL)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--candidates", type=int, default=30)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--top-n", type=int, default=4)
+    parser.add_argument("--token-budget", type=int, default=1500)
+    parser.add_argument("--chunk-words", type=int, default=350, help="About a 512-token chunk")
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub seconds per answer, besides the prompt")
+    parser.add_argument("--ms-per-prompt-token", type=float, default=1.0, help="Stub prompt processing time")
+    args = parser.parse_args()
+
+    stub = None
+    if args.llm_model:
+        # Ten 512-token chunks do not fit the default 4096-token window
+        llm = LocalLLM(args.llm_model, n_threads=args.threads, context_window=8192, max_new_tokens=args.new_tokens,
+                       temperature=0.0)
+    else:
+        stub, url = start_stub_server("generation", args.latency, latency_per_token=args.ms_per_prompt_token / 1000,
+                                      count_tokens=count_tokens)
+        llm = HuggingFaceInferenceAPI(model_name=url, num_output=args.new_tokens, timeout=120)
+    reranker = CrossEncoderReranker(
+        load_cross_encoder(args.rerank_model), RerankScoreCache(), count_tokens,
+        model_name=args.rerank_model, top_n=args.top_n, token_budget=args.token_budget,
+    )
+    llm.complete("Warm up.")
+
+    rows = {"top-k": [], "rerank": [], "rerank (cached)": []}
+    for variant in rows:
+        for question in QUESTIONS:
+            # Every variant sees the same candidates for a question
+            candidates = make_candidates(args.candidates, args.chunk_words, random.Random(QUESTIONS.index(question)))
+            start = time.perf_counter()
+            if variant == "top-k":
+                nodes = candidates[:args.top_k]
+            else:
+                nodes = reranker.postprocess_nodes(candidates, query_str=question)
+            rerank_ms = (time.perf_counter() - start) * 1000
+            prompt_tokens, llm_ms = answer(llm, question, nodes)
+            rows[variant].append((len(nodes), prompt_tokens, rerank_ms, llm_ms))
+
+    print(f"{'variant':>16} {'chunks':>7} {'prompt tok':>11} {'rerank ms':>10} {'LLM ms':>9} {'total ms':>9}")
+    for variant, results in rows.items():
+        chunks, tokens, rerank_ms, llm_ms = (statistics.median(column) for column in zip(*results))
+        print(f"{variant:>16} {chunks:>7.0f} {tokens:>11.0f} {rerank_ms:>10.1f} {llm_ms:>9.1f} {rerank_ms + llm_ms:>9.1f}")
+    if stub is not None:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Latency and recall@k of vector, keyword and hybrid retrieval on a fixed query set.
+
+Builds a synthetic course corpus in a temporary Chroma collection, with
+embeddings served by the stub server (so vector search pays a round trip).
+
+    python -m benchmarks.retrieval_modes --latency 0.05 --top-k 5
+"""
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import chromadb
+from llama_index.core import VectorStoreIndex, StorageContext
+from llama_index.core.schema import TextNode, QueryBundle
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from embedding_pipeline import InferenceAPIBatchEmbedding
+from keyword_index import BM25Index, KeywordRetriever, HybridRetriever
+from benchmarks.stub_server import start_stub_server
+
+TOPICS = ["marketing mix", "supply and demand", "linear regression", "cell biology", "contract law",
+          "thermodynamics", "data structures", "organic chemistry", "macroeconomics", "statistics"]
+
+
+def build_corpus(chunks_per_course, courses=40, seed=7):
+    """Synthetic chunks; each course has a code such as MKT1203 mentioned in one chunk."""
+    rng = random.Random(seed)
+    nodes, queries = [], []
+    for course in range(courses):
+        topic = TOPICS[course % len(TOPICS)]
+        code = f"{topic[:3].upper()}{1000 + course}"
+        for chunk in range(chunks_per_course):
+            filler = " ".join(rng.choice(TOPICS) for _ in range(12))
+            text = f"Lecture {chunk} on {topic}. {filler}."
+            if chunk == 0:
+                text = f"Course {code} syllabus: assessment and schedule for {topic}. {filler}."
+            node = TextNode(text=text, metadata={"file_name": f"{code}.pdf"})
+            nodes.append(node)
+            if chunk == 0:
+                queries.append((f"When is the assessment for {code}?", node.node_id))
+    return nodes, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks-per-course", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub embedding latency in seconds")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    server, url = start_stub_server("embedding", args.latency)
+    embed_model = InferenceAPIBatchEmbedding(model_name=url, embed_batch_size=64)
+    nodes, queries = build_corpus(args.chunks_per_course)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        collection = chromadb.PersistentClient(workdir).get_or_create_collection("bench")
+        vector_store = ChromaVectorStore(chroma_collection=collection)
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+        keyword_index = BM25Index(f"{workdir}/keyword_index.sqlite3")
+        keyword_index.add_nodes(nodes)
+
+        vector = index.as_retriever(similarity_top_k=args.top_k, embed_model=embed_model)
+        keyword = KeywordRetriever(keyword_index, collection, similarity_top_k=args.top_k)
+        retrievers = {
+            "vector": vector,
+            "keyword": keyword,
+            "hybrid": HybridRetriever([vector, keyword], similarity_top_k=args.top_k),
+        }
+
+        print(f"{len(nodes)} chunks, {len(queries)} queries, top_k={args.top_k}")
+        print(f"{'mode':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+        for mode, retriever in retrievers.items():
+            latencies, hits = [], 0
+            for query, expected_id in queries:
+                start = time.perf_counter()
+                results = retriever.retrieve(QueryBundle(query_str=query))
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += any(result.node.node_id == expected_id for result in results)
+            p95 = statistics.quantiles(latencies, n=20)[18]
+            print(f"{mode:>8} {statistics.median(latencies):>8.1f} {p95:>8.1f} {hits / len(queries):>9.2f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Throughput and tail latency of the headless RAG server under concurrent clients.
+
+Starts stub servers for embeddings and generation, then ``serve`` in a
+temporary directory with a small synthetic corpus. Each client keeps one
+connection open and sends its next question as soon as the previous answer
+arrives. "unique" sends a different question every time; "repeated" draws
+from ``--pool`` questions, so identical concurrent queries share one answer
+and later ones hit the answer cache:
+
+    python -m benchmarks.server_load --clients 32 --duration 10 --latency 0.2
+    python -m benchmarks.server_load --stream --rate-limit 60    # per-client 429s
+    python -m benchmarks.server_load --url http://127.0.0.1:8765  # an already running server
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.request
+from collections import Counter
+from urllib.parse import urlsplit
+import yaml
+from benchmarks.stub_server import start_stub_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENTENCES = [
+    "The marketing mix combines product, price, place and promotion.",
+    "The final exam counts for forty percent of the course grade.",
+    "When prices rise, the quantity demanded usually falls while supply increases.",
+    "Assignments are due at noon on the Friday of week ten.",
+    "Late submissions lose ten percent per day unless an extension was approved.",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def start_server(workdir, embedding_url, generation_url, rate_limit, workers, documents):
+    """Write a config and corpus into workdir and start ``serve`` there; return (process, url)."""
+    config = dict(
+        API_TOKEN="", EMBEDDING_MODEL=embedding_url, LLM_MODEL=generation_url, TRACING=False, LOG_LEVEL="WARNING",
+        SERVER_CLIENT_HEADER="X-Client-Id", SERVER_RATE_LIMIT=rate_limit, SERVER_RATE_BURST=10,
+        SERVER_QUERY_WORKERS=workers, SERVER_QUERY_QUEUE_SIZE=1024,
+    )
+    with open(os.path.join(workdir, "config.yaml"), "w") as file:
+        yaml.safe_dump(config, file)
+    os.makedirs(os.path.join(workdir, "documents"))
+    rng = random.Random(3)
+    for i in range(documents):
+        with open(os.path.join(workdir, "documents", f"course_{i}.txt"), "w") as file:
+            file.write(" ".join(rng.choice(SENTENCES) for _ in range(200)))
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "serve", "--config", "config.yaml", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if get_json(url + "/health")["ready"]:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become ready")
+
+
+async def post(reader, writer, host, path, payload, client_id):
+    """Send one keep-alive POST; return (status, seconds to the first body chunk)."""
+    body = json.dumps(payload).encode("utf-8")
+    start = time.perf_counter()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nX-Client-Id: {client_id}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    first_chunk = None
+    if headers.get("transfer-encoding") == "chunked":
+        while (size := int((await reader.readline()).strip(), 16)) > 0:
+            await reader.readexactly(size + 2)
+            first_chunk = first_chunk or time.perf_counter() - start
+        await reader.readline()
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, first_chunk
+
+
+async def client(url, client_id, args, deadline, results):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+    rng = random.Random(client_id)
+    path = "/query/stream" if args.stream else "/query"
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            if args.pool:
+                prompt = f"Question {rng.randrange(args.pool)}: how is the final exam weighted?"
+            else:
+                prompt = f"Question {client_id}-{i}: how is the final exam weighted?"
+            i += 1
+            start = time.perf_counter()
+            status, first_chunk = await post(
+                reader, writer, parts.netloc, path, {"prompt": prompt, "role": "Student"}, f"client-{client_id}"
+            )
+            results.append((status, time.perf_counter() - start, first_chunk))
+            if status == 429:
+                await asyncio.sleep(0.1)
+    finally:
+        writer.close()
+
+
+async def run_load(url, args):
+    results = []
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(client(url, i, args, deadline, results) for i in range(args.clients)))
+    return results, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+
+def report(label, results, elapsed):
+    statuses = Counter(status for status, _, _ in results)
+    latencies = [seconds * 1000 for status, seconds, _ in results if status == 200]
+    first_chunks = [first * 1000 for status, _, first in results if status == 200 and first is not None]
+    print(f"{label:>9} {len(latencies) / elapsed:>7.1f} {percentile(latencies, 0.5):>8.1f} "
+          f"{percentile(latencies, 0.95):>8.1f} {percentile(latencies, 0.99):>8.1f} "
+          f"{(statistics.median(first_chunks) if first_chunks else float('nan')):>9.1f}  "
+          f"{dict(sorted(statuses.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Load an already running server instead of starting one")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub LLM latency in seconds")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Stub embedding latency in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="SERVER_QUERY_WORKERS of the started server")
+    parser.add_argument("--rate-limit", type=int, default=0, help="SERVER_RATE_LIMIT per client, 0 = off")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pool", type=int, default=8, help="Distinct questions of the repeated run")
+    parser.add_argument("--stream", action="store_true", help="Use /query/stream and report time to first token")
+    args = parser.parse_args()
+
+    process = None
+    stubs = []
+    url = args.url
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if url is None:
+                embedding_stub, embedding_url = start_stub_server("embedding", args.embed_latency)
+                generation_stub, generation_url = start_stub_server("generation", args.latency)
+                stubs = [embedding_stub, generation_stub]
+                process, url = start_server(
+                    workdir, embedding_url, generation_url, args.rate_limit, args.workers, args.documents
+                )
+
+            print(f"{args.clients} clients, {args.duration:g} s per run, {'streaming' if args.stream else 'blocking'}")
+            print(f"{'questions':>9} {'QPS':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'first ms':>9}  statuses")
+            pool = args.pool
+            for label, args.pool in (("unique", 0), ("repeated", pool)):
+                results, elapsed = asyncio.run(run_load(url, args))
+                report(label, results, elapsed)
+            health = get_json(url + "/health")
+            print(f"Identical queries answered by an in-flight query: {health['coalesced_queries']}")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+            for stub in stubs:
+                stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
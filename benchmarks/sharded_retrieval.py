@@ -0,0 +1,142 @@
+"""Build time and query latency of sharded collections against one collection holding everything.
+
+Embeds ``--shards`` shards of ``--vectors`` chunks (``--documents``
+documents each) through the ingestion pipeline, first one shard at a time
+and then ``--workers`` at a time, against an embedding model that waits
+``--embed-latency`` seconds per batch like a remote endpoint. The same
+vectors also go into one unsharded collection. Queries then search the
+unsharded collection, every shard (merged by score), one shard, and one
+document of a shard (metadata pre-filter):
+
+    python -m benchmarks.sharded_retrieval --shards 8 --vectors 5000 --workers 4
+"""
+import time
+import zlib
+import argparse
+import tempfile
+import statistics
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import chromadb
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import TextNode, QueryBundle
+from embedding_pipeline import EmbeddingPipeline
+from shards import Shard, ShardedRetriever
+
+BATCH_SIZE = 5000  # Below Chroma's maximum batch size
+
+
+class SlowRandomEmbedding(BaseEmbedding):
+    """Deterministic random unit vectors, returned after a fixed per-request latency."""
+
+    dim: int = 384
+    latency: float = 0.05
+
+    def _vectors(self, texts):
+        time.sleep(self.latency)
+        vectors = np.stack([
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dim) for text in texts
+        ])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._vectors(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vectors([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vectors([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+
+def make_nodes(shard, count, documents):
+    return [
+        TextNode(id_=f"{shard}-{i}", text=f"Chunk {i} of {shard}", metadata={"file_name": f"{shard}/document_{i % documents}.pdf"})
+        for i in range(count)
+    ]
+
+
+def build(client, prefix, args, embed_model, workers):
+    """Embed and index every shard, ``workers`` shards at a time; return (shards, seconds)."""
+    def build_one(name):
+        shard = Shard(client, f"{prefix}{name}", f"{client_dir}/{prefix}{name}.keyword.sqlite3")
+        pipeline = EmbeddingPipeline(
+            embed_model, shard.vector_store, batch_size=64, max_in_flight=2, on_batch=shard.keyword_index.add_nodes
+        )
+        pipeline.run(make_nodes(name, args.vectors, args.documents))
+        return shard
+
+    client_dir = client.get_settings().persist_directory
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        shards = list(pool.map(build_one, [f"course{i}" for i in range(args.shards)]))
+    return shards, time.perf_counter() - start
+
+
+def time_queries(retriever, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.retrieve(QueryBundle(query_str="", embedding=query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--vectors", type=int, default=5000, help="Chunks per shard")
+    parser.add_argument("--documents", type=int, default=50, help="Documents per shard")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--workers", type=int, default=4, help="Shards built at once in the parallel build")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    embed_model = SlowRandomEmbedding(dim=args.dim, latency=args.embed_latency)
+    Settings.embed_model = embed_model  # Queries carry their embedding, so it is never called for them
+    queries = np.random.default_rng(7).standard_normal((args.queries, args.dim)).tolist()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        client = chromadb.PersistentClient(workdir)
+        print(f"{args.shards} shards x {args.vectors} chunks, dim {args.dim}, {args.embed_latency * 1000:g} ms per batch")
+        _, sequential = build(client, "seq_", args, embed_model, 1)
+        shards, parallel = build(client, "par_", args, embed_model, args.workers)
+        print(f"Build: {sequential:.1f} s one shard at a time, {parallel:.1f} s with {args.workers} workers")
+
+        unsharded = Shard(client, "all", f"{workdir}/all.keyword.sqlite3")
+        for shard in shards:
+            stored = shard.collection.get(include=["embeddings", "documents", "metadatas"])
+            for start in range(0, len(stored["ids"]), BATCH_SIZE):
+                end = start + BATCH_SIZE
+                unsharded.collection.add(
+                    ids=stored["ids"][start:end], embeddings=stored["embeddings"][start:end],
+                    documents=stored["documents"][start:end], metadatas=stored["metadatas"][start:end],
+                )
+
+        first = shards[0]
+        document = "course0/document_0.pdf"
+        runs = [
+            ("unsharded", unsharded.vector_retriever(args.top_k), unsharded.count()),
+            ("all shards", ShardedRetriever([shard.vector_retriever(args.top_k) for shard in shards], args.top_k),
+             sum(shard.count() for shard in shards)),
+            ("one shard", first.vector_retriever(args.top_k), first.count()),
+            ("one document", first.vector_retriever(args.top_k, file_name=document),
+             args.vectors // args.documents),
+        ]
+        print(f"{'scope':>13} {'vectors':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for label, retriever, searched in runs:
+            retriever.retrieve(QueryBundle(query_str="", embedding=queries[0]))  # Load the HNSW index
+            p50, p95 = time_queries(retriever, queries)
+            print(f"{label:>13} {searched:>9} {p50:>8.2f} {p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Peak-RSS check for streaming ingestion of a very large text file.
+
+Writes a synthetic text file of --size-mb, streams it through the
+SentenceSplitter and the embedding pipeline into a temporary Chroma
+collection (with a small mock embedding, so only ingestion memory is
+measured), and fails if peak RSS grew by more than --budget-mb.
+
+    python -m benchmarks.streaming_ingest_memory --size-mb 300 --budget-mb 256
+"""
+import sys
+import time
+import random
+import resource
+import argparse
+import tempfile
+import chromadb
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from embedding_pipeline import EmbeddingPipeline, iter_nodes
+from streaming_reader import iter_file_documents, block_chars_for_budget
+
+WORDS = "course lecture student marketing mix price product place promotion demand supply model data".split()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def write_synthetic_file(path, size_mb, seed=1):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as file:
+        while written < target:
+            line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) + ".\n"
+            block = line * 1000
+            file.write(block)
+            written += len(block)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=300)
+    parser.add_argument("--budget-mb", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = f"{workdir}/large.txt"
+        write_synthetic_file(path, args.size_mb)
+        collection = chromadb.PersistentClient(f"{workdir}/db").get_or_create_collection("bench")
+        pipeline = EmbeddingPipeline(MockEmbedding(embed_dim=8), ChromaVectorStore(chroma_collection=collection))
+        splitter = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=10)
+
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        documents = iter_file_documents(path, block_chars_for_budget(args.budget_mb))
+        node_ids = pipeline.run(iter_nodes(documents, splitter))
+        elapsed = time.perf_counter() - start
+        growth = peak_rss_mb() - baseline
+
+    print(f"{args.size_mb} MB file -> {len(node_ids)} chunks in {elapsed:.1f}s")
+    print(f"peak RSS growth: {growth:.0f} MB (budget {args.budget_mb} MB)")
+    if growth > args.budget_mb:
+        print("FAIL: peak RSS exceeded the memory budget")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Local stand-in for the Hugging Face Inference API used by the benchmarks.
+
+Run from the repository root, e.g. ``python -m benchmarks.embedding_pipeline``.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 384
+
+
+def stub_embedding(text, dim=EMBEDDING_DIM):
+    """Deterministic pseudo-random unit vector for a piece of text."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+def stub_generation(prompt):
+    """Deterministic short answer for a prompt."""
+    return f"Stub answer {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}."
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Listen backlog; the default of 5 drops connections under concurrent load
+
+    def __init__(self, address, kind, latency, max_concurrency, latency_per_token=0.0, count_tokens=None):
+        super().__init__(address, StubHandler)
+        self.kind = kind
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+        self.latency_per_token = latency_per_token
+        self.count_tokens = count_tokens or (lambda text: len(text.split()))
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def prompt_delay(self, prompt):
+        """Seconds spent reading a generation prompt: ``latency_per_token`` for each of its tokens."""
+        if not self.latency_per_token or not isinstance(prompt, str):
+            return 0.0
+        return self.latency_per_token * self.count_tokens(prompt)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, text, latency, chat):
+        """Send the answer as server-sent events, one word per event, in text-generation or chat format."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(latency / len(words))
+            last = i == len(words) - 1
+            delta = word if last else word + " "
+            if chat:
+                event = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                    "system_fingerprint": "stub",
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": delta},
+                                 "finish_reason": "stop" if last else None}],
+                }
+            else:
+                event = {
+                    "index": i,
+                    "token": {"id": i, "text": delta, "logprob": 0.0, "special": False},
+                    "generated_text": text if last else None,
+                    "details": None,
+                }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if chat:
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server.lock:
+            server.requests += 1
+            if server.max_concurrency and server.in_flight >= server.max_concurrency:
+                server.rejected += 1
+                self._send_json(429, {"error": "Too Many Requests"})
+                return
+            server.in_flight += 1
+        try:
+            # Chat models are called through the OpenAI-style chat completions route
+            chat = self.path.endswith("/chat/completions")
+            inputs = payload["messages"][-1]["content"] if chat else payload.get("inputs", "")
+            if server.kind == "generation":
+                time.sleep(server.prompt_delay(inputs))
+            if server.kind == "generation" and payload.get("stream"):
+                self._send_stream(stub_generation(inputs), server.latency, chat)
+                return
+            time.sleep(server.latency)
+            if chat:
+                self._send_json(200, {
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                    "system_fingerprint": "stub",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": stub_generation(inputs)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+            elif server.kind == "embedding":
+                if isinstance(inputs, list):
+                    self._send_json(200, [stub_embedding(text) for text in inputs])
+                else:
+                    self._send_json(200, stub_embedding(inputs))
+            else:
+                self._send_json(200, [{"generated_text": stub_generation(inputs)}])
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def start_stub_server(kind="embedding", latency=0.05, max_concurrency=None, latency_per_token=0.0, count_tokens=None):
+    """Start a stub server on a free local port; return (server, url).
+
+    A generation server also waits ``latency_per_token`` seconds per prompt
+    token, counted with ``count_tokens`` (whitespace words by default).
+    """
+    server = StubServer(("127.0.0.1", 0), kind, latency, max_concurrency, latency_per_token, count_tokens)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
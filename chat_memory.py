@@ -0,0 +1,139 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CONDENSE_PROMPT = (
+    "Rewrite the follow-up question as a standalone question that can be understood without the conversation. "
+    "Keep the names, terms and numbers it refers to. Reply with the question only.\n"
+    "Conversation summary:\n{summary}\n"
+    "Recent turns:\n{turns}\n"
+    "Follow-up question: {question}\n"
+    "Standalone question: "
+)
+
+SUMMARY_PROMPT = (
+    "Update the summary of a conversation about course material with the turns below. Keep the topics, "
+    "facts and definitions the user may refer back to, in at most {words} words.\n"
+    "Current summary:\n{summary}\n"
+    "New turns:\n{turns}\n"
+    "Updated summary: "
+)
+
+# Older turns of every conversation are summarized one at a time, off the query threads
+_summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+
+
+def format_turns(turns):
+    return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer, _ in turns)
+
+
+def truncate_to_tokens(text, max_tokens, count_tokens):
+    """Cut ``text`` to at most ``max_tokens`` tokens, keeping its beginning."""
+    tokens = count_tokens(text)
+    while tokens > max_tokens and text:
+        text = text[:max(0, int(len(text) * max_tokens / tokens) - 1)]
+        tokens = count_tokens(text)
+    return text
+
+
+class ChatMemory:
+    """Memory of one conversation that stays within a token budget.
+
+    The newest turns are kept verbatim within ``token_budget - summary_tokens``
+    tokens. Older turns are folded into a running summary of at most
+    ``summary_tokens`` by ``complete`` on a background thread, so answering
+    a question never waits for it. ``complete`` takes a prompt and returns
+    the LLM's text; ``count_tokens`` returns the token count of a text.
+    """
+
+    def __init__(self, complete, count_tokens, token_budget=1500, summary_tokens=300, executor=None):
+        self.complete = complete
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget // 2)
+        self.executor = executor or _summarizer
+        self.summary = ""
+        self.turns = []  # (question, answer, tokens), oldest first
+        self._pending = []  # Turns dropped from ``turns`` that are waiting to be summarized
+        self._summarizing = None  # Future of the running summary update
+        self._lock = threading.Lock()
+
+    @property
+    def turn_budget(self):
+        return self.token_budget - self.summary_tokens
+
+    def _make_turn(self, question, answer):
+        # A single turn (e.g. a pasted document) may not take more than the whole turn budget
+        question = truncate_to_tokens(question, self.turn_budget // 4, self.count_tokens)
+        answer = truncate_to_tokens(answer, self.turn_budget - self.count_tokens(question), self.count_tokens)
+        return question, answer, self.count_tokens(format_turns([(question, answer, 0)]))
+
+    def add_turn(self, question, answer):
+        """Remember a finished turn; turns that no longer fit are summarized in the background."""
+        turn = self._make_turn(question, answer)
+        with self._lock:
+            self.turns.append(turn)
+            total = sum(tokens for _, _, tokens in self.turns)
+            while total > self.turn_budget and len(self.turns) > 1:
+                evicted = self.turns.pop(0)
+                total -= evicted[2]
+                self._pending.append(evicted)
+            if self._pending and self._summarizing is None:
+                self._summarizing = self.executor.submit(self._summarize)
+
+    def seed(self, turns):
+        """Start from (question, answer) turns of a saved conversation, keeping the newest that fit.
+
+        Older turns are dropped rather than summarized, so reopening a long
+        session costs no LLM call.
+        """
+        kept = []
+        total = 0
+        for question, answer in reversed(list(turns)):
+            turn = self._make_turn(question, answer)
+            if total + turn[2] > self.turn_budget:
+                break
+            kept.append(turn)
+            total += turn[2]
+        with self._lock:
+            self.turns = kept[::-1]
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                turns, self._pending = self._pending, []
+                summary = self.summary
+                if not turns:
+                    self._summarizing = None
+                    return
+            prompt = SUMMARY_PROMPT.format(
+                words=max(1, self.summary_tokens * 3 // 4), summary=summary or "(none)", turns=format_turns(turns)
+            )
+            try:
+                summary = truncate_to_tokens(str(self.complete(prompt)).strip(), self.summary_tokens, self.count_tokens)
+            except Exception as e:
+                logger.warning(f"Could not summarize {len(turns)} chat turn(s); they are dropped from memory: {e}")
+            with self._lock:
+                self.summary = summary
+
+    def wait_for_summary(self, timeout=None):
+        """Block until turns waiting to be summarized have been folded into the summary."""
+        with self._lock:
+            future = self._summarizing
+        if future is not None:
+            future.result(timeout)
+
+    def condense_prompt(self, question):
+        """Return the prompt that turns a follow-up into a standalone question, or None for a first question."""
+        with self._lock:
+            if not self.turns and not self.summary:
+                return None
+            return CONDENSE_PROMPT.format(
+                summary=self.summary or "(none)", turns=format_turns(self.turns) or "(none)", question=question
+            )
+
+    def history_tokens(self):
+        with self._lock:
+            return self.count_tokens(self.summary) + sum(tokens for _, _, tokens in self.turns)
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_EXTENSION = ".jsonl"
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChatSessionFile:
+    """Append-only JSONL chat session: one ``{"i", "sender", "message"}`` line per message.
+
+    ``i`` is the message's position in the transcript. Answers are written
+    when they complete, so they can follow later questions in the file;
+    readers order messages by ``i``. Each line goes to the OS in a single
+    write as soon as it is appended, and fsync is batched: it runs once
+    ``fsync_every`` lines are pending or ``fsync_interval`` seconds have
+    passed since the last one, and again on sync() or close().
+    """
+
+    def __init__(self, path, fsync_interval=1.0, fsync_every=20):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fsync_every = fsync_every
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+b")
+        # A crash may have left a partial last line; start a fresh line after it
+        if self._file.tell() > 0:
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+
+    def append(self, index, sender, message):
+        """Write one message; O(1) regardless of session length."""
+        if self._file is None:
+            self._open()
+        line = json.dumps({"i": index, "sender": sender, "message": message}, ensure_ascii=False) + "\n"
+        self._file.write(line.encode("utf-8"))
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """fsync the lines written since the last sync."""
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def read_session_tail(path, max_messages, end=None):
+    """Read the newest ``max_messages`` lines of a session that end before byte offset ``end``.
+
+    The file is read backwards in blocks, so opening a long session only
+    reads its tail. Returns ``(messages, offset)``, where messages are
+    ``(index, sender, text)`` tuples sorted by index and ``offset`` is
+    where older lines end (pass it as ``end`` to read the previous page;
+    0 means there are none).
+    """
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell() if end is None else end
+        buffer = b""
+        while position > 0 and buffer.count(b"\n") <= max_messages:
+            size = min(READ_BLOCK_SIZE, position)
+            position -= size
+            file.seek(position)
+            buffer = file.read(size) + buffer
+
+    segments = buffer.split(b"\n")
+    offset = position
+    if position > 0:
+        # The first segment may start before the block; leave it for the previous page
+        offset += len(segments[0]) + 1
+        segments = segments[1:]
+    lines = segments[:-1]  # The last segment is empty, or a partial line left by a crash
+    while len(lines) > max_messages:
+        offset += len(lines.pop(0)) + 1
+    if end is None and segments[-1]:
+        logger.warning(f"Ignoring incomplete last line in {path}")
+
+    return _parse_lines(path, lines), offset
+
+
+def read_session(path):
+    """Read every message of a session as ``(index, sender, text)`` tuples sorted by index."""
+    with open(path, "rb") as file:
+        lines = file.read().split(b"\n")
+    return _parse_lines(path, lines[:-1])  # The last segment is empty, or a partial line
+
+
+def _parse_lines(path, lines):
+    messages = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            messages.append((entry["i"], entry.get("sender", "model"), entry.get("message", "")))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Skipping unreadable line in {path}: {e}")
+    messages.sort(key=lambda message: message[0])
+    return messages
+
+
+def convert_json_sessions(directory):
+    """Convert chat sessions saved as one JSON array into the JSONL format, once.
+
+    The JSON file is left in place (it may be tracked or still read by an
+    older version); a session whose JSONL file already exists is skipped.
+    """
+    if not os.path.isdir(directory):
+        return
+    for file_name in sorted(os.listdir(directory)):
+        base_name, extension = os.path.splitext(file_name)
+        if extension != ".json":
+            continue
+        source = os.path.join(directory, file_name)
+        target = os.path.join(directory, base_name + SESSION_EXTENSION)
+        if os.path.exists(target):
+            continue
+        try:
+            with open(source, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+            tmp_path = target + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for index, entry in enumerate(entries):
+                    line = {"i": index, "sender": entry.get("sender", "model"), "message": entry.get("message", "")}
+                    file.write(json.dumps(line, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, target)
+            logger.info(f"Converted chat session {file_name} to {base_name + SESSION_EXTENSION}")
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Could not convert chat session {file_name}: {e}")
@@ -0,0 +1,175 @@
+import bisect
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize
+from PyQt5.QtGui import QColor, QPainter, QPalette
+from PyQt5.QtWidgets import QStyledItemDelegate
+
+MESSAGE_ROLE = Qt.UserRole + 1
+
+BUBBLE_PADDING = 10  # Space between bubble edge and text
+BUBBLE_SPACING = 10  # Space below each bubble
+BUBBLE_RADIUS = 10
+MAX_BUBBLE_WIDTH = {"user": 500, "model": 1300}
+
+
+class ChatMessage:
+    """One transcript entry.
+
+    ``index`` is the message's position in the whole session (and in the
+    session file); ``row`` is its position in the model, or None once the
+    transcript has been cleared, so late updates to it are ignored.
+    """
+
+    __slots__ = ("index", "sender", "text", "loading", "row", "sizes")
+
+    def __init__(self, index, sender, text, loading=False):
+        self.index = index
+        self.sender = sender
+        self.text = text
+        self.loading = loading
+        self.row = None
+        self.sizes = {}  # Text width budget -> bubble size, dropped whenever the text changes
+
+
+class ChatMessageModel(QAbstractListModel):
+    """List model holding the chat transcript, ordered by session index.
+
+    New messages are appended; older messages of a saved session can be
+    inserted later as they are loaded.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._messages = []
+        self._next_index = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self._messages[index.row()]
+        if role == Qt.DisplayRole:
+            return message.text
+        if role == MESSAGE_ROLE:
+            return message
+        return None
+
+    def append_message(self, sender, text, loading=False):
+        """Add a message at the end of the transcript and return it."""
+        message = ChatMessage(self._next_index, sender, text, loading)
+        self._next_index += 1
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        message.row = row
+        self._messages.append(message)
+        self.endInsertRows()
+        return message
+
+    def set_text(self, message, text, loading=False):
+        """Replace a message's text, e.g. as an answer streams in."""
+        if message.row is None:
+            return
+        message.text = text
+        message.loading = loading
+        message.sizes.clear()
+        index = self.index(message.row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def set_messages(self, entries):
+        """Replace the whole transcript with (index, sender, text) entries in a single model reset."""
+        self.beginResetModel()
+        for message in self._messages:
+            message.row = None
+        self._messages = [ChatMessage(index, sender, text) for index, sender, text in entries]
+        self._messages.sort(key=lambda message: message.index)
+        for row, message in enumerate(self._messages):
+            message.row = row
+        self._next_index = self._messages[-1].index + 1 if self._messages else 0
+        self.endResetModel()
+
+    def insert_messages(self, entries):
+        """Insert (index, sender, text) entries, e.g. older messages of a session, in index order."""
+        entries = sorted(entries)
+        if entries and (not self._messages or entries[-1][0] < self._messages[0].index):
+            # The usual case: a whole page of older messages goes above the current first row
+            self.beginInsertRows(QModelIndex(), 0, len(entries) - 1)
+            self._messages[:0] = [ChatMessage(index, sender, text) for index, sender, text in entries]
+            for row, message in enumerate(self._messages):
+                message.row = row
+            self._next_index = max(self._next_index, entries[-1][0] + 1)
+            self.endInsertRows()
+            return
+        for index, sender, text in entries:
+            row = bisect.bisect_left([message.index for message in self._messages], index)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._messages.insert(row, ChatMessage(index, sender, text))
+            for position in range(row, len(self._messages)):
+                self._messages[position].row = position
+            self.endInsertRows()
+            self._next_index = max(self._next_index, index + 1)
+
+    def row_for_index(self, index):
+        """Return the row of the message with session index ``index``, or None if it is not loaded."""
+        row = bisect.bisect_left([message.index for message in self._messages], index)
+        if row < len(self._messages) and self._messages[row].index == index:
+            return row
+        return None
+
+    def clear(self):
+        self.set_messages([])
+
+
+class ChatBubbleDelegate(QStyledItemDelegate):
+    """Paint messages as rounded bubbles: user messages on the right, model answers on the left.
+
+    Bubble sizes are measured once per text and width budget and cached
+    on the message, so scrolling and relayouts do not re-measure text.
+    """
+
+    def __init__(self, view, dark=False):
+        super().__init__(view)
+        self._view = view
+        self._colors = {
+            "user": QColor("#228B22" if dark else "#adf0ad"),
+            "model": QColor("#121212" if dark else "white"),
+        }
+        view.model().dataChanged.connect(self._on_data_changed)
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        # New text means a new bubble height; ask the view to lay the rows out again
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.sizeHintChanged.emit(top_left.sibling(row, 0))
+
+    def _bubble_size(self, font_metrics, message):
+        max_width = MAX_BUBBLE_WIDTH.get(message.sender, MAX_BUBBLE_WIDTH["model"])
+        text_width = max(1, min(max_width, self._view.viewport().width()) - 2 * BUBBLE_PADDING)
+        size = message.sizes.get(text_width)
+        if size is None:
+            rect = font_metrics.boundingRect(QRect(0, 0, text_width, 0), Qt.TextWordWrap, message.text)
+            size = QSize(rect.width() + 2 * BUBBLE_PADDING, rect.height() + 2 * BUBBLE_PADDING)
+            message.sizes[text_width] = size
+        return size
+
+    def sizeHint(self, option, index):
+        size = self._bubble_size(option.fontMetrics, index.data(MESSAGE_ROLE))
+        return QSize(self._view.viewport().width(), size.height() + BUBBLE_SPACING)
+
+    def paint(self, painter, option, index):
+        message = index.data(MESSAGE_ROLE)
+        size = self._bubble_size(option.fontMetrics, message)
+        left = option.rect.right() - size.width() if message.sender == "user" else option.rect.left()
+        bubble = QRect(left, option.rect.top(), size.width(), size.height())
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self._colors.get(message.sender, self._colors["model"]))
+        painter.drawRoundedRect(bubble, BUBBLE_RADIUS, BUBBLE_RADIUS)
+        painter.setPen(option.palette.color(QPalette.Text))
+        painter.setFont(option.font)
+        painter.drawText(
+            bubble.adjusted(BUBBLE_PADDING, BUBBLE_PADDING, -BUBBLE_PADDING, -BUBBLE_PADDING),
+            Qt.TextWordWrap, message.text,
+        )
+        painter.restore()
@@ -0,0 +1,156 @@
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(model_name, kind, text):
+    """Key an embedding by model, embedding kind (text/query) and text hash."""
+    return hashlib.sha256(f"{model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk (SQLite) embedding cache with an entry cap and LRU eviction.
+
+    Vectors are stored as float32 blobs. Every hit refreshes the entry's
+    last-used time; once the cache grows past ``max_entries`` the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array.array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs and evict the least recently used overflow."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array.array("f", vector).tobytes(), now) for key, vector in items],
+            )
+            # Counted inside the write transaction, so rows added by other processes sharing the file are included
+            overflow = self._entries() - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+            self._conn.commit()
+
+    def _entries(self):
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        """Return hit/miss counters and the current entry count."""
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wrap an embedding model so repeated texts never reach the remote API."""
+
+    _embed_model: Any = PrivateAttr()
+    _cache: Any = PrivateAttr()
+
+    def __init__(self, embed_model, cache, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _lookup(self, kind, texts):
+        keys = [_cache_key(self.model_name, kind, text) for text in texts]
+        return keys, self._cache.get_many(keys)
+
+    def _merge(self, keys, found, missing_keys, missing_vectors):
+        self._cache.put_many(list(zip(missing_keys, missing_vectors)))
+        found.update(zip(missing_keys, missing_vectors))
+        return [found[key] for key in keys]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup("text", texts)
+        missing = [(key, text) for key, text in zip(keys, texts) if key not in found]
+        vectors = self._embed_model._get_text_embeddings([text for _, text in missing]) if missing else []
+        return self._merge(keys, found, [key for key, _ in missing], vectors)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup("text", texts)
+        missing = [(key, text) for key, text in zip(keys, texts) if key not in found]
+        vectors = await self._embed_model._aget_text_embeddings([text for _, text in missing]) if missing else []
+        return self._merge(keys, found, [key for key, _ in missing], vectors)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        keys, found = self._lookup("query", [query])
+        if keys[0] in found:
+            return found[keys[0]]
+        return self._merge(keys, found, keys, [self._embed_model._get_query_embedding(query)])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        keys, found = self._lookup("query", [query])
+        if keys[0] in found:
+            return found[keys[0]]
+        return self._merge(keys, found, keys, [await self._embed_model._aget_query_embedding(query)])[0]
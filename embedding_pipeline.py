@@ -0,0 +1,160 @@
+import time
+import random
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from llama_index.core.schema import MetadataMode
+from llama_index.embeddings.huggingface_api import HuggingFaceInferenceAPIEmbedding
+from llama_index.embeddings.huggingface_api.pooling import Pooling
+from llama_index.utils.huggingface import format_text
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limited, or model still loading
+RETRYABLE_STATUS_CODES = (429, 503)
+
+
+def _is_rate_limited(error):
+    """Return True if an embedding error looks like a rate limit / overload."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(error).lower()
+    return "429" in message or "too many requests" in message or "rate limit" in message
+
+
+def _is_retryable(error):
+    """Return True if an embedding request may succeed when retried (rate limit, dropped or refused connection)."""
+    return _is_rate_limited(error) or isinstance(error, httpx.TransportError)
+
+
+class InferenceAPIBatchEmbedding(HuggingFaceInferenceAPIEmbedding):
+    """HuggingFaceInferenceAPIEmbedding that sends a batch of texts as one feature-extraction request.
+
+    The base class sends one request per text, so every chunk of a batch
+    hit the endpoint at once.
+    """
+
+    def _pooled(self, vectors):
+        if vectors.ndim == 3:  # Token embeddings of a model that does not pool itself; mean-pool them by default
+            pooling = self.pooling or Pooling.MEAN
+            return [pooling(vector).tolist() for vector in vectors]
+        return vectors.tolist()
+
+    def _format_texts(self, texts):
+        return [format_text(text, self.model_name, self.text_instruction) for text in texts]
+
+    def _get_text_embeddings(self, texts):
+        return self._pooled(self._sync_client.feature_extraction(self._format_texts(texts)))
+
+    async def _aget_text_embeddings(self, texts):
+        return self._pooled(await self._async_client.feature_extraction(self._format_texts(texts)))
+
+
+def iter_nodes(documents, text_splitter):
+    """Yield chunks one document at a time instead of splitting the whole batch up front."""
+    for document in documents:
+        start = time.perf_counter()
+        nodes = text_splitter.get_nodes_from_documents([document])
+        tracing.record("ingest.split", (time.perf_counter() - start) * 1000, chunks=len(nodes))
+        yield from nodes
+
+
+class EmbeddingPipeline:
+    """Embed chunks in batches with a bounded number of requests in flight.
+
+    Each completed batch is upserted into the vector store as soon as it is
+    embedded. At most ``max_in_flight`` batches are embedding at once and at
+    most ``max_in_flight`` more are queued, so a slow embedding endpoint
+    applies backpressure to the chunk producer instead of buffering the corpus.
+    """
+
+    def __init__(self, embed_model, vector_store, batch_size=32, max_in_flight=4, max_retries=5, backoff=1.0,
+                 on_batch=None):
+        self.embed_model = embed_model
+        self.vector_store = vector_store
+        self.on_batch = on_batch  # Called with each batch after it is upserted
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dimension = None  # Length of the vectors embedded so far
+        self._upsert_lock = threading.Lock()
+
+    def _embed_with_retry(self, texts):
+        """Embed a batch of texts, backing off exponentially on rate limits and connection errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embed_model.get_text_embedding_batch(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"Embedding failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+    def _process_batch(self, nodes):
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        with tracing.span("ingest.embed", chunks=len(nodes), chars=sum(len(text) for text in texts)):
+            embeddings = self._embed_with_retry(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        self.dimension = len(embeddings[0])
+        with self._upsert_lock, tracing.span("ingest.upsert", chunks=len(nodes)):
+            self.vector_store.add(nodes)
+            if self.on_batch is not None:
+                self.on_batch(nodes)
+        return [node.node_id for node in nodes]
+
+    def run(self, nodes):
+        """Embed and upsert an iterable of nodes; return the ids written.
+
+        The first batch that fails (after its retries) stops the run: no more
+        batches are submitted, queued ones are cancelled and its error is raised.
+        """
+        start = time.perf_counter()
+        slots = threading.BoundedSemaphore(self.max_in_flight * 2)
+        futures = []
+        errors = []
+
+        def finished(future):
+            slots.release()
+            if not future.cancelled() and future.exception() is not None:
+                errors.append(future.exception())
+
+        def submit(batch):
+            slots.acquire()
+            # Run in a copy of the caller's context so batch spans join its trace
+            future = executor.submit(contextvars.copy_context().run, self._process_batch, batch)
+            future.add_done_callback(finished)
+            futures.append(future)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            batch = []
+            for node in nodes:
+                if errors:
+                    break
+                batch.append(node)
+                if len(batch) >= self.batch_size:
+                    submit(batch)
+                    batch = []
+            if batch and not errors:
+                submit(batch)
+            if errors:
+                for future in futures:
+                    future.cancel()
+        if errors:
+            raise errors[0]
+
+        node_ids = []
+        for future in futures:
+            node_ids.extend(future.result())
+
+        elapsed = time.perf_counter() - start
+        if node_ids:
+            logger.info(f"Embedded {len(node_ids)} chunks in {elapsed:.2f}s ({len(node_ids) / elapsed:.1f} chunks/s)")
+        return node_ids
@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Stat + content fingerprint of a source file
+FileFingerprint = namedtuple("FileFingerprint", ["size", "mtime_ns", "sha256"])
+
+# Result of comparing the documents folder against the manifest
+ManifestDiff = namedtuple("ManifestDiff", ["added", "changed", "unchanged", "removed", "fingerprints"])
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_documents(directory, extensions):
+    """Yield (file_name, path) for documents in a directory and its direct subfolders.
+
+    Files in a subfolder are named "folder/file"; hidden files and folders are skipped.
+    """
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith("."):
+            continue
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                file_path = os.path.join(path, file_name)
+                if not file_name.startswith(".") and os.path.isfile(file_path) and file_name.endswith(extensions):
+                    yield f"{name}/{file_name}", file_path
+        elif os.path.isfile(path) and name.endswith(extensions):
+            yield name, path
+
+
+class IngestManifest:
+    """Persistent map of source file -> fingerprint and the node ids it produced.
+
+    Files whose size and mtime are unchanged are skipped without being read.
+    Files whose stat changed are hashed, and only re-ingested if the content
+    hash differs as well. The manifest also records the embedding model (and
+    vector dimension) of the stored chunks; after a model change every file
+    is re-ingested.
+    """
+
+    def __init__(self, path, entries=None, embedding_model=None, embedding_dim=None):
+        self.path = path
+        self.entries = entries or {}
+        self.embedding_model = embedding_model
+        self.embedding_dim = embedding_dim
+        self.reembed = False  # Every recorded file counts as changed
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        """Load the manifest from disk, or start an empty one."""
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            return cls(path, data.get("files", {}), data.get("embedding_model"), data.get("embedding_dim"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ingestion manifest unreadable, rebuilding it: {e}")
+            return cls(path)
+
+    def save(self):
+        """Atomically write the manifest if it has changed."""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "embedding_model": self.embedding_model,
+                "embedding_dim": self.embedding_dim,
+                "files": self.entries,
+            }, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def use_embedding_model(self, model_name):
+        """Record the model new chunks are embedded with; return True if the stored chunks used another one.
+
+        Manifests written before the model was recorded are assumed to match.
+        """
+        previous = self.embedding_model
+        if previous == model_name:
+            return False
+        self.embedding_model = model_name
+        self.embedding_dim = None
+        self.dirty = True
+        if previous is None:
+            return False
+        self.reembed = True
+        return True
+
+    def record_dimension(self, dim):
+        if dim and dim != self.embedding_dim:
+            self.embedding_dim = dim
+            self.dirty = True
+
+    def scan(self, directory, extensions):
+        """Compare the files in a directory and its direct subfolders against the manifest."""
+        added, changed, unchanged = [], [], []
+        fingerprints = {}
+        seen = set()
+
+        for file_name, path in list_documents(directory, extensions):
+            seen.add(file_name)
+            stat = os.stat(path)
+            entry = self.entries.get(file_name)
+
+            if entry and not self.reembed and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                unchanged.append(file_name)
+                continue
+
+            fingerprint = FileFingerprint(stat.st_size, stat.st_mtime_ns, file_sha256(path))
+            if entry is None:
+                added.append(file_name)
+                fingerprints[file_name] = fingerprint
+            elif entry["sha256"] == fingerprint.sha256 and not self.reembed:
+                # Touched but not modified: refresh the stat, keep the nodes
+                entry.update(size=fingerprint.size, mtime_ns=fingerprint.mtime_ns)
+                self.dirty = True
+                unchanged.append(file_name)
+            else:
+                changed.append(file_name)
+                fingerprints[file_name] = fingerprint
+
+        removed = [file_name for file_name in self.entries if file_name not in seen]
+        return ManifestDiff(added, changed, unchanged, removed, fingerprints)
+
+    def node_ids(self, file_name):
+        """Return the node ids recorded for a file."""
+        entry = self.entries.get(file_name)
+        return list(entry["node_ids"]) if entry else []
+
+    def record(self, file_name, fingerprint, node_ids, error=None):
+        """Record the fingerprint and node ids of an ingested file.
+
+        Files that failed to parse are recorded with their error and no nodes,
+        so they are not retried until their content changes.
+        """
+        self.entries[file_name] = {
+            "size": fingerprint.size,
+            "mtime_ns": fingerprint.mtime_ns,
+            "sha256": fingerprint.sha256,
+            "node_ids": list(node_ids),
+        }
+        if error is not None:
+            self.entries[file_name]["error"] = str(error)
+        self.dirty = True
+
+    def forget(self, file_name):
+        """Drop a file from the manifest and return its node ids."""
+        entry = self.entries.pop(file_name, None)
+        if entry is None:
+            return []
+        self.dirty = True
+        return entry["node_ids"]
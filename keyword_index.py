@@ -0,0 +1,215 @@
+import re
+import math
+import sqlite3
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import List
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or that the this to was what when "
+    "where which who why will with you your".split()
+)
+RRF_K = 60  # Reciprocal-rank fusion constant
+
+
+def tokenize(text):
+    """Lowercase word/number tokens without stopwords, so codes like 'CS101' stay one term."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Incremental BM25 inverted index stored in SQLite.
+
+    Postings are keyed by (term, node_id); the node table also records the
+    source file so every chunk of a file can be dropped at once.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, file_name TEXT, length INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, node_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, node_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_node ON postings (node_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS nodes_file ON nodes (file_name)")
+        self._node_count, total_length = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM nodes"
+        ).fetchone()
+        self._total_length = total_length
+
+    def count(self):
+        return self._node_count
+
+    def node_ids(self):
+        """Return the ids of every indexed node."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT node_id FROM nodes")]
+
+    def add(self, entries):
+        """Index (node_id, file_name, text) entries, replacing any existing postings."""
+        entries = list(entries)
+        if not entries:
+            return
+        with self._lock:
+            self._remove_locked([node_id for node_id, _, _ in entries])
+            for node_id, file_name, text in entries:
+                terms = Counter(tokenize(text))
+                length = sum(terms.values())
+                self._conn.execute(
+                    "INSERT INTO nodes (node_id, file_name, length) VALUES (?, ?, ?)", (node_id, file_name, length)
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, node_id, tf) VALUES (?, ?, ?)",
+                    [(term, node_id, tf) for term, tf in terms.items()],
+                )
+                self._node_count += 1
+                self._total_length += length
+            self._conn.commit()
+
+    def add_nodes(self, nodes):
+        """Index llama_index nodes as they are upserted into the vector store."""
+        self.add(
+            (node.node_id, node.metadata.get("file_name"), node.get_content(metadata_mode=MetadataMode.NONE))
+            for node in nodes
+        )
+
+    def _remove_locked(self, node_ids):
+        for start in range(0, len(node_ids), 500):
+            chunk = node_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            removed_count, removed_length = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM nodes WHERE node_id IN ({placeholders})", chunk
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM postings WHERE node_id IN ({placeholders})", chunk)
+            self._conn.execute(f"DELETE FROM nodes WHERE node_id IN ({placeholders})", chunk)
+            self._node_count -= removed_count
+            self._total_length -= removed_length
+
+    def remove(self, node_ids):
+        """Drop nodes from the index."""
+        if not node_ids:
+            return
+        with self._lock:
+            self._remove_locked(list(node_ids))
+            self._conn.commit()
+
+    def remove_file(self, file_name):
+        """Drop every node that came from a source file."""
+        with self._lock:
+            node_ids = [row[0] for row in self._conn.execute("SELECT node_id FROM nodes WHERE file_name = ?", (file_name,))]
+            self._remove_locked(node_ids)
+            self._conn.commit()
+
+    def search(self, query, top_k=5, file_name=None):
+        """Return [(node_id, score)] ranked by BM25, optionally only among the chunks of one file."""
+        terms = set(tokenize(query))
+        if not terms or not self._node_count:
+            return []
+        with self._lock:
+            placeholders = ",".join("?" * len(terms))
+            file_filter = " AND n.file_name = ?" if file_name is not None else ""
+            rows = self._conn.execute(
+                f"SELECT p.term, p.node_id, p.tf, n.length FROM postings p JOIN nodes n ON n.node_id = p.node_id "
+                f"WHERE p.term IN ({placeholders}){file_filter}",
+                list(terms) + ([file_name] if file_name is not None else []),
+            ).fetchall()
+            node_count = self._node_count
+            avg_length = self._total_length / node_count if node_count else 0.0
+
+        postings = defaultdict(list)
+        for term, node_id, tf, length in rows:
+            postings[term].append((node_id, tf, length))
+
+        scores = defaultdict(float)
+        for term, matches in postings.items():
+            idf = math.log(1 + (node_count - len(matches) + 0.5) / (len(matches) + 0.5))
+            for node_id, tf, length in matches:
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+                scores[node_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def rebuild_from_collection(self, chroma_collection, page_size=1000):
+        """Index every chunk already stored in a Chroma collection."""
+        count = 0
+        for page in iter_collection_pages(chroma_collection, page_size):
+            self.add(page)
+            count += len(page)
+        logger.info(f"Keyword index built from {count} stored chunks")
+
+
+def iter_collection_pages(chroma_collection, page_size=1000):
+    """Yield lists of (node_id, file_name, text) for every chunk stored in a Chroma collection."""
+    offset = 0
+    while True:
+        page = chroma_collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield [
+            (node_id, (metadata or {}).get("file_name"), text or "")
+            for node_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"])
+        ]
+        offset += len(page["ids"])
+
+
+def nodes_from_collection(chroma_collection, node_ids):
+    """Load nodes by id from a Chroma collection, in the given order."""
+    if not node_ids:
+        return []
+    result = chroma_collection.get(ids=list(node_ids), include=["documents", "metadatas"])
+    nodes = {}
+    for node_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+        node = metadata_dict_to_node(metadata)
+        node.set_content(text or "")
+        nodes[node_id] = node
+    return [nodes[node_id] for node_id in node_ids if node_id in nodes]
+
+
+class KeywordRetriever(BaseRetriever):
+    """Retrieve chunks with the local BM25 index; no embedding call is made."""
+
+    def __init__(self, keyword_index, chroma_collection, similarity_top_k=5, file_name=None):
+        super().__init__()
+        self._keyword_index = keyword_index
+        self._chroma_collection = chroma_collection
+        self._similarity_top_k = similarity_top_k
+        self._file_name = file_name  # Only search this file's chunks
+
+    def _retrieve(self, query_bundle) -> List[NodeWithScore]:
+        ranked = self._keyword_index.search(query_bundle.query_str, self._similarity_top_k, file_name=self._file_name)
+        scores = dict(ranked)
+        nodes = nodes_from_collection(self._chroma_collection, [node_id for node_id, _ in ranked])
+        return [NodeWithScore(node=node, score=scores[node.node_id]) for node in nodes]
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuse vector and keyword results with reciprocal-rank fusion."""
+
+    def __init__(self, retrievers, similarity_top_k=5):
+        super().__init__()
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+
+    def _retrieve(self, query_bundle) -> List[NodeWithScore]:
+        fused = {}
+        scores = defaultdict(float)
+        for retriever in self._retrievers:
+            for rank, result in enumerate(retriever.retrieve(query_bundle)):
+                fused.setdefault(result.node.node_id, result.node)
+                scores[result.node.node_id] += 1.0 / (RRF_K + rank + 1)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self._similarity_top_k]
+        return [NodeWithScore(node=fused[node_id], score=score) for node_id, score in ranked]
@@ -1,100 +1,884 @@
 import os
+import glob
+import time
 import logging
+import threading
+import functools
+import contextvars
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from llama_index.llms.huggingface_api import HuggingFaceInferenceAPI
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings, StorageContext, load_index_from_storage
-from llama_index.embeddings.huggingface_api import HuggingFaceInferenceAPIEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core import VectorStoreIndex, Settings, StorageContext, load_index_from_storage
 from llama_index.core.node_parser import SentenceSplitter
 import chromadb
+from ingest_manifest import IngestManifest
+from embedding_pipeline import EmbeddingPipeline, InferenceAPIBatchEmbedding, iter_nodes
+from embedding_cache import EmbeddingCache, CachedEmbedding
+from answer_cache import SemanticAnswerCache
+from llama_index.core import QueryBundle
+from role_profiles import get_role_profile
+from keyword_index import HybridRetriever
+from shards import DEFAULT_SHARD, Shard, ShardedRetriever, shard_of, document_path, collection_name, parse_scope
+from quantized_store import VECTOR_QUANTIZATIONS, QuantizedCollection
+from search_index import FullTextIndex
+from chat_memory import ChatMemory
+from reranker import CrossEncoderReranker, RerankScoreCache, load_cross_encoder, DEFAULT_RERANK_MODEL
+from parallel_loader import iter_parsed_files, default_workers
+from streaming_reader import iter_file_documents, block_chars_for_budget
+from local_models import is_local_model, local_model_path, LocalEmbedding, LocalLLM
+from micro_batching import BatchedEmbedding, CoalescingLLM, hf_query_embedder
+from sqlite_docstore import SQLiteKVStore, SQLiteDocumentStore, SQLiteIndexStore, migrate_json_stores
+from llama_index.core.query_engine import RetrieverQueryEngine
+import tracing
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants
-COLLECTION_NAME = "doc"
 DB_PATH = "chroma_db"  # Path to store the ChromaDB database
+DOCS_PATH = "documents"  # Folder holding the source documents; each subfolder is a shard of its own
+MANIFEST_PATH = os.path.join(DB_PATH, "ingest_manifest.json")  # Source file -> node ids
+EMBED_CACHE_PATH = os.path.join(DB_PATH, "embedding_cache.sqlite3")  # (model, text hash) -> vector
+KEYWORD_INDEX_PATH = os.path.join(DB_PATH, "keyword_index.sqlite3")  # BM25 postings over the default shard's chunks
+SEARCH_INDEX_PATH = os.path.join(DB_PATH, "search_index.sqlite3")  # FTS5 index of chunks and chat messages for the search bar
+DOCSTORE_PATH = os.path.join(DB_PATH, "docstore.sqlite3")  # Docstore and index store for the "sqlite" backend
+DOCSTORE_BACKENDS = ("json", "sqlite")
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+MAX_QUERY_ENGINES = 64  # Query engines kept built; older (role, mode, scope) combinations are rebuilt on use
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt", ".csv", ".json", ".pptx")
 
 # Global variables to store initialized models
 chroma_client = None
-vector_store = None
+shards = {}  # shard name -> Shard (Chroma collection and keyword index of a documents subfolder)
+vector_options = {}  # HNSW and quantization settings the open shards use
 index = None
+embedding_cache = None
+search_index = None
+docstore_kvstore = None
+local_embed_model = None  # Kept across initialize_rag calls so local weights are loaded once
+retrieval_mode = "vector"  # Default for queries that do not pick a mode
+llm = None  # Built on first query by get_llm()
+llm_options = {}
+index_version = 0  # Bumped whenever the indexed documents change
+query_engines = OrderedDict()  # (role, streaming, retrieval mode, shards, document) -> query engine, least recently used first
+query_engines_lock = threading.Lock()
+answer_cache = SemanticAnswerCache()
+chat_memories = OrderedDict()  # conversation id -> (ChatMemory, last use), least recently used first
+chat_memories_lock = threading.Lock()
+chat_memory_options = dict(token_budget=1500, summary_tokens=300)
+chat_limits = dict(max_conversations=1000, idle_seconds=3600)
+rerank_options = dict(enabled=False)
+rerank_model = None  # Cross-encoder loaded on first reranked query
+rerank_lock = threading.Lock()
+rerank_cache = RerankScoreCache()
+index_lock = threading.RLock()  # Serializes ingestion, deletion and compaction
 
-def initialize_rag(api_token, embedding_model, llm_model, chunk_size, chunk_overlap, role):
-    """Initialize and update the RAG database (ChromaDB) with new documents."""
-    global chroma_client, vector_store, index
+def _with_index_lock(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with index_lock:
+            return func(*args, **kwargs)
+    return wrapper
 
-    role = role
+def _storage_context(backend):
+    """Return a storage context over the persisted docstore and index store.
+
+    The "json" backend reads and rewrites the SimpleDocumentStore JSON files in
+    full; the "sqlite" backend reads nodes by key and writes only changed rows,
+    migrating existing JSON files on first use.
+    """
+    global docstore_kvstore
+    vector_store = shards[DEFAULT_SHARD].vector_store
+    if backend == "sqlite":
+        if docstore_kvstore is None:
+            docstore_kvstore = SQLiteKVStore(DOCSTORE_PATH)
+        migrate_json_stores(docstore_kvstore, DB_PATH)
+        return StorageContext.from_defaults(
+            vector_store=vector_store,
+            docstore=SQLiteDocumentStore(docstore_kvstore),
+            index_store=SQLiteIndexStore(docstore_kvstore),
+        )
+    if os.path.exists(os.path.join(DB_PATH, "index_store.json")):
+        return StorageContext.from_defaults(vector_store=vector_store, persist_dir=DB_PATH)
+    return StorageContext.from_defaults(vector_store=vector_store)
+
+def _delete_nodes(shard, node_ids):
+    """Remove nodes from a shard's vector store and keyword index, the full-text index and the docstore."""
+    if not node_ids:
+        return
+    shard.collection.delete(ids=node_ids)
+    shard.keyword_index.remove(node_ids)
+    search_index.remove_chunks(node_ids)
+    for node_id in node_ids:
+        index.docstore.delete_document(node_id, raise_error=False)
+
+def _index_chunks(shard, nodes):
+    """Add nodes upserted into a shard's vector store to its keyword index and the full-text index."""
+    shard.keyword_index.add_nodes(nodes)
+    search_index.add_nodes(nodes)
+
+def _keyword_index_path(name):
+    if name == DEFAULT_SHARD:
+        return KEYWORD_INDEX_PATH
+    return os.path.join(DB_PATH, f"keyword_index.{collection_name(name)}.sqlite3")
+
+def _open_shard(name):
+    quantized_path = os.path.join(DB_PATH, f"quantized.{collection_name(name)}.sqlite3")
+    return Shard(chroma_client, name, _keyword_index_path(name), quantized_path, **vector_options)
+
+def _open_shards(names, workers):
+    """Open the shards that are not open yet, ``workers`` at a time."""
+    global shards
+    missing = sorted(name for name in names if name not in shards)
+    if not missing:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+        opened = list(pool.map(_open_shard, missing))
+    # Queries may be reading the shards meanwhile, so the dict is replaced rather than changed
+    shards = {**shards, **{shard.name: shard for shard in opened}}
+    logger.info(f"Opened {len(opened)} shard(s): {missing}")
+
+def _drop_vectors():
+    """Delete every shard's vectors, so chunks embedded with another model are re-embedded from scratch."""
+    global shards
+    for shard in shards.values():
+        if isinstance(shard.collection, QuantizedCollection):
+            shard.collection.close()
+    shards = {}
+    for collection in chroma_client.list_collections():
+        chroma_client.delete_collection(collection.name)
+    for path in glob.glob(os.path.join(DB_PATH, "quantized.*.sqlite3*")):
+        os.remove(path)
+
+def _with_file_name(documents, file_name):
+    """Name each document by its path in DOCS_PATH, so files of the same name in two shards stay apart."""
+    for document in documents:
+        document.metadata["file_name"] = file_name
+        yield document
+
+@_with_index_lock
+@tracing.traced("ingest")
+def initialize_rag(api_token, embedding_model, llm_model, chunk_size, chunk_overlap,
+                   embed_batch_size=32, embed_concurrency=4, embed_cache_size=50000,
+                   answer_cache_threshold=0.95, answer_cache_size=1000, query_timeout=120,
+                   default_retrieval_mode="vector", parse_workers=0,
+                   streaming_threshold_mb=20, ingest_memory_mb=256, docstore_backend="sqlite", local_threads=0,
+                   chat_memory_tokens=1500, chat_summary_tokens=300, chat_max_conversations=1000,
+                   chat_idle_minutes=60, rerank=False, rerank_model_name=DEFAULT_RERANK_MODEL, rerank_candidates=30,
+                   rerank_token_budget=1500, rerank_batch_size=16, rerank_cache_size=20000,
+                   micro_batch_ms=10, micro_batch_size=16, llm_concurrency=4, shard_workers=2,
+                   hnsw_m=16, hnsw_ef_construction=100, hnsw_ef_search=100, vector_quantization="none",
+                   quantized_probes=16, quantized_rescore=50):
+    """Initialize and update the RAG database (ChromaDB) with new or changed documents.
+
+    Models named "local:<path to .gguf>" run in-process on CPU with
+    ``local_threads`` threads (0 = llama.cpp default) instead of calling the
+    Hugging Face Inference API.
+
+    Chat conversations remember at most ``chat_memory_tokens`` tokens of
+    history, of which ``chat_summary_tokens`` hold the summary of older turns.
+    A conversation is forgotten after ``chat_idle_minutes`` without a
+    question, and the least recently used ones beyond
+    ``chat_max_conversations`` are dropped (0 = no limit).
+
+    With ``rerank``, queries retrieve ``rerank_candidates`` chunks and a CPU
+    cross-encoder keeps the role's top-k best of them that fit in
+    ``rerank_token_budget`` tokens.
+
+    Query embeddings requested within ``micro_batch_ms`` of each other (up
+    to ``micro_batch_size``) are sent as one batched request (0 = off).
+    Identical concurrent generations run once, and at most
+    ``llm_concurrency`` generations run at a time (0 = no cap).
+
+    Each subfolder of the documents folder is a shard with its own Chroma
+    collection and keyword index; up to ``shard_workers`` shards are opened
+    and built at once.
+
+    Collections are created with HNSW graphs of ``hnsw_m`` neighbours per
+    node built with ``hnsw_ef_construction``, and searched with
+    ``hnsw_ef_search``. With ``vector_quantization`` "int8", each shard's
+    vectors are moved out of Chroma into a QuantizedCollection that keeps
+    int8 codes in memory, scans ``quantized_probes`` of its k-means lists
+    per query and rescores the best ``quantized_rescore`` chunks with their
+    float32 vectors read from disk.
+
+    Returns a list of (file_name, error) for files that could not be parsed.
+    """
+    global chroma_client, index, embedding_cache
+    global llm, llm_options, search_index, retrieval_mode, local_embed_model, rerank_model, shards
 
     # Initialize ChromaDB client
-    chroma_client = chromadb.PersistentClient(DB_PATH)  # Persistent storage
+    if chroma_client is None:
+        chroma_client = chromadb.PersistentClient(DB_PATH)  # Persistent storage
+
+    # Only parse and embed files that are new or whose content changed, or every file if the model changed
+    manifest = IngestManifest.load(MANIFEST_PATH)
+    previous_model = manifest.embedding_model
+    if manifest.use_embedding_model(embedding_model):
+        logger.warning(
+            f"Embedding model changed from {previous_model} to {embedding_model}; re-embedding every document"
+        )
+        _drop_vectors()
+    diff = manifest.scan(DOCS_PATH, SUPPORTED_EXTENSIONS)
+    logger.info(
+        f"Documents: {len(diff.added)} new, {len(diff.changed)} changed, "
+        f"{len(diff.removed)} removed, {len(diff.unchanged)} unchanged"
+    )
 
-    # Create/retrieve the collection
-    chroma_collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+    if vector_quantization not in VECTOR_QUANTIZATIONS:
+        raise ValueError(f"Unknown vector quantization '{vector_quantization}', expected one of {VECTOR_QUANTIZATIONS}")
+    new_vector_options = dict(
+        hnsw={"max_neighbors": hnsw_m, "ef_construction": hnsw_ef_construction, "ef_search": hnsw_ef_search},
+        quantization=vector_quantization, probes=quantized_probes, rescore_candidates=quantized_rescore,
+    )
+    if vector_options != new_vector_options:
+        vector_options.clear()
+        vector_options.update(new_vector_options)
+        shards = {}  # Reopened below with the new settings
+
+    # One collection and keyword index per shard, each built from Chroma the first time it is opened
+    _open_shards({DEFAULT_SHARD, *map(shard_of, manifest.entries), *map(shard_of, diff.added)}, shard_workers)
 
-    # Set up the vector store
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    # Full-text index of the same chunks for the search bar, also built from Chroma the first time
+    if search_index is None:
+        search_index = FullTextIndex(SEARCH_INDEX_PATH)
+    if search_index.chunk_count() == 0:
+        for shard in shards.values():
+            if shard.count():
+                search_index.rebuild_chunks_from_collection(shard.collection)
+    if default_retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{default_retrieval_mode}', expected one of {RETRIEVAL_MODES}")
+    retrieval_mode = default_retrieval_mode
+    if docstore_backend not in DOCSTORE_BACKENDS:
+        raise ValueError(f"Unknown docstore backend '{docstore_backend}', expected one of {DOCSTORE_BACKENDS}")
 
-    # Create a StorageContext
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    # Create a StorageContext over the persisted docstore and index store
+    storage_context = _storage_context(docstore_backend)
 
     # Set up text splitter
     text_splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
-    # Set up Hugging Face embedding model
-    Settings.embed_model = HuggingFaceInferenceAPIEmbedding(
-        model_name=embedding_model,
-        token=api_token,
-    )
+    # Set up the embedding model: local weights on CPU, or the Hugging Face Inference API
+    if is_local_model(embedding_model):
+        model_path = local_model_path(embedding_model)
+        if local_embed_model is None or (local_embed_model.model_name, local_embed_model.n_threads) != (
+            model_path, local_threads or None
+        ):
+            logger.info(f"Loading local embedding model {model_path}")
+            local_embed_model = LocalEmbedding(model_path, n_threads=local_threads or None)
+        local_embed_model.embed_batch_size = embed_batch_size
+        Settings.embed_model = local_embed_model
+    else:
+        Settings.embed_model = InferenceAPIBatchEmbedding(
+            model_name=embedding_model,
+            token=api_token,
+            embed_batch_size=embed_batch_size,
+        )
+
+    # Concurrent query embeddings that miss the cache are sent together
+    if micro_batch_ms > 0:
+        if is_local_model(embedding_model):
+            embed_queries = local_embed_model.embed_queries
+        else:
+            embed_queries = hf_query_embedder(Settings.embed_model, token=api_token, timeout=query_timeout)
+        Settings.embed_model = BatchedEmbedding(
+            Settings.embed_model, embed_queries, max_batch_size=micro_batch_size, max_wait_ms=micro_batch_ms
+        )
+
+    # Serve repeated texts and queries from the on-disk embedding cache
+    if embed_cache_size > 0:
+        if embedding_cache is None:
+            embedding_cache = EmbeddingCache(EMBED_CACHE_PATH, max_entries=embed_cache_size)
+        embedding_cache.max_entries = embed_cache_size
+        Settings.embed_model = CachedEmbedding(Settings.embed_model, embedding_cache)
 
-    # Set up Hugging Face LLM
-    Settings.llm = HuggingFaceInferenceAPI(
-        model_name=llm_model,
-        token=api_token,
+    # The LLM is only needed to answer queries, so it is built (or loaded) on first use
+    new_llm_options = dict(
+        model_name=llm_model, token=api_token, timeout=query_timeout, local_threads=local_threads,
+        concurrency=llm_concurrency,
     )
+    if llm_options != new_llm_options:
+        llm_options = new_llm_options
+        llm = None
 
     # Store settings
     Settings.chunk_size = chunk_size
     Settings.text_splitter = text_splitter
 
-    # Check if the index exists
-    index_exists = os.path.lexists(DB_PATH) and os.path.isdir(DB_PATH) and os.listdir(DB_PATH)
-
-    # Load existing index if it exists
-    if index_exists:
-        try:
-            logger.info("Loading existing index...")
-            index = load_index_from_storage(storage_context)  # Now safe to call
-        except ValueError:
-            logger.warning("Index not found in storage, creating a new one...")
-            index_exists = False  # Force re-creation
-    else:
-        logger.info("Creating a new index...")
-
-    # Load new documents only (incremental update)
-    documents = SimpleDirectoryReader("documents").load_data()
-    stored_docs = set(chroma_collection.get()["ids"])  # Get existing document IDs in ChromaDB
-    new_docs = [doc for doc in documents if doc.doc_id not in stored_docs]
-
-    if new_docs:
-        logger.info(f"Adding {len(new_docs)} new document(s) to the database...")
-        index = VectorStoreIndex.from_documents(new_docs, storage_context=storage_context, transformations=[text_splitter])
-        index.storage_context.persist(DB_PATH)  # Persist the updated database
-        logger.info("Index updated with new documents.")
+    answer_cache.threshold = answer_cache_threshold
+    answer_cache.max_entries = answer_cache_size
+    chat_memory_options.update(token_budget=chat_memory_tokens, summary_tokens=chat_summary_tokens)
+    chat_limits.update(max_conversations=chat_max_conversations, idle_seconds=chat_idle_minutes * 60)
+
+    # Two-stage retrieval: the cross-encoder is loaded on first use, and again only if the model changes
+    if rerank_options.get("model_name") != rerank_model_name:
+        rerank_model = None
+        rerank_cache.clear()
+    rerank_options.update(
+        enabled=rerank, model_name=rerank_model_name, candidates=rerank_candidates,
+        token_budget=rerank_token_budget, batch_size=rerank_batch_size,
+    )
+    rerank_cache.max_entries = rerank_cache_size
+
+    # Load existing index if it exists; the previous index keeps serving queries meanwhile
+    loaded_index = None
+    with tracing.span("ingest.load_index", backend=docstore_backend):
+        if storage_context.index_store.index_structs():
+            try:
+                logger.info("Loading existing index...")
+                loaded_index = load_index_from_storage(storage_context)
+            except ValueError:
+                logger.warning("Index not found in storage, creating a new one...")
+        if loaded_index is None:
+            logger.info("Creating a new index...")
+            loaded_index = VectorStoreIndex(nodes=[], storage_context=storage_context)
+    index = loaded_index
+
+    # Query engines hold the previous index and models; rebuild them on next query
+    query_engines.clear()
+
+    for file_name in diff.changed + diff.removed:
+        _delete_nodes(shards[shard_of(file_name)], manifest.forget(file_name))
+
+    def drop_unrecorded_chunks(file_name):
+        # Chunks with no manifest entry (pre-manifest index or an interrupted ingest)
+        shards[shard_of(file_name)].delete_file_chunks(file_name)
+        search_index.remove_file(file_name)
+
+    def ingest(pipeline, file_name, documents, error):
+        drop_unrecorded_chunks(file_name)
+        if error is not None:
+            failed_files.append((file_name, str(error)))
+            manifest.record(file_name, diff.fingerprints[file_name], [], error=error)
+            return
+        node_ids = pipeline.run(iter_nodes(_with_file_name(documents, file_name), text_splitter))
+        manifest.record(file_name, diff.fingerprints[file_name], node_ids)
+        logger.info(f"Indexed {file_name} ({len(node_ids)} chunks)")
+
+    def build_shard(shard, file_names):
+        pipeline = EmbeddingPipeline(
+            Settings.embed_model, shard.vector_store, batch_size=embed_batch_size, max_in_flight=embed_concurrency,
+            on_batch=functools.partial(_index_chunks, shard),
+        )
+        paths = {document_path(DOCS_PATH, file_name): file_name for file_name in file_names}
+        large_paths = [path for path, file_name in paths.items() if diff.fingerprints[file_name].size > streaming_threshold]
+
+        # Regular files are parsed in a process pool; each is embedded as soon as it has been parsed
+        regular_paths = [path for path in paths if path not in large_paths]
+        parsed_files = iter_parsed_files(regular_paths, max_workers=shard_parse_workers)
+        for path, documents, error in tracing.traced_iter("ingest.load", parsed_files, shard=shard.name):
+            ingest(pipeline, paths[path], documents, error)
+
+        # Large files are streamed block by block (or page by page), so memory stays within
+        # ingest_memory_mb instead of growing with the file
+        for path in large_paths:
+            logger.info(f"Streaming large file {paths[path]} in blocks of {block_chars} characters")
+            try:
+                documents = tracing.traced_iter(
+                    "ingest.load", iter_file_documents(path, block_chars), streamed=True, shard=shard.name
+                )
+                ingest(pipeline, paths[path], documents, None)
+            except Exception as e:
+                # Reading failed part-way through; drop what was written and retry on the next run
+                logger.error(f"Failed to stream {path}: {e}")
+                drop_unrecorded_chunks(paths[path])
+                failed_files.append((paths[path], str(e)))
+        shard.finish_build()
+        manifest.record_dimension(pipeline.dimension)
+
+    failed_files = []
+    file_names_by_shard = defaultdict(list)
+    for file_name in diff.added + diff.changed:
+        file_names_by_shard[shard_of(file_name)].append(file_name)
+    streaming_threshold = streaming_threshold_mb * 1024 * 1024
+
+    # Shards are built independently, several at once; parser processes and memory are shared out between them
+    workers = max(1, min(shard_workers, len(file_names_by_shard)))
+    shard_parse_workers = max(1, (parse_workers or default_workers()) // workers)
+    block_chars = block_chars_for_budget(ingest_memory_mb // workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-build") as pool:
+        # Run in a copy of the caller's context so load spans join the ingest trace
+        builds = [
+            pool.submit(contextvars.copy_context().run, build_shard, shards[name], file_names)
+            for name, file_names in file_names_by_shard.items()
+        ]
+        for build in builds:
+            build.result()
+
+    if diff.added or diff.changed or diff.removed:
+        _index_changed()  # Persist the updated database
+        logger.info("Index updated with document changes.")
     else:
-        logger.info("No new documents detected. Skipping update.")
+        logger.info("No document changes detected. Skipping update.")
+    manifest.save()
+
+    if embedding_cache is not None:
+        logger.info(f"Embedding cache: {embedding_cache.stats()}")
+    if failed_files:
+        logger.warning(f"Could not parse {len(failed_files)} file(s): {failed_files}")
+    return failed_files
+
+def rag_options_from_config(config):
+    """Keyword arguments for initialize_rag built from config.yaml; the GUI and serve.py both use it."""
+    return dict(
+        api_token=config.get("API_TOKEN", ""),
+        embedding_model=config.get("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"),
+        llm_model=config.get("LLM_MODEL", "google/gemma-2-2b-it"),
+        chunk_size=config.get("CHUNK_SIZE", 512),
+        chunk_overlap=config.get("CHUNK_OVERLAP", 10),
+        embed_batch_size=config.get("EMBED_BATCH_SIZE", 32),
+        embed_concurrency=config.get("EMBED_CONCURRENCY", 4),
+        embed_cache_size=config.get("EMBED_CACHE_SIZE", 50000),
+        query_timeout=config.get("QUERY_TIMEOUT", 120),
+        default_retrieval_mode=config.get("RETRIEVAL_MODE", "vector"),
+        parse_workers=config.get("PARSE_WORKERS", 0),
+        streaming_threshold_mb=config.get("STREAMING_THRESHOLD_MB", 20),
+        ingest_memory_mb=config.get("INGEST_MEMORY_MB", 256),
+        docstore_backend=config.get("DOCSTORE_BACKEND", "sqlite"),
+        local_threads=config.get("LOCAL_THREADS", 0),
+        answer_cache_threshold=config.get("ANSWER_CACHE_THRESHOLD", 0.95),
+        answer_cache_size=config.get("ANSWER_CACHE_SIZE", 1000),
+        chat_memory_tokens=config.get("CHAT_MEMORY_TOKENS", 1500),
+        chat_summary_tokens=config.get("CHAT_SUMMARY_TOKENS", 300),
+        chat_max_conversations=config.get("CHAT_MAX_CONVERSATIONS", 1000),
+        chat_idle_minutes=config.get("CHAT_IDLE_MINUTES", 60),
+        rerank=config.get("RERANK", False),
+        rerank_model_name=config.get("RERANK_MODEL", DEFAULT_RERANK_MODEL),
+        rerank_candidates=config.get("RERANK_CANDIDATES", 30),
+        rerank_token_budget=config.get("RERANK_TOKEN_BUDGET", 1500),
+        rerank_batch_size=config.get("RERANK_BATCH_SIZE", 16),
+        rerank_cache_size=config.get("RERANK_CACHE_SIZE", 20000),
+        micro_batch_ms=config.get("MICRO_BATCH_MS", 10),
+        micro_batch_size=config.get("MICRO_BATCH_SIZE", 16),
+        llm_concurrency=config.get("LLM_CONCURRENCY", 4),
+        shard_workers=config.get("SHARD_WORKERS", 2),
+        hnsw_m=config.get("HNSW_M", 16),
+        hnsw_ef_construction=config.get("HNSW_EF_CONSTRUCTION", 100),
+        hnsw_ef_search=config.get("HNSW_EF_SEARCH", 100),
+        vector_quantization=config.get("VECTOR_QUANTIZATION", "none"),
+        quantized_probes=config.get("QUANTIZED_PROBES", 16),
+        quantized_rescore=config.get("QUANTIZED_RESCORE", 50),
+    )
+
+def _index_changed():
+    """Persist the storage context and invalidate answers given for the old documents.
+
+    The SQLite docstore and index store are already up to date, so this only
+    rewrites the (small) graph and image store files for that backend.
+    """
+    global index_version
+    with tracing.span("ingest.persist"):
+        index.storage_context.persist(DB_PATH)
+    index_version += 1
+    answer_cache.clear()
+
+def _disk_usage_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return round(total / 1024 / 1024, 2)
+
+def _probe_query_latency_ms(repeats=20, top_k=5):
+    """Average vector search latency of the largest shard using a stored embedding as the probe (no network)."""
+    collection = max((shard.collection for shard in shards.values()), key=lambda collection: collection.count())
+    sample = collection.get(limit=1, include=["embeddings"])
+    if not sample["ids"]:
+        return 0.0
+    probe = [list(sample["embeddings"][0])]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        collection.query(query_embeddings=probe, n_results=top_k)
+    return round((time.perf_counter() - start) * 1000 / repeats, 2)
+
+def search_documents(query, limit=50):
+    """Full-text search over the indexed document chunks, best match first."""
+    return search_index.search(query, limit=limit, kinds=("document",))
+
+def shard_stats():
+    """Number of vectors in each shard."""
+    return {name: shard.count() for name, shard in sorted(shards.items())}
+
+def index_stats():
+    """Size of the index: shards, vectors, docstore entries, keyword-index nodes, MB on disk and search latency."""
+    return {
+        "shards": len(shards),
+        "vectors": sum(shard.count() for shard in shards.values()),
+        "docstore_entries": (
+            index.docstore.count() if isinstance(index.docstore, SQLiteDocumentStore) else len(index.docstore.docs)
+        ),
+        "keyword_nodes": sum(shard.keyword_index.count() for shard in shards.values()),
+        "disk_mb": _disk_usage_mb(DB_PATH),
+        "query_latency_ms": _probe_query_latency_ms(),
+    }
 
-def hugging_face_query(prompt, role):
-    """Query the preloaded RAG index instead of rebuilding it."""
+@_with_index_lock
+def delete_document(file_name):
+    """Remove every node produced from a source file from Chroma, the docstore and the keyword and search indexes."""
+    if index is None:
+        raise RuntimeError("Index has not been initialized. Call initialize_rag() first.")
+    manifest = IngestManifest.load(MANIFEST_PATH)
+    node_ids = manifest.forget(file_name)
+    shard = shards.get(shard_of(file_name))
+    if shard is not None:
+        _delete_nodes(shard, node_ids)
+        # Chunks that never made it into the manifest
+        shard.delete_file_chunks(file_name)
+    search_index.remove_file(file_name)
+
+    # Source documents kept in the docstore
+    for doc_id, doc in list(index.docstore.docs.items()):
+        if doc.metadata.get("file_name") == file_name:
+            index.docstore.delete_document(doc_id, raise_error=False)
+
+    manifest.save()
+    _index_changed()
+    logger.info(f"Deleted {file_name} from the index ({len(node_ids)} chunks)")
+    return len(node_ids)
+
+@_with_index_lock
+def compact_index(page_size=1000):
+    """Drop vectors, keyword postings, search-index chunks and docstore entries that no manifest file owns.
+
+    Returns the index_stats() measured before and after compaction.
+    """
+    if index is None:
+        raise RuntimeError("Index has not been initialized. Call initialize_rag() first.")
+    before = index_stats()
+    manifest = IngestManifest.load(MANIFEST_PATH)
+    live_ids = {node_id for file_name in manifest.entries for node_id in manifest.node_ids(file_name)}
+
+    removed_vectors = 0
+    for shard in shards.values():
+        orphaned = []
+        offset = 0
+        while True:
+            page = shard.collection.get(include=[], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            orphaned.extend(node_id for node_id in page["ids"] if node_id not in live_ids)
+            offset += len(page["ids"])
+        for start in range(0, len(orphaned), page_size):
+            shard.collection.delete(ids=orphaned[start:start + page_size])
+        shard.keyword_index.remove([node_id for node_id in shard.keyword_index.node_ids() if node_id not in live_ids])
+        shard.finish_build()
+        removed_vectors += len(orphaned)
+
+    search_index.remove_chunks([node_id for node_id in search_index.chunk_ids() if node_id not in live_ids])
+
+    # The vector store holds the chunk text, so the docstore only needs entries for live nodes
+    for doc_id in list(index.docstore.docs):
+        if doc_id not in live_ids:
+            index.docstore.delete_document(doc_id, raise_error=False)
+
+    _index_changed()
+    after = index_stats()
+    logger.info(f"Compacted index: removed {removed_vectors} orphaned vectors; before {before}, after {after}")
+    return {"before": before, "after": after, "removed_vectors": removed_vectors}
+
+def get_llm():
+    """Return the LLM, constructing the client (or loading local weights) on first use."""
+    global llm
+    if llm is None:
+        model_name = llm_options["model_name"]
+        if is_local_model(model_name):
+            logger.info(f"Loading local LLM {local_model_path(model_name)}")
+            llm = LocalLLM(local_model_path(model_name), n_threads=llm_options["local_threads"] or None)
+        else:
+            llm = HuggingFaceInferenceAPI(
+                model_name=model_name, token=llm_options["token"], timeout=llm_options["timeout"]
+            )
+        llm = CoalescingLLM(llm, max_in_flight=llm_options["concurrency"])
+        Settings.llm = llm
+    return llm
+
+def get_reranker(top_n):
+    """Return a reranking postprocessor keeping ``top_n`` chunks, loading the cross-encoder on first use."""
+    global rerank_model
+    with rerank_lock:
+        if rerank_model is None:
+            logger.info(f"Loading reranker {rerank_options['model_name']}")
+            rerank_model = load_cross_encoder(rerank_options["model_name"])
+    return CrossEncoderReranker(
+        rerank_model, rerank_cache, _count_tokens, lock=rerank_lock,
+        model_name=rerank_options["model_name"], top_n=top_n,
+        token_budget=rerank_options["token_budget"], batch_size=rerank_options["batch_size"],
+    )
+
+def _scope_shards(role, scope):
+    """Return the (shard names, document) a query searches: its scope, within the collections the role may search."""
+    names, document = parse_scope(scope)
+    allowed = get_role_profile(role)["collections"]
+    if names is None:
+        return tuple(name for name in sorted(shards) if allowed is None or name in allowed), None
+    for name in names:
+        if allowed is not None and name not in allowed:
+            raise ValueError(f"Role '{role}' is not allowed to search collection '{name}'")
+        if name not in shards:
+            raise ValueError(f"Unknown shard '{name}', expected one of {sorted(shards)}")
+    return names, document
+
+def get_query_engine(role, streaming=False, mode=None, scope=None):
+    """Return the query engine for a role, retrieval mode and scope, building it once per index.
+
+    Roles share the loaded index and differ only in prompt and retrieval
+    parameters, so switching role never reloads or re-embeds anything.
+    ``scope`` limits retrieval to some shards or one document (see
+    shards.parse_scope); only their vectors are searched.
+    """
+    mode = mode or retrieval_mode
+    shard_names, document = _scope_shards(role, scope)
+    key = (role, streaming, mode, shard_names, document)
+    with query_engines_lock:
+        query_engine = query_engines.get(key)
+        if query_engine is not None:
+            query_engines.move_to_end(key)
+    if query_engine is None:
+        profile = get_role_profile(role)
+        top_k = profile["similarity_top_k"]
+        node_postprocessors = []
+        if rerank_options["enabled"]:
+            # Retrieve a wide pool; the reranker keeps the role's top_k best of it
+            node_postprocessors.append(get_reranker(top_k))
+            top_k = max(top_k, rerank_options["candidates"])
+        searched = [shards[name] for name in shard_names]
+
+        def vector_retriever():
+            return ShardedRetriever([shard.vector_retriever(top_k, document) for shard in searched], top_k)
+
+        def keyword_retriever():
+            return ShardedRetriever(
+                [shard.keyword_retriever(top_k, document) for shard in searched], top_k, fusion="rank"
+            )
+
+        if mode == "vector":
+            retriever = vector_retriever()
+        elif mode == "keyword":
+            retriever = keyword_retriever()
+        elif mode == "hybrid":
+            retriever = HybridRetriever([vector_retriever(), keyword_retriever()], similarity_top_k=top_k)
+        else:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        query_engine = RetrieverQueryEngine.from_args(
+            retriever,
+            llm=get_llm(),
+            streaming=streaming,
+            node_postprocessors=node_postprocessors,
+            response_mode=profile["response_mode"],
+            text_qa_template=profile["qa_template"],
+        )
+        with query_engines_lock:
+            query_engines[key] = query_engine
+            # Every scoped document or shard set gets its own engine; keep only the recently used ones
+            while len(query_engines) > MAX_QUERY_ENGINES:
+                query_engines.popitem(last=False)
+    return query_engine
+
+def _lookup_answer(prompt, mode, cache_key):
+    """Embed the question and look for a near-identical one asked with the same ``cache_key``.
+
+    Keyword retrieval never embeds, so it skips the (embedding-based) answer cache.
+    """
+    version = index_version
+    if mode == "keyword":
+        return None, version, None
+    embedding = Settings.embed_model.get_query_embedding(prompt)
+    cached = None
+    if answer_cache.threshold > 0:
+        cached = answer_cache.lookup(embedding, cache_key, version)
+        if cached is not None:
+            logger.info("Answer served from cache.")
+    return embedding, version, cached
+
+def _count_tokens(text):
+    return len(Settings.tokenizer(text))
+
+def _context_tokens(nodes):
+    return sum(_count_tokens(result.node.get_content()) for result in nodes)
+
+def _store_answer(prompt, embedding, cache_key, version, answer):
+    if answer_cache.threshold > 0 and embedding is not None:
+        answer_cache.store(prompt, embedding, cache_key, version, answer)
+
+def hugging_face_query(prompt, role, cancel_event=None, mode=None, scope=None):
+    """Query the preloaded RAG index instead of rebuilding it.
+
+    ``mode`` picks the retrieval mode ("vector", "keyword" or "hybrid"); it
+    defaults to the mode configured in initialize_rag. ``scope`` limits the
+    search to some shards or one document, e.g. ``{"shards": ["econ101"]}``
+    or ``{"document": "econ101/syllabus.pdf"}``; the default searches every
+    shard the role may search. Setting ``cancel_event`` skips the LLM call
+    if it is set once retrieval is done; None is returned then.
+    """
     global index
     if index is None:
         return "Error: Index has not been initialized. Call initialize_rag() first."
-    role = role
-    query_engine = index.as_query_engine()
-    response = query_engine.query(prompt)
+    mode = mode or retrieval_mode
+    shard_names, document = _scope_shards(role, scope)
+    cache_key = (role, mode, shard_names, document)
+
+    with tracing.span("query", role=role, mode=mode, prompt_tokens=_count_tokens(prompt)) as query_span:
+        # Near-identical questions against the same documents reuse the stored answer
+        with tracing.span("query.embed", mode=mode):
+            embedding, version, cached = _lookup_answer(prompt, mode, cache_key)
+        query_span["cache_hit"] = cached is not None
+        if cached is not None:
+            return cached
+
+        query_engine = get_query_engine(role, mode=mode, scope=scope)
+        query_bundle = QueryBundle(query_str=prompt, embedding=embedding)
+        with tracing.span("query.retrieve", mode=mode, shards=len(shard_names)) as retrieve_span:
+            nodes = query_engine.retrieve(query_bundle)
+            retrieve_span["nodes"] = len(nodes)
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info("Query cancelled before generation.")
+            query_span["cancelled"] = True
+            return None
+        # Prompt construction and the LLM call
+        with tracing.span("query.generate", context_tokens=_context_tokens(nodes)) as generate_span:
+            response = query_engine.synthesize(query_bundle, nodes)
+            generate_span["output_tokens"] = _count_tokens(response.response or "")
+    _store_answer(prompt, embedding, cache_key, version, response.response)
     return response.response  # Ensure we return only the text response
 
+def hugging_face_query_stream(prompt, role, cancel_event=None, mode=None, trace=None, scope=None):
+    """Query the preloaded RAG index and yield the answer token by token.
+
+    Setting ``cancel_event`` stops the stream and closes the underlying HTTP response.
+    """
+    if index is None:
+        yield "Error: Index has not been initialized. Call initialize_rag() first."
+        return
+    mode = mode or retrieval_mode
+    shard_names, document = _scope_shards(role, scope)
+    cache_key = (role, mode, shard_names, document)
+
+    # A generator cannot hold a span open across yields, so stages are recorded explicitly
+    trace = trace or tracing.new_trace_id()
+    query_start = time.perf_counter()
+    query_attributes = dict(role=role, mode=mode, streaming=True, prompt_tokens=_count_tokens(prompt))
+
+    embedding, version, cached = _lookup_answer(prompt, mode, cache_key)
+    tracing.record("query.embed", (time.perf_counter() - query_start) * 1000, trace=trace, mode=mode)
+    if cached is not None:
+        tracing.record("query", (time.perf_counter() - query_start) * 1000, trace=trace, cache_hit=True,
+                       **query_attributes)
+        yield cached
+        return
+
+    query_engine = get_query_engine(role, streaming=True, mode=mode, scope=scope)
+    query_bundle = QueryBundle(query_str=prompt, embedding=embedding)
+    start = time.perf_counter()
+    nodes = query_engine.retrieve(query_bundle)
+    tracing.record("query.retrieve", (time.perf_counter() - start) * 1000, trace=trace, mode=mode, nodes=len(nodes),
+                   shards=len(shard_names))
+
+    start = time.perf_counter()
+    response = query_engine.synthesize(query_bundle, nodes)
+    tokens = []
+    for token in response.response_gen:
+        if not tokens:
+            tracing.record("query.first_token", (time.perf_counter() - start) * 1000, trace=trace)
+        if cancel_event is not None and cancel_event.is_set():
+            response.response_gen.close()
+            logger.info("Streaming query cancelled.")
+            tracing.record("query", (time.perf_counter() - query_start) * 1000, trace=trace, cache_hit=False,
+                           cancelled=True, **query_attributes)
+            return
+        tokens.append(token)
+        yield token
+    tracing.record("query.generate", (time.perf_counter() - start) * 1000, trace=trace,
+                   context_tokens=_context_tokens(nodes), output_tokens=len(tokens))
+    tracing.record("query", (time.perf_counter() - query_start) * 1000, trace=trace, cache_hit=False,
+                   **query_attributes)
+    _store_answer(prompt, embedding, cache_key, version, "".join(tokens))
+
+def _complete(prompt):
+    return get_llm().complete(prompt).text
+
+def _evict_chat_memories(now):
+    """Forget idle conversations, then the least recently used ones over the limit."""
+    max_conversations, idle_seconds = chat_limits["max_conversations"], chat_limits["idle_seconds"]
+    evicted = 0
+    while chat_memories:
+        conversation_id, (_, last_use) = next(iter(chat_memories.items()))
+        over_limit = max_conversations and len(chat_memories) > max_conversations
+        if not over_limit and not (idle_seconds and now - last_use > idle_seconds):
+            break
+        del chat_memories[conversation_id]
+        evicted += 1
+    if evicted:
+        logger.debug(f"Forgot {evicted} idle chat conversation(s), {len(chat_memories)} kept")
+
+def get_chat_memory(conversation_id):
+    """Return the memory of a chat conversation, creating it on its first question."""
+    now = time.monotonic()
+    with chat_memories_lock:
+        entry = chat_memories.pop(conversation_id, None)
+        memory = entry[0] if entry else ChatMemory(_complete, _count_tokens, **chat_memory_options)
+        chat_memories[conversation_id] = (memory, now)
+        _evict_chat_memories(now)
+    return memory
+
+def start_chat(conversation_id, turns=()):
+    """Start a conversation's memory afresh, seeded with (question, answer) turns of a reopened session."""
+    with chat_memories_lock:
+        chat_memories.pop(conversation_id, None)
+    if turns:
+        get_chat_memory(conversation_id).seed(turns)
+
+def end_chat(conversation_id):
+    """Forget a conversation's memory."""
+    with chat_memories_lock:
+        chat_memories.pop(conversation_id, None)
+
+def _condense_question(prompt, memory, trace=None):
+    """Rewrite a follow-up as a standalone question from the conversation memory.
+
+    Only the standalone question is embedded, retrieved for and answered, so
+    the answer prompt does not grow with the conversation.
+    """
+    condense_prompt = memory.condense_prompt(prompt)
+    if condense_prompt is None:
+        return prompt
+    start = time.perf_counter()
+    question = _complete(condense_prompt).strip() or prompt
+    tracing.record("query.condense", (time.perf_counter() - start) * 1000, trace=trace,
+                   prompt_tokens=_count_tokens(condense_prompt), history_tokens=memory.history_tokens())
+    logger.debug(f"Condensed follow-up question to: {question}")
+    return question
+
+def chat_query(prompt, role, conversation_id, cancel_event=None, mode=None, scope=None):
+    """Answer a question in a multi-turn conversation and remember the turn."""
+    if index is None:
+        return "Error: Index has not been initialized. Call initialize_rag() first."
+    _scope_shards(role, scope)  # Reject a bad scope before the follow-up is condensed
+    memory = get_chat_memory(conversation_id)
+    with tracing.span("chat"):
+        question = _condense_question(prompt, memory)
+        answer = hugging_face_query(question, role, cancel_event=cancel_event, mode=mode, scope=scope)
+    if answer is not None:
+        memory.add_turn(prompt, answer)
+    return answer
+
+def chat_query_stream(prompt, role, conversation_id, cancel_event=None, mode=None, scope=None):
+    """Answer a question in a multi-turn conversation token by token; the turn is remembered once complete."""
+    if index is None:
+        yield "Error: Index has not been initialized. Call initialize_rag() first."
+        return
+    _scope_shards(role, scope)  # Reject a bad scope before the follow-up is condensed
+    memory = get_chat_memory(conversation_id)
+    trace = tracing.new_trace_id()
+    question = _condense_question(prompt, memory, trace=trace)
+    tokens = []
+    for token in hugging_face_query_stream(
+        question, role, cancel_event=cancel_event, mode=mode, trace=trace, scope=scope
+    ):
+        tokens.append(token)
+        yield token
+    if cancel_event is None or not cancel_event.is_set():
+        memory.add_turn(prompt, "".join(tokens))
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Test prompt
     prompt = "What is product marketing mix?"
     hugging_face_query(prompt)
@@ -0,0 +1,159 @@
+import os
+import threading
+from typing import Any, List, Optional
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+# EMBEDDING_MODEL / LLM_MODEL values starting with this prefix name a local GGUF file
+LOCAL_MODEL_PREFIX = "local:"
+
+# Query prefix the BGE models were trained with for retrieval
+BGE_QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
+
+
+def is_local_model(model_name):
+    """Return True if a configured model name points at local weights."""
+    return model_name.startswith(LOCAL_MODEL_PREFIX)
+
+
+def local_model_path(model_name):
+    """Resolve 'local:<path>' to the weights file, failing early if it is missing."""
+    path = os.path.expanduser(model_name[len(LOCAL_MODEL_PREFIX):])
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Local model weights not found: {path}")
+    return path
+
+
+def _load_llama(model_path, **kwargs):
+    # llama-cpp-python is only needed when a local model is configured
+    from llama_cpp import Llama
+    return Llama(model_path=model_path, verbose=False, **kwargs)
+
+
+class LocalEmbedding(BaseEmbedding):
+    """Embed texts on CPU in-process with (quantized) GGUF weights through llama.cpp.
+
+    A batch of texts is packed into one llama.cpp decode of up to
+    ``context_window`` tokens; calls are serialized because a llama.cpp
+    context is not thread safe, and ``n_threads`` controls the CPU threads
+    each call uses.
+    """
+
+    n_threads: Optional[int] = Field(default=None, description="CPU threads (None = llama.cpp default)")
+    query_instruction: Optional[str] = Field(default=None, description="Prefix added to queries")
+
+    _model: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, model_path, n_threads=None, embed_batch_size=32, context_window=2048, query_instruction=None,
+                 **kwargs):
+        if query_instruction is None and "bge" in os.path.basename(model_path).lower():
+            query_instruction = BGE_QUERY_INSTRUCTION
+        super().__init__(
+            model_name=model_path,
+            embed_batch_size=embed_batch_size,
+            n_threads=n_threads,
+            query_instruction=query_instruction,
+            **kwargs,
+        )
+        self._model = _load_llama(
+            model_path, embedding=True, n_ctx=context_window, n_batch=context_window, n_threads=n_threads
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    def _embed(self, texts):
+        with self._lock:
+            return self._model.embed(texts, normalize=True, truncate=True)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._get_text_embeddings(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    def embed_queries(self, queries):
+        """Embed several queries in one llama.cpp call."""
+        return self._embed([(self.query_instruction or "") + query for query in queries])
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed_queries([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+
+class LocalLLM(CustomLLM):
+    """Generate answers on CPU in-process with (quantized) GGUF weights through llama.cpp.
+
+    Prompts are wrapped in the chat template stored in the GGUF file, so
+    instruction-tuned models answer the same QA prompts as the remote model.
+    """
+
+    model_path: str = Field(description="Path to the GGUF weights")
+    context_window: int = Field(default=4096)
+    max_new_tokens: int = Field(default=512)
+    temperature: float = Field(default=0.1)
+
+    _model: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, model_path, n_threads=None, n_batch=512, context_window=4096, max_new_tokens=512,
+                 temperature=0.1, **kwargs):
+        super().__init__(
+            model_path=model_path,
+            context_window=context_window,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            **kwargs,
+        )
+        self._model = _load_llama(model_path, n_ctx=context_window, n_batch=n_batch, n_threads=n_threads)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window, num_output=self.max_new_tokens, model_name=self.model_path
+        )
+
+    def _chat_completion(self, prompt, stream):
+        return self._model.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_new_tokens,
+            temperature=self.temperature,
+            stream=stream,
+        )
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        with self._lock:
+            result = self._chat_completion(prompt, stream=False)
+        return CompletionResponse(text=result["choices"][0]["message"]["content"] or "", raw=result)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen():
+            # The lock is held until the stream finishes or is closed (cancelled)
+            with self._lock:
+                text = ""
+                for chunk in self._chat_completion(prompt, stream=True):
+                    delta = chunk["choices"][0]["delta"].get("content") or ""
+                    text += delta
+                    yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
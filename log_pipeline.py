@@ -0,0 +1,146 @@
+import time
+import atexit
+import logging
+import threading
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Loggers that are chatty at DEBUG/INFO (uic logs every property it sets)
+NOISY_LOGGERS = ("PyQt5.uic", "httpx", "httpcore", "urllib3", "chromadb")
+
+_listener = None
+_stop_at_exit = False
+
+
+def stop_logging():
+    """Flush queued records, stop the writer thread and close its handlers."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+class TruncatingFormatter(logging.Formatter):
+    """Cut long messages such as full responses to ``max_chars``; tracebacks are kept whole.
+
+    Used by the writer thread's handlers, so callers never build the message.
+    """
+
+    def __init__(self, fmt=None, max_chars=2000):
+        super().__init__(fmt)
+        self.max_chars = max_chars
+
+    def formatMessage(self, record):
+        message = record.message
+        if self.max_chars and len(message) > self.max_chars:
+            record.message = f"{message[:self.max_chars]}... [{len(message)} chars]"
+        return super().formatMessage(record)
+
+
+class RateLimitFilter(logging.Filter):
+    """Allow at most ``max_per_second`` records per call site; warnings and errors always pass.
+
+    The next record let through from a throttled call site reports how many
+    were dropped.
+    """
+
+    def __init__(self, max_per_second=20):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self._windows = {}  # (logger, path, line) -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.max_per_second or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.max_per_second:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting to the writer thread.
+
+    The stock QueueHandler formats every record in the calling thread so it
+    can be pickled; an in-process queue does not need that.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """Roll the log over when it reaches ``maxBytes`` or every ``rotate_seconds``, whichever comes first."""
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, rotate_seconds=0, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = time.time() + rotate_seconds
+
+    def shouldRollover(self, record):
+        if self.rotate_seconds and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotate_seconds
+
+
+def setup_logging(path="application.log", level="INFO", max_bytes=5 * 1024 * 1024, backup_count=5,
+                  rotate_hours=24, max_message_chars=2000, rate_limit=20, console=True):
+    """Route all logging through a queue to a background writer thread.
+
+    Callers (including the GUI thread) only filter the record and put it on
+    a queue; formatting and disk writes happen on the listener thread.
+    Returns the QueueListener, which is stopped (and flushed) at exit.
+    """
+    global _listener, _stop_at_exit
+    if not _stop_at_exit:
+        atexit.register(stop_logging)
+        _stop_at_exit = True
+    stop_logging()
+
+    file_handler = SizeAndTimeRotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, rotate_seconds=rotate_hours * 3600
+    )
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler())
+    formatter = TruncatingFormatter(LOG_FORMAT, max_message_chars)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DeferredQueueHandler(SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
@@ -1,56 +1,79 @@
 import sys
 import os
+import html
 import json
+import time
 import datetime
 import shutil
 import yaml
 import subprocess
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import sqlite3
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QLabel, QFileDialog, QMessageBox, QMenu, QWidget, QHBoxLayout, QSizePolicy
+    QApplication, QMainWindow, QFileDialog, QMessageBox, QMenu, QLabel, QListWidgetItem, QAbstractItemView
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QTimer, QThread
 from PyQt5.uic import loadUi
-from llm_query import initialize_rag, hugging_face_query
+import llm_query
+from llm_query import initialize_rag, rag_options_from_config, SUPPORTED_EXTENSIONS, SEARCH_INDEX_PATH
+from rag_client import RAGClient
+from ingest_manifest import list_documents
+from shards import document_path, shard_of, DEFAULT_SHARD
 from settings import SettingsWindow
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-file_handler = logging.FileHandler('application.log')
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.getLogger().addHandler(file_handler)
+from query_scheduler import QueryScheduler, QueryQueueFull
+import tracing
+from log_pipeline import setup_logging
+from chat_transcript import ChatMessageModel, ChatBubbleDelegate
+from chat_sessions import ChatSessionFile, SESSION_EXTENSION, read_session_tail, convert_json_sessions
+from search_index import FullTextIndex, HIGHLIGHT_START, HIGHLIGHT_END, fuse_results
+
+APP_START = time.perf_counter()
+SESSION_PAGE_SIZE = 200  # Messages read from a saved session at a time, newest first
+RAG_RETRY_MS = 30000  # Delay before loading the index (or reaching the server) again after a failed startup
+
+def record_startup_metric(name):
+    """Log the milliseconds elapsed since process start for a startup milestone and record it as a span."""
+    elapsed_ms = round((time.perf_counter() - APP_START) * 1000, 1)
+    logging.info(f"Startup metric {name}: {elapsed_ms} ms")
+    tracing.record(f"startup.{name}", elapsed_ms)
 
 class RAGWorker(QThread):
     finished = pyqtSignal()
     error = pyqtSignal(str)
+    parse_failed = pyqtSignal(list)  # [(file_name, error)] for files the parser could not read
 
-    def __init__(self, api_token, embedding_model, llm_model, chunk_size, chunk_overlap, role):
+    def __init__(self, **rag_options):
         super().__init__()
-        self.api_token = api_token
-        self.embedding_model = embedding_model
-        self.llm_model = llm_model
-        self.chunk_size = chunk_size
-        self.chunk_overlap = chunk_overlap
-        self.role = role
+        self.rag_options = rag_options
 
     def run(self):
         try:
-            initialize_rag(
-                api_token=self.api_token,
-                embedding_model=self.embedding_model,
-                llm_model=self.llm_model,
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                role = self.role
-            )
+            failed_files = initialize_rag(**self.rag_options)
+            if failed_files:
+                self.parse_failed.emit(failed_files)
             self.finished.emit()
         except Exception as e:
             self.error.emit(str(e))
 
+class MaintenanceWorker(QThread):
+    """Run an index-maintenance call (deletion, compaction) off the GUI thread."""
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, func, *args):
+        super().__init__()
+        self.func = func
+        self.args = args
+
+    def run(self):
+        try:
+            self.finished.emit(self.func(*self.args))
+        except Exception as e:
+            self.error.emit(str(e))
+
 class MainWindow(QMainWindow):
-    response_ready = pyqtSignal(str)
+    response_ready = pyqtSignal(int, str, str)  # request id, response, error
+    response_token = pyqtSignal(int, str)  # request id, streamed token
 
     def __init__(self):
         logging.debug("Initializing MainWindow")
@@ -76,26 +99,60 @@ class MainWindow(QMainWindow):
         self.interface_mode = self.config.get("INTERFACE_MODE", "DARK").upper()
         self.internal_folder = self.config.get("DOC_DIR", self.internal_folder)
         self.chat_history_dir = self.config.get("CHAT_DIR", self.chat_history_dir)
-
-        # Initialize RAG
-        logging.debug("Initializing RAG")
-        initialize_rag(
-            api_token=self.api_token,
-            embedding_model=self.embedding_model,
-            llm_model=self.llm_model,
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            role=self.role
-        )
+        self.streaming = self.config.get("STREAMING", True)
+        self.stream_flush_ms = self.config.get("STREAM_FLUSH_MS", 50)
+        self.query_workers = self.config.get("QUERY_WORKERS", 2)
+        self.query_queue_size = self.config.get("QUERY_QUEUE_SIZE", 8)
+        self.query_timeout = self.config.get("QUERY_TIMEOUT", 120)
+        self.search_debounce_ms = self.config.get("SEARCH_DEBOUNCE_MS", 150)
+        self.search_results = self.config.get("SEARCH_RESULTS", 50)
+        self.chat_mode = self.config.get("CHAT_MODE", True)  # Follow-up questions use the conversation so far
+        self.server_url = self.config.get("SERVER_URL", "")  # Empty: load the index in this process
+        tracing.configure(enabled=self.config.get("TRACING", True))  # Spans in traces.jsonl
+
+        # Thin client: queries, uploads and deletions go to a shared server (serve.py) instead of a local index
+        self.rag = RAGClient(self.server_url, timeout=self.query_timeout) if self.server_url else llm_query
 
         # Signals and UI setup
         self.response_ready.connect(self.handle_response)
+        self.response_token.connect(self.handle_response_token)
+        self.stopButton.clicked.connect(self.stop_generating)
+
+        # One scheduler runs every query; answers are delivered in the order they were asked
+        self.query_scheduler = QueryScheduler(
+            max_workers=self.query_workers, max_queue=self.query_queue_size, timeout=self.query_timeout
+        )
+        self.active_queries = {}  # request id -> {"message", "text", "streaming", "started"}
+
+        # The transcript is a model/view list: only visible bubbles are painted
+        self.chat_model = ChatMessageModel(self)
+        self.chatView.setModel(self.chat_model)
+        self.chatView.setItemDelegate(ChatBubbleDelegate(self.chatView, dark=self.interface_mode == "DARK"))
+
+        # Placeholder bubbles share one "Loading..." animation timer
+        self.loading_messages = []
+        self.dot_count = 0
+        self.dot_timer = QTimer(self)
+        self.dot_timer.timeout.connect(self.update_dot_animation)
+
+        # Streamed tokens are buffered and pushed to the bubbles at most every stream_flush_ms
+        self.dirty_streams = set()
+        self.stream_flush_timer = QTimer(self)
+        self.stream_flush_timer.setSingleShot(True)
+        self.stream_flush_timer.setInterval(self.stream_flush_ms)
+        self.stream_flush_timer.timeout.connect(self.flush_stream)
+
         self.uploadButton.clicked.connect(self.upload_files)
         self.sendButton.clicked.connect(self.send_query)
         self.documentList.setContextMenuPolicy(Qt.CustomContextMenu)
         self.documentList.customContextMenuRequested.connect(self.show_context_menu)
         self.splitter.setSizes([200, self.width() - 200])
 
+        # Questions search every document unless limited to one document or shard from the document list
+        self.query_scope = None
+        self.scope_label = QLabel("Searching: all documents")
+        self.statusBar().addPermanentWidget(self.scope_label)
+
         # Enable drag and drop for leftPanel
         self.leftPanel.setAcceptDrops(True)
         self.leftPanel.dragEnterEvent = self.dragEnterEvent
@@ -105,10 +162,18 @@ class MainWindow(QMainWindow):
         self.uploaded_files = []
         self.update_document_list()
 
-        # Chat management panel
-        self.current_session_file = None  # Track the currently loaded/saved chat session file
-        
+        # Chat management panel: each message is appended to the session file as it is added
+        self.chat_session = None  # Created with the first message of a new chat
+        self.conversation_id = 0  # Key of the chat memory; a new one for every cleared or reopened transcript
+        self.session_history_end = 0  # Byte offset where the older, not yet loaded messages end
+        self.session_sync_timer = QTimer(self)
+        self.session_sync_timer.setSingleShot(True)
+        self.session_sync_timer.setInterval(1000)
+        self.session_sync_timer.timeout.connect(self.sync_chat_session)
+
+        convert_json_sessions(self.chat_history_dir)
         self.chatHistoryList.itemClicked.connect(self.load_chat_session)
+        self.chatView.verticalScrollBar().valueChanged.connect(self.on_transcript_scrolled)
         self.load_existing_chat_sessions()
 
         # Connect the new chat button (with '+' symbol) to create a new session.
@@ -117,8 +182,40 @@ class MainWindow(QMainWindow):
         # Connect the settings button
         self.settingsButton.clicked.connect(self.open_settings_window)
 
-        # Connect search bar to filter function
-        self.searchBar.textChanged.connect(self.filter_lists)
+        # Full-text search over chat messages and document chunks, run once typing pauses
+        self.search_index = FullTextIndex(SEARCH_INDEX_PATH)
+        self.search_result_entries = []
+        self.search_generation = 0  # Bumped per search, so late server results of an earlier one are dropped
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.search_debounce_ms)
+        self.search_timer.timeout.connect(self.run_search)
+        self.searchBar.textChanged.connect(lambda: self.search_timer.start())
+        self.searchResultsList.itemClicked.connect(self.open_search_result)
+        self.searchResultsList.hide()
+
+        # Load the RAG index in the background so the window paints immediately;
+        # queries sent before it is ready are queued.
+        self.worker = None
+        self.maintenance_workers = []
+        self.rag_ready = False
+        self.rag_load_error = None  # Why the index failed to load at startup; queries fail fast until it loads
+        self.rag_update_pending = False
+        self.pending_queries = []
+        self.rag_retry_timer = QTimer(self)
+        self.rag_retry_timer.setSingleShot(True)
+        self.rag_retry_timer.setInterval(RAG_RETRY_MS)
+        self.rag_retry_timer.timeout.connect(self.start_rag)
+        self.first_paint_recorded = False
+        self.first_query_recorded = False
+        QTimer.singleShot(0, self.start_rag)
+
+        # Index chat sessions written or changed since the last run
+        self.run_maintenance(self.search_index.sync_sessions, self.chat_history_dir)
+
+    def rag_options(self):
+        """Keyword arguments for initialize_rag built from the current settings."""
+        return rag_options_from_config(self.config)
 
     @staticmethod
     def load_config(config_path):
@@ -149,8 +246,9 @@ class MainWindow(QMainWindow):
         """Populate the document list with files from the internal folder."""
         logging.debug("Updating document list")
         self.documentList.clear()
+        # Files in a subfolder (one shard per course, say) are listed as "folder/file"
         self.uploaded_files = [
-            file for file in os.listdir(self.internal_folder) if file.endswith((".pdf", ".docx", ".txt", ".csv", ".json", ".pptx"))
+            file_name for file_name, _ in list_documents(self.internal_folder, SUPPORTED_EXTENSIONS)
         ]
         self.documentList.addItems(self.uploaded_files)
 
@@ -207,47 +305,129 @@ class MainWindow(QMainWindow):
             self.update_document_list()
             self.run_initialize_rag(new_files)
 
-    def run_initialize_rag(self, new_files):
-        logging.debug(f"Updating RAG with {len(new_files)} new file(s)")
-        self.worker = RAGWorker(
-            api_token=self.api_token,
-            embedding_model=self.embedding_model,
-            llm_model=self.llm_model,
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap
-        )
+    def start_rag(self):
+        """Load the RAG index on the worker thread at startup, or check that the server is reachable."""
+        logging.debug("Initializing RAG")
+        self.statusBar().showMessage("Loading document index...")
+        if self.server_url:
+            self.run_maintenance(self.rag.health, on_done=lambda _: self.on_rag_ready(), on_error=self.on_rag_error)
+            return
+        self.start_rag_worker()
+
+    def start_rag_worker(self):
+        """Run initialize_rag on a RAGWorker, or schedule a rerun if one is already busy."""
+        if self.worker is not None and self.worker.isRunning():
+            self.rag_update_pending = True
+            return
+        self.worker = RAGWorker(**self.rag_options())
         self.worker.finished.connect(self.on_rag_finished)
         self.worker.error.connect(self.on_rag_error)
+        self.worker.parse_failed.connect(self.on_parse_failed)
         self.worker.start()
         logging.debug("RAG update started")
+
+    def run_initialize_rag(self, new_files):
+        logging.debug(f"Updating RAG with {len(new_files)} new file(s)")
+        if self.server_url:
+            paths = [os.path.join(self.internal_folder, file_name) for file_name in new_files]
+            self.run_maintenance(self.rag.upload_documents, paths, on_done=self.on_documents_uploaded)
+        else:
+            self.start_rag_worker()
         QMessageBox.information(self, "RAG Update", "Updating RAG database in the background.")
 
     def on_rag_finished(self):
+        if not self.rag_ready:
+            self.on_rag_ready()
+        else:
+            logging.info("RAG update completed")
+            QMessageBox.information(self, "RAG Update", "RAG database update completed successfully!")
+        if self.rag_update_pending:
+            self.rag_update_pending = False
+            self.start_rag_worker()
+
+    def on_rag_ready(self):
+        """Mark the index as ready and send any queries queued during startup."""
+        logging.info("RAG index ready")
+        record_startup_metric("time_to_index_ready")
+        self.rag_ready = True
+        self.rag_load_error = None
+        self.rag_retry_timer.stop()
+        self.statusBar().showMessage("Ready", 3000)
+        pending, self.pending_queries = self.pending_queries, []
+        for user_input, message in pending:
+            self.submit_query(user_input, message)
+
+    def on_documents_uploaded(self, failed_files):
+        """Report the result of uploading documents to the server."""
+        if failed_files:
+            self.on_parse_failed(failed_files)
         logging.info("RAG update completed")
         QMessageBox.information(self, "RAG Update", "RAG database update completed successfully!")
 
+    def on_parse_failed(self, failed_files):
+        """Report files the parser could not read; the rest of the update still applies."""
+        details = "\n".join(f"{file_name}: {error}" for file_name, error in failed_files)
+        logging.warning(f"Skipped unreadable documents:\n{details}")
+        QMessageBox.warning(self, "Unreadable Documents", f"These documents could not be read and were skipped:\n{details}")
+
     def on_rag_error(self, error_message):
         logging.error(f"RAG update failed: {error_message}")
+        if not self.rag_ready:
+            # Queued and later questions fail with the error until a retry loads the index
+            first_failure = self.rag_load_error is None
+            self.rag_load_error = error_message
+            pending, self.pending_queries = self.pending_queries, []
+            for _, message in pending:
+                self.finish_bubble(message, f"Error: document index failed to load. {error_message}")
+            self.statusBar().showMessage(f"Document index failed to load, retrying in {RAG_RETRY_MS // 1000} s")
+            self.rag_retry_timer.start()
+            if not first_failure:
+                return
         QMessageBox.critical(self, "RAG Update Error", f"RAG database update failed.\n{error_message}")
 
     def show_context_menu(self, position):
         """Show context menu for the document list."""
         logging.debug("Showing context menu")
         item = self.documentList.itemAt(position)
+        menu = QMenu()
+        open_action = delete_action = document_scope_action = shard_scope_action = all_scope_action = None
         if item:
-            menu = QMenu()
             open_action = menu.addAction("Open File")
             delete_action = menu.addAction("Delete File")
-            selected_action = menu.exec_(self.documentList.mapToGlobal(position))
-            if selected_action == delete_action:
-                self.delete_file(item)
-            elif selected_action == open_action:
-                self.open_file(item)
+            menu.addSeparator()
+            document_scope_action = menu.addAction("Ask About This Document Only")
+            if shard_of(item.text()) != DEFAULT_SHARD:
+                shard_scope_action = menu.addAction(f"Ask About '{shard_of(item.text())}' Only")
+        if self.query_scope is not None:
+            all_scope_action = menu.addAction("Ask About All Documents")
+        menu.addSeparator()
+        compact_action = menu.addAction("Compact Index")
+        selected_action = menu.exec_(self.documentList.mapToGlobal(position))
+        if selected_action is None:
+            return
+        if selected_action == delete_action:
+            self.delete_file(item)
+        elif selected_action == open_action:
+            self.open_file(item)
+        elif selected_action == document_scope_action:
+            self.set_query_scope({"document": item.text()}, item.text())
+        elif selected_action == shard_scope_action:
+            self.set_query_scope({"shards": [shard_of(item.text())]}, f"{shard_of(item.text())}/")
+        elif selected_action == all_scope_action:
+            self.set_query_scope(None, "all documents")
+        elif selected_action == compact_action:
+            self.compact_index()
+
+    def set_query_scope(self, scope, label):
+        """Limit the next questions to one document or shard, or search everything again (scope None)."""
+        self.query_scope = scope
+        self.scope_label.setText(f"Searching: {label}")
+        logging.info(f"Query scope set to {label}")
 
     def open_file(self, item):
         """Open the selected file."""
         file_name = item.text()
-        file_path = os.path.join(self.internal_folder, file_name)
+        file_path = document_path(self.internal_folder, file_name)
         logging.debug(f"Opening file: {file_name}")
         try:
             os.startfile(file_path)  # For Windows
@@ -260,7 +440,7 @@ class MainWindow(QMainWindow):
     def delete_file(self, item):
         """Delete the selected file."""
         file_name = item.text()
-        file_path = os.path.join(self.internal_folder, file_name)
+        file_path = document_path(self.internal_folder, file_name)
         logging.debug(f"Deleting file: {file_name}")
 
         if QMessageBox.question(
@@ -271,41 +451,89 @@ class MainWindow(QMainWindow):
                 os.remove(file_path)
                 self.documentList.takeItem(self.documentList.row(item))
                 self.uploaded_files.remove(file_name)
+                if self.query_scope == {"document": file_name}:
+                    self.set_query_scope(None, "all documents")
                 logging.info(f"Deleted file: {file_name}")
+                self.run_maintenance(self.rag.delete_document, file_name, on_done=lambda removed: self.statusBar().showMessage(
+                    f"Removed {removed} chunk(s) of '{file_name}' from the index", 5000
+                ))
                 QMessageBox.information(self, "Delete Successful", f"'{file_name}' has been deleted.")
             except Exception as e:
                 logging.error(f"Failed to delete '{file_name}': {e}")
                 QMessageBox.critical(self, "Error", f"Failed to delete '{file_name}'.\n{str(e)}")
 
+    def run_maintenance(self, func, *args, on_done=None, on_error=None):
+        """Run an index-maintenance call on a background worker; on_error replaces the error dialog."""
+        worker = MaintenanceWorker(func, *args)
+        self.maintenance_workers.append(worker)
+
+        def finished(result):
+            self.maintenance_workers.remove(worker)
+            if on_done is not None:
+                on_done(result)
+
+        def failed(error_message):
+            self.maintenance_workers.remove(worker)
+            if on_error is not None:
+                on_error(error_message)
+                return
+            logging.error(f"Index maintenance failed: {error_message}")
+            QMessageBox.critical(self, "Index Maintenance Error", f"Index maintenance failed.\n{error_message}")
+
+        worker.finished.connect(finished)
+        worker.error.connect(failed)
+        worker.start()
+
+    def compact_index(self):
+        """Drop orphaned vectors and docstore entries in the background and report the effect."""
+        logging.info("Compacting index")
+        self.statusBar().showMessage("Compacting index...")
+        self.run_maintenance(self.rag.compact_index, on_done=self.on_compaction_finished)
+
+    def on_compaction_finished(self, result):
+        before, after = result["before"], result["after"]
+        rows = [
+            ("Shards", "shards", ""),
+            ("Vectors", "vectors", ""),
+            ("Docstore entries", "docstore_entries", ""),
+            ("Keyword index nodes", "keyword_nodes", ""),
+            ("Disk usage", "disk_mb", " MB"),
+            ("Search latency", "query_latency_ms", " ms"),
+        ]
+        report = "\n".join(f"{label}: {before[key]}{unit} → {after[key]}{unit}" for label, key, unit in rows)
+        self.statusBar().clearMessage()
+        QMessageBox.information(
+            self, "Index Compacted", f"Removed {result['removed_vectors']} orphaned vector(s).\n\n{report}"
+        )
+
     def show_dot_animation(self):
-        """Show a loading animation while waiting for the response."""
+        """Show a loading bubble while waiting for a response and return it."""
         logging.debug("Showing dot animation")
-        self.dot_label = QLabel("Loading")
-        if self.interface_mode == "DARK":
-            self.dot_label.setStyleSheet("background-color: #121212; border-radius: 10px; padding: 10px;")
-        else:
-            self.dot_label.setStyleSheet("background-color: white; border-radius: 10px; padding: 10px;")
-
-        self.add_message(self.dot_label, sender="model")
-
-        self.dot_timer = QTimer(self)
-        self.dot_count = 0
-        self.dot_timer.timeout.connect(self.update_dot_animation)
-        self.dot_timer.start(500)
+        message = self.add_message("Loading", sender="model", loading=True)
+        self.loading_messages.append(message)
+        if not self.dot_timer.isActive():
+            self.dot_timer.start(500)
+        return message
 
     def update_dot_animation(self):
         """Update the dot animation."""
         self.dot_count = (self.dot_count + 1) % 4
-        self.dot_label.setText("Loading" + "." * self.dot_count)
+        for message in self.loading_messages:
+            self.chat_model.set_text(message, "Loading" + "." * self.dot_count, loading=True)
 
-    def remove_dot_animation(self):
-        """Remove the dot animation."""
+    def remove_dot_animation(self, message):
+        """Stop animating a loading bubble."""
         logging.debug("Removing dot animation")
-        if hasattr(self, "dot_timer"):
+        if message in self.loading_messages:
+            self.loading_messages.remove(message)
+        if not self.loading_messages:
             self.dot_timer.stop()
-        if hasattr(self, "dot_label"):
-            self.chatLayout.removeWidget(self.dot_label)
-            self.dot_label.deleteLater()
+
+    def finish_bubble(self, message, text):
+        """Turn a loading bubble into the model's answer."""
+        self.remove_dot_animation(message)
+        self.chat_model.set_text(message, text)
+        self.save_message(message)
 
     def send_query(self):
         """Send a query to the LLM and handle the response."""
@@ -317,129 +545,161 @@ class MainWindow(QMainWindow):
         logging.debug(f"Sending query: {user_input}")
         self.add_message(user_input, sender="user")
         self.promptInput.clear()
-        self.show_dot_animation()
-
-        def query_llm():
-            return str(hugging_face_query(user_input, self.role))
+        message = self.show_dot_animation()
 
-        executor = ThreadPoolExecutor(max_workers=1)
-        future = executor.submit(query_llm)
-        future.add_done_callback(lambda f: self.response_ready.emit(f.result()))
-
-    def handle_response(self, response):
-        """Handle the response from the LLM."""
-        logging.debug(f"Handling response: {response}")
-        self.remove_dot_animation()
-        self.add_message(response, sender="model")
-
-    def add_message(self, text_or_widget, sender):
-        """Add a message bubble or widget to the chat layout."""
-        logging.debug(f"Adding message from {sender}")
-        if isinstance(text_or_widget, str):
-            # Create a QLabel for text and store the sender info.
-            label = QLabel(text_or_widget)
-            label.setWordWrap(True)
-            label.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
-            label.setProperty("sender", sender)
-
-            # Use QFontMetrics to compute the width of the text.
-            font_metrics = label.fontMetrics()
-            text_width = font_metrics.boundingRect(text_or_widget).width()
-            padding = 40  # extra space for padding
-            if sender == "user":
-                max_width = 500
-            else:
-                max_width = 1300
-            
-            # Calculate the desired width including padding.
-            desired_width = text_width + padding
-
-            # If the desired width is less than the maximum, fix the width to that.
-            # Otherwise, allow the label to use the maximum width so that text wraps.
-            if desired_width < max_width:
-                label.setFixedWidth(desired_width)
-            else:
-                label.setMaximumWidth(max_width)
-            
-            # Apply styling based on sender and interface mode.
-            if self.interface_mode == "DARK":
-                user_color = "#228B22"
-                model_color = "#121212"
+        if not self.rag_ready and self.rag_load_error is not None:
+            self.finish_bubble(message, f"Error: document index failed to load. {self.rag_load_error}")
+            return
+        if not self.rag_ready:
+            logging.debug("Index not ready, queueing query")
+            self.pending_queries.append((user_input, message))
+            self.stopButton.setEnabled(True)
+            self.statusBar().showMessage("Loading document index... your question will be answered when it is ready.")
+            return
+        self.submit_query(user_input, message)
+
+    def submit_query(self, user_input, message):
+        """Schedule a query on the shared query scheduler; its answer fills the given bubble."""
+        role = self.role
+        conversation_id = self.conversation_id
+        scope = self.query_scope
+
+        def run_query(request_id, cancel_event):
+            if not self.streaming:
+                if self.chat_mode:
+                    return str(self.rag.chat_query(user_input, role, conversation_id, cancel_event, scope=scope))
+                return str(self.rag.hugging_face_query(user_input, role, cancel_event, scope=scope))
+            if self.chat_mode:
+                tokens = self.rag.chat_query_stream(user_input, role, conversation_id, cancel_event, scope=scope)
             else:
-                user_color = "#adf0ad"
-                model_color = "white"
+                tokens = self.rag.hugging_face_query_stream(user_input, role, cancel_event, scope=scope)
+            for token in tokens:
+                self.response_token.emit(request_id, token)
+            return None  # The streamed text is already held by the GUI
 
-            if sender == "user":
-                label.setStyleSheet(f"background-color: {user_color}; border-radius: 10px; padding: 10px;")
-                alignment = Qt.AlignRight
-            else:
-                label.setStyleSheet(f"background-color: {model_color}; border-radius: 10px; padding: 10px;")
-                alignment = Qt.AlignLeft
+        def on_done(request_id, result, error):
+            self.response_ready.emit(request_id, result or "", str(error) if error else "")
 
-            label.adjustSize()
-            label.setFixedHeight(label.sizeHint().height())
-        else:
-            # If a widget is passed in, assume it's a QLabel or similar.
-            label = text_or_widget
-            label.setProperty("sender", sender)
-            alignment = Qt.AlignLeft
-
-        # Create a container widget for alignment and add the label.
-        container = QWidget()
-        layout = QHBoxLayout(container)
-        layout.addWidget(label)
-        layout.setAlignment(alignment)
-        layout.setContentsMargins(0, 0, 0, 10)
-        self.chatLayout.addWidget(container)
-
-        # Adjust sizes if needed.
-        container.adjustSize()
-        label.adjustSize()
-
-    def save_current_chat_session(self):
-        """Save the current chat session to a JSON file with sender information, but only if the chat space is not empty."""
-        os.makedirs(self.chat_history_dir, exist_ok=True)
-
-        session_data = []
-        for i in range(self.chatLayout.count()):
-            container = self.chatLayout.itemAt(i).widget()
-            if container:
-                label = container.findChild(QLabel)
-                if label:
-                    sender = label.property("sender")
-                    message_text = label.text()
-                    session_data.append({"sender": sender, "message": message_text})
-
-        # Do not save if there is no chat content.
-        if not session_data:
-            logging.info("Chat session is empty, nothing to save.")
+        try:
+            request_id = self.query_scheduler.submit(run_query, on_done)
+        except QueryQueueFull as e:
+            logging.warning(f"Query rejected: {e}")
+            self.finish_bubble(message, "Error: too many questions in progress. Please wait for an answer first.")
             return
-
-        # Determine the session file path.
-        if self.current_session_file:
-            session_path = self.current_session_file
-        else:
-            session_name = f"chat_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            session_path = os.path.join(self.chat_history_dir, session_name)
-            self.current_session_file = session_path
-
+        logging.debug(f"Submitted query {request_id}")
+        self.active_queries[request_id] = {
+            "message": message, "text": "", "streaming": False, "started": time.perf_counter()
+        }
+        self.stopButton.setEnabled(True)
+
+    def handle_response(self, request_id, response, error):
+        """Handle the (final) response from the LLM for a query."""
+        logging.debug(f"Handling response {request_id} ({len(response or '')} chars)")
+        query = self.active_queries.pop(request_id, None)
+        if query is None:
+            return
+        self.dirty_streams.discard(request_id)
+        text = response or query["text"]
+        if error:
+            text = f"{text}\n\n[{error}]" if text else f"Error: {error}"
+        self.finish_bubble(query["message"], text)
+        self.stopButton.setEnabled(bool(self.active_queries or self.pending_queries))
+        self.on_query_answered()
+
+    def handle_response_token(self, request_id, token):
+        """Append a streamed token to its query's bubble, coalescing relayouts."""
+        query = self.active_queries.get(request_id)
+        if query is None:
+            return
+        if not query["streaming"]:
+            query["streaming"] = True
+            logging.info(f"Time to first token: {(time.perf_counter() - query['started']) * 1000:.0f} ms")
+            self.remove_dot_animation(query["message"])
+        query["text"] += token
+        self.dirty_streams.add(request_id)
+        if not self.stream_flush_timer.isActive():
+            self.stream_flush_timer.start()
+
+    def flush_stream(self):
+        """Push buffered streamed text into the bubbles that changed."""
+        for request_id in self.dirty_streams:
+            query = self.active_queries.get(request_id)
+            if query is not None:
+                self.chat_model.set_text(query["message"], query["text"])
+        self.dirty_streams.clear()
+        self.scroll_to_bottom()
+
+    def stop_generating(self):
+        """Cancel every queued and in-flight query, aborting any open LLM stream."""
+        logging.info("Stopping generation")
+        pending, self.pending_queries = self.pending_queries, []
+        for _, message in pending:
+            self.finish_bubble(message, "[Stopped]")
+        self.query_scheduler.cancel_all()
+
+    def on_query_answered(self):
+        if not self.first_query_recorded:
+            self.first_query_recorded = True
+            record_startup_metric("time_to_first_query")
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint_recorded:
+            self.first_paint_recorded = True
+            record_startup_metric("time_to_first_paint")
+
+    @tracing.traced("gui.add_message")
+    def add_message(self, text, sender, loading=False):
+        """Append a message bubble to the transcript and return it."""
+        logging.debug(f"Adding message from {sender}")
+        message = self.chat_model.append_message(sender, text, loading=loading)
+        if not loading:
+            self.save_message(message)
+        self.scroll_to_bottom()
+        return message
+
+    def save_message(self, message):
+        """Append a finished message to the session file, creating the file for a new chat."""
+        if message.row is None:
+            return  # The transcript it belonged to has been cleared
         try:
-            with open(session_path, "w", encoding="utf-8") as file:
-                json.dump(session_data, file, indent=2)
-            logging.info(f"Chat session saved as {session_path}")
-            
-            # Prevent duplicate chat history entries
-            session_file_name = os.path.basename(session_path)
-            session_base_name, _ = os.path.splitext(session_file_name)
-
-            # Check if it already exists in the chat history list
-            existing_items = [self.chatHistoryList.item(i).text() for i in range(self.chatHistoryList.count())]
-            if session_base_name not in existing_items:
+            if self.chat_session is None:
+                os.makedirs(self.chat_history_dir, exist_ok=True)
+                session_base_name = f"chat_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                while os.path.exists(os.path.join(self.chat_history_dir, session_base_name + SESSION_EXTENSION)):
+                    session_base_name += "_1"
+                self.chat_session = ChatSessionFile(
+                    os.path.join(self.chat_history_dir, session_base_name + SESSION_EXTENSION)
+                )
                 self.chatHistoryList.addItem(session_base_name)
+                logging.info(f"Chat session saved as {self.chat_session.path}")
+            self.chat_session.append(message.index, message.sender, message.text)
+        except OSError as e:
+            logging.error(f"Error saving chat message: {e}")
+            self.statusBar().showMessage(f"Could not save chat message: {e}", 5000)
+            return
+        if not self.session_sync_timer.isActive():
+            self.session_sync_timer.start()
 
-        except Exception as e:
-            logging.error(f"Error saving chat session: {e}")
-            QMessageBox.critical(self, "Save Error", f"Could not save chat session:\n{str(e)}")
+        # Sessions are re-indexed from their files at startup, so a failure here is only logged
+        session_name = os.path.splitext(os.path.basename(self.chat_session.path))[0]
+        try:
+            self.search_index.add_message(session_name, message.index, message.sender, message.text)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not add chat message to the search index: {e}")
+
+    def sync_chat_session(self):
+        """fsync messages appended since the last sync."""
+        if self.chat_session is not None:
+            self.chat_session.sync()
+
+    def close_chat_session(self):
+        """Flush and close the current session file; its messages are already saved."""
+        self.session_sync_timer.stop()
+        if self.chat_session is not None:
+            self.chat_session.close()
+            self.chat_session = None
+        self.session_history_end = 0
 
     def load_existing_chat_sessions(self):
         """Load saved chat sessions into the chat history list."""
@@ -450,61 +710,89 @@ class MainWindow(QMainWindow):
         self.chatHistoryList.clear()
         for session in session_files:
             file_name, ext = os.path.splitext(session)
-            self.chatHistoryList.addItem(file_name)
+            if ext == SESSION_EXTENSION:
+                self.chatHistoryList.addItem(file_name)
 
     def load_chat_session(self, item):
-        """Load a selected chat session from a JSON file into the chat layout and scroll to the bottom."""
-        session_name = item.text() + ".json"
+        """Open the chat session selected in the chat history list."""
+        self.open_chat_session(item.text())
+
+    def open_chat_session(self, session_base_name, position=None):
+        """Load the newest messages of a saved chat session and scroll to the bottom.
+
+        With ``position``, pages are read back until that message is loaded and
+        it is scrolled into view instead. Older messages are read a page at a
+        time when the transcript is scrolled to the top.
+        """
+        session_name = session_base_name + SESSION_EXTENSION
         session_path = os.path.join(self.chat_history_dir, session_name)
 
         try:
-            with open(session_path, "r", encoding="utf-8") as file:
-                session_data = json.load(file)
+            messages, history_end = read_session_tail(session_path, SESSION_PAGE_SIZE)
+            while position is not None and history_end and all(index != position for index, _, _ in messages):
+                older_messages, history_end = read_session_tail(session_path, SESSION_PAGE_SIZE, end=history_end)
+                messages = older_messages + messages
+        except Exception as e:
+            logging.error(f"Error loading chat session {session_name}: {e}")
+            QMessageBox.critical(self, "Load Error", f"Could not load chat session:\n{str(e)}")
+            return
 
-            self.clear_chat_layout()
+        self.clear_chat_layout()
+        self.chat_model.set_messages(messages)
 
-            # Re-add each message to the chat layout with the appropriate sender.
-            for entry in session_data:
-                sender = entry.get("sender", "model")
-                message_text = entry.get("message", "")
-                self.add_message(message_text, sender=sender)
+        # Follow-up questions continue from the newest loaded turns
+        turns = [
+            (question[2], answer[2]) for question, answer in zip(messages, messages[1:])
+            if question[1] == "user" and answer[1] == "model"
+        ]
+        self.rag.start_chat(self.conversation_id, turns)
 
-            # Scroll to the bottom after loading messages
-            QTimer.singleShot(100, self.scroll_to_bottom)
+        # New messages are appended to the same file
+        self.chat_session = ChatSessionFile(session_path)
 
-            # Set the current session file so new messages are saved to the same file.
-            self.current_session_file = session_path
+        # Scroll once the messages are laid out, then allow older pages to load
+        def scrolled_into_place():
+            row = self.chat_model.row_for_index(position) if position is not None else None
+            if row is None:
+                self.scroll_to_bottom()
+            else:
+                self.chatView.scrollTo(self.chat_model.index(row), QAbstractItemView.PositionAtCenter)
+            self.session_history_end = history_end
 
-        except Exception as e:
-            logging.error(f"Error loading chat session {session_name}: {e}")
-            QMessageBox.critical(self, "Load Error", f"Could not load chat session:\n{str(e)}")
+        QTimer.singleShot(100, scrolled_into_place)
+
+    def on_transcript_scrolled(self, value):
+        """Load the previous page of a saved session when the transcript reaches the top."""
+        if value != 0 or not self.session_history_end or self.chat_session is None:
+            return
+        messages, self.session_history_end = read_session_tail(
+            self.chat_session.path, SESSION_PAGE_SIZE, end=self.session_history_end
+        )
+        scrollbar = self.chatView.verticalScrollBar()
+        previous_maximum = scrollbar.maximum()
+        self.chat_model.insert_messages(messages)
+        # Keep the previously first message in view once the new rows are laid out
+        QTimer.singleShot(0, lambda: scrollbar.setValue(scrollbar.maximum() - previous_maximum))
 
     def clear_chat_layout(self):
-        """Clear all messages from the chat layout."""
-        while self.chatLayout.count():
-            item = self.chatLayout.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.deleteLater()
-                
-    def new_chat_session(self):
-        """Prompt the user before starting a new chat session to avoid accidental overwrites."""
-        if self.chatLayout.count() > 0:
-            reply = QMessageBox.question(
-                self, "Save Chat", 
-                "Do you want to save the current chat before starting a new session?",
-                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
-            )
-            if reply == QMessageBox.Yes:
-                self.save_current_chat_session()
+        """Clear all messages from the transcript."""
+        self.stop_generating()
+        self.close_chat_session()
+        self.rag.end_chat(self.conversation_id)
+        self.conversation_id += 1
+        self.loading_messages.clear()
+        self.dot_timer.stop()
+        self.chat_model.clear()
 
-        self.current_session_file = None  # Ensure new chat session starts fresh
+    def new_chat_session(self):
+        """Start a new chat session; the current one has already been saved message by message."""
         logging.info("Starting a new chat session.")
         self.clear_chat_layout()
 
     def closeEvent(self, event):
-        # Optionally prompt the user to save the current session
-        self.save_current_chat_session()
+        # Every message is already saved; flush the last ones to disk
+        self.close_chat_session()
+        self.query_scheduler.shutdown()
         event.accept()
 
     def open_settings_window(self):
@@ -513,6 +801,69 @@ class MainWindow(QMainWindow):
         self.settings_window = SettingsWindow(parent=self)
         self.settings_window.exec_()
 
+    @tracing.traced("gui.search")
+    def run_search(self):
+        """Filter the lists by name and show the best full-text matches in chats and documents."""
+        self.filter_lists()
+        query = self.searchBar.text().strip()
+        self.searchResultsList.clear()
+        self.search_result_entries = []
+        self.search_generation += 1
+        if not query:
+            self.searchResultsList.hide()
+            return
+
+        # Ranking every match of a common word takes a few hundred ms, so searches run off the GUI thread.
+        # With a server, chats are searched here and documents in the server's index.
+        generation = self.search_generation
+        kinds = ("chat",) if self.server_url else ("chat", "document")
+        self.run_maintenance(
+            self.search_index.search, query, self.search_results, kinds,
+            on_done=lambda results: self.add_search_results(generation, results),
+            on_error=lambda error: logging.error(f"Search failed: {error}"),
+        )
+        if self.server_url:
+            self.run_maintenance(
+                self.rag.search_documents, query, self.search_results,
+                on_done=lambda results: self.add_search_results(generation, results),
+                on_error=lambda error: logging.warning(f"Document search on the server failed: {error}"),
+            )
+
+    def add_search_results(self, generation, results):
+        """Merge matches into the shown results, unless another search has started since."""
+        if generation != self.search_generation:
+            return
+        # Chat and document ranks come from different indexes, so each kind is fused by its own order
+        kinds = {}
+        for result in self.search_result_entries + results:
+            kinds.setdefault(result.kind, []).append(result)
+        self.search_result_entries = fuse_results(list(kinds.values()), self.search_results)
+        self.show_search_results()
+
+    def show_search_results(self):
+        self.searchResultsList.clear()
+        for result in self.search_result_entries:
+            title = result.source if result.kind == "document" else f"{result.source} ({result.sender})"
+            snippet = html.escape(result.snippet).replace(HIGHLIGHT_START, "<b>").replace(HIGHLIGHT_END, "</b>")
+            label = QLabel(f"<small>{html.escape(title)}</small><br>{snippet}")
+            label.setTextFormat(Qt.RichText)
+            label.setWordWrap(True)
+            item = QListWidgetItem()
+            item.setSizeHint(label.sizeHint())
+            self.searchResultsList.addItem(item)
+            self.searchResultsList.setItemWidget(item, label)
+        self.searchResultsList.setVisible(bool(self.search_result_entries))
+
+    def open_search_result(self, item):
+        """Open the chat session at the matching message, or the matching document."""
+        result = self.search_result_entries[self.searchResultsList.row(item)]
+        if result.kind == "chat":
+            self.open_chat_session(result.source, position=result.position)
+            return
+        matches = self.documentList.findItems(result.source, Qt.MatchExactly)
+        if matches:
+            self.open_file(matches[0])
+
     def filter_lists(self):
         """Filter the documentList and chatHistoryList based on searchBar input."""
         search_text = self.searchBar.text().strip().lower()
@@ -528,9 +879,8 @@ class MainWindow(QMainWindow):
             item.setHidden(search_text not in item.text().lower())
 
     def scroll_to_bottom(self):
-        """Ensure the chat scroll area always scrolls to the latest message."""
-        scrollbar = self.chatScrollArea.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+        """Ensure the transcript always scrolls to the latest message."""
+        self.chatView.scrollToBottom()
 
     def on_role_change(self, index):
         """Handle changes in the role dropdown and disable document uploads when role is Teacher."""
@@ -539,21 +889,9 @@ class MainWindow(QMainWindow):
         QMessageBox.information(self, "Role Changed", f"Now the LLM model is in {self.role} mode")
         logging.info(f"Role switched to: {self.role}")
         
-        # Reinitialize RAG with current settings
-        try:
-            initialize_rag(
-                api_token=self.api_token,
-                embedding_model=self.embedding_model,
-                llm_model=self.llm_model,
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                role=self.role
-            )
-            logging.info("RAG reinitialized successfully after role change")
-        except Exception as e:
-            logging.error(f"Error reinitializing RAG: {e}")
-            QMessageBox.critical(self, "RAG Error", f"Error reinitializing RAG:\n{str(e)}")
-        
+        # The loaded index is shared; hugging_face_query picks the role's prompts and retrieval settings,
+        # so no RAG reinitialization is needed here.
+
         # Disable or enable document uploads based on the role
         if self.role == "Teacher":
             self.uploadButton.setEnabled(False)
@@ -576,11 +914,21 @@ def load_stylesheet(file_path):
 
 
 def main():
-    logging.debug("Starting application")
-
     # Load configuration
     with open("config.yaml", "r") as config_file:
         config = yaml.safe_load(config_file)
+
+    # Configure logging: records are queued and written to application.log by a background thread
+    setup_logging(
+        "application.log",
+        level=config.get("LOG_LEVEL", "INFO"),
+        max_bytes=config.get("LOG_MAX_MB", 5) * 1024 * 1024,
+        backup_count=config.get("LOG_BACKUP_COUNT", 5),
+        rotate_hours=config.get("LOG_ROTATE_HOURS", 24),
+        max_message_chars=config.get("LOG_MAX_MESSAGE_CHARS", 2000),
+        rate_limit=config.get("LOG_RATE_LIMIT", 20),
+    )
+    logging.debug("Starting application")
     
     # Determine the interface mode
     interface_mode = config.get("INTERFACE_MODE", "DARK").upper()
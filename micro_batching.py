@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import CustomLLM, LLMMetadata
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collect calls arriving within ``max_wait_ms`` (at most ``max_batch_size``) into one batched call.
+
+    ``process_batch(items)`` returns one result per item; identical items in
+    a batch are processed once. The first caller of a batch waits for the
+    window to close, runs the batch on its own thread and fans the results
+    out to the others, so batches can overlap without a dispatcher thread.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=10):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._lock = threading.Lock()
+        self._open = None  # Batch still accepting items
+
+    def submit(self, item):
+        """Add an item to the open batch and return its result once the batch has run."""
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            position = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+                self.batches += 1
+                self.items += len(batch.items)
+            self._run(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+    def _run(self, batch):
+        try:
+            unique = list(dict.fromkeys(batch.items))
+            results = dict(zip(unique, self.process_batch(unique)))
+            batch.results = [results[item] for item in batch.items]
+        except Exception as e:
+            logger.warning(f"Batch of {len(batch.items)} failed: {e}")
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch": self.items / self.batches if self.batches else 0.0,
+            }
+
+
+class SingleFlight:
+    """Run a call once for all callers asking for the same key while it is in flight."""
+
+    def __init__(self):
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the running call
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def hf_query_embedder(embed_model, token=None, timeout=None):
+    """Return embed_queries(queries) that sends one feature-extraction request for all queries.
+
+    Queries are formatted and pooled like HuggingFaceInferenceAPIEmbedding,
+    which sends a request per text.
+    """
+    from huggingface_hub import InferenceClient
+    from llama_index.utils.huggingface import format_query
+    client = InferenceClient(model=embed_model.model_name, token=token or None, timeout=timeout)
+
+    def embed_queries(queries):
+        vectors = client.feature_extraction(
+            [format_query(query, embed_model.model_name, embed_model.query_instruction) for query in queries]
+        )
+        if vectors.ndim == 3:  # Token embeddings of a model that does not pool itself
+            return [embed_model.pooling(vector).tolist() for vector in vectors]
+        return vectors.tolist()
+
+    return embed_queries
+
+
+class BatchedEmbedding(BaseEmbedding):
+    """Wrap an embedding model so concurrent query embeddings go out as one batched request.
+
+    ``embed_queries(queries)`` embeds a list of queries in one call. Texts
+    are already batched by EmbeddingPipeline and pass straight through.
+    """
+
+    _embed_model: Any = PrivateAttr()
+    _batcher: Any = PrivateAttr()
+
+    def __init__(self, embed_model, embed_queries, max_batch_size=16, max_wait_ms=10, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._batcher = MicroBatcher(embed_queries, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedEmbedding"
+
+    def batch_stats(self):
+        return self._batcher.stats()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._batcher.submit(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        # submit() blocks until the batch has run, which would stall the event loop for every other caller
+        return await asyncio.to_thread(self._batcher.submit, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed_model._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._embed_model._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_model._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._embed_model._aget_text_embeddings(texts)
+
+
+class CoalescingLLM(CustomLLM):
+    """Wrap an LLM so identical concurrent generations run once and at most ``max_in_flight`` run at a time.
+
+    Text-generation endpoints and llama.cpp take one prompt per request, so
+    generations cannot be sent as one batch. Instead, a caller whose prompt
+    (e.g. the same question over the same retrieved context) is already
+    being answered waits for that answer, and the cap keeps a burst of users
+    under the API's rate limit. Streams are capped but not shared.
+    Callback events are fired by the wrapped LLM.
+    """
+
+    _llm: Any = PrivateAttr()
+    _calls: Any = PrivateAttr()
+    _slots: Any = PrivateAttr()
+
+    def __init__(self, llm, max_in_flight=4, **kwargs):
+        super().__init__(**kwargs)
+        self._llm = llm
+        self._calls = SingleFlight()
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CoalescingLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    @property
+    def shared_calls(self):
+        return self._calls.shared
+
+    def _limited(self, fn, *args, **kwargs):
+        if self._slots is None:
+            return fn(*args, **kwargs)
+        with self._slots:
+            return fn(*args, **kwargs)
+
+    def _limited_stream(self, fn, *args, **kwargs):
+        def gen():
+            # The slot is held until the stream finishes or is closed (cancelled)
+            if self._slots is not None:
+                self._slots.acquire()
+            try:
+                yield from fn(*args, **kwargs)
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+
+        return gen()
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        key = ("complete", prompt, formatted, repr(sorted(kwargs.items())))
+        return self._calls.do(key, self._limited, self._llm.complete, prompt, formatted=formatted, **kwargs)
+
+    def chat(self, messages, **kwargs):
+        key = (
+            "chat", tuple((str(message.role), message.content) for message in messages), repr(sorted(kwargs.items()))
+        )
+        return self._calls.do(key, self._limited, self._llm.chat, messages, **kwargs)
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        return self._limited_stream(self._llm.stream_complete, prompt, formatted=formatted, **kwargs)
+
+    def stream_chat(self, messages, **kwargs):
+        return self._limited_stream(self._llm.stream_chat, messages, **kwargs)
@@ -0,0 +1,75 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from llama_index.core import SimpleDirectoryReader
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_file(path):
+    """Parse a single file into documents (runs in a worker process)."""
+    return SimpleDirectoryReader(input_files=[path]).load_data()
+
+
+def default_workers():
+    """Number of parser processes to use when none is configured."""
+    return max(1, (os.cpu_count() or 1))
+
+
+def iter_parsed_files(paths, max_workers=None):
+    """Parse files in a process pool, yielding (path, documents, error) as each file finishes.
+
+    A parser that raises only fails its own file. A parser that kills its
+    worker process breaks the whole pool; the unfinished files are then
+    split in half and each half parsed in its own pool, halving again only
+    the halves that crash, until the crashing file is alone. Files in halves
+    that do not crash keep being parsed in parallel.
+    """
+    paths = list(paths)
+    max_workers = max_workers or default_workers()
+
+    # A single file is not worth the cost of starting a pool
+    if len(paths) == 1 or max_workers == 1:
+        for path in paths:
+            try:
+                yield path, _parse_file(path), None
+            except Exception as e:
+                logger.error(f"Failed to parse {path}: {e}")
+                yield path, None, e
+        return
+
+    batches = [paths]
+    while batches:
+        batch = batches.pop()
+        pool = ProcessPoolExecutor(max_workers=min(max_workers, len(batch)))
+        futures = {pool.submit(_parse_file, path): path for path in batch}
+        unfinished = set(batch)
+        crashed = False
+        try:
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    documents = future.result()
+                except BrokenProcessPool:
+                    crashed = True
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to parse {path}: {e}")
+                    unfinished.discard(path)
+                    yield path, None, e
+                    continue
+                unfinished.discard(path)
+                yield path, documents, None
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if not crashed:
+            continue
+        unfinished = [path for path in batch if path in unfinished]
+        if len(unfinished) == 1:
+            logger.error(f"Parser process crashed on {unfinished[0]}")
+            yield unfinished[0], None, RuntimeError("parser process crashed")
+            continue
+        logger.warning(f"A parser process crashed; splitting the {len(unfinished)} unfinished files in half")
+        middle = len(unfinished) // 2
+        batches.extend([unfinished[middle:], unfinished[:middle]])  # First half is parsed next
@@ -0,0 +1,350 @@
+import json
+import math
+import sqlite3
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_QUANTIZATIONS = ("none", "int8")
+MIN_TRAIN_VECTORS = 10000  # Smaller collections are scanned in full
+TRAIN_SAMPLE_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+SCAN_BLOCK = 65536  # Rows dequantized at once while scanning
+COLUMNS = {"documents": "document", "metadatas": "metadata", "embeddings": "embedding"}
+
+
+def _nearest_centroids(vectors, centroids, block=16384):
+    """Index of the nearest centroid of each vector."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    nearest = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        distances = centroid_norms - 2 * vectors[start:start + block] @ centroids.T
+        nearest[start:start + block] = distances.argmin(axis=1)
+    return nearest
+
+
+def _kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroids(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=n_lists)
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts[filled])[:-1])))
+        centroids[filled] = sums / counts[filled, None]  # Empty lists keep their centroid
+    return centroids
+
+
+def _where_sql(where):
+    """SQL conditions and parameters of a Chroma ``where`` filter of equality matches."""
+    conditions, params = [], []
+    for key, value in (where or {}).items():
+        if key == "$and":
+            for clause in value:
+                clause_conditions, clause_params = _where_sql(clause)
+                conditions += clause_conditions
+                params += clause_params
+            continue
+        if isinstance(value, dict):
+            if set(value) != {"$eq"}:
+                raise ValueError(f"Unsupported filter {where!r}, only equality matches are supported")
+            value = value["$eq"]
+        if key == "file_name":
+            conditions.append("file_name = ?")
+        else:
+            conditions.append("json_extract(metadata, ?) = ?")
+            params.append(f'$."{key}"')
+        params.append(value)
+    return conditions, params
+
+
+class QuantizedCollection:
+    """A vector collection keeping int8 codes in memory and float32 vectors, text and metadata in SQLite.
+
+    It answers the part of the Chroma collection API used by
+    ChromaVectorStore and the indexes built from a collection (add, upsert,
+    get, query, delete, count), so it can stand in for a shard's Chroma
+    collection. In memory each vector takes a quarter of its float32 size.
+    Once the collection holds MIN_TRAIN_VECTORS vectors it is partitioned
+    into about sqrt(n) k-means lists, and a query scans the ``probes`` lists
+    nearest to it (0 = every vector). The best ``rescore_candidates`` are
+    then ranked by their exact distance to the float32 vectors read from
+    disk (0 = keep the int8 distances). Filters are equality matches.
+    """
+
+    def __init__(self, path, name=None, probes=16, rescore_candidates=50):
+        self.path = path
+        self.name = name or path
+        self.probes = probes
+        self.rescore_candidates = rescore_candidates
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (node_id TEXT PRIMARY KEY, file_name TEXT, document TEXT, "
+            "metadata TEXT, embedding BLOB NOT NULL, scale REAL NOT NULL, sq_norm REAL NOT NULL, "
+            "code BLOB NOT NULL, list INTEGER NOT NULL DEFAULT -1)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_file ON vectors (file_name)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+        self._node_ids = []
+        self._file_numbers = {}  # file_name -> number stored per row in _files
+        self._pending = []  # (codes, scales, sq_norms, lists, files) added since the arrays were last joined
+        self._codes = self._scales = self._sq_norms = self._lists = self._files = None
+        self._centroids = None
+        self._trained_count = 0
+        self._order = self._offsets = None  # Rows sorted by list, and where each list starts
+        self._load()
+
+    def _load(self, page_size=10000):
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        dim = int(meta["dim"]) if "dim" in meta else 0
+        if "centroids" in meta:
+            self._centroids = np.frombuffer(meta["centroids"], dtype=np.float32).reshape(-1, dim)
+            self._trained_count = int(meta["trained_count"])
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()
+        self._codes = np.empty((count, dim), dtype=np.int8)
+        self._scales = np.empty(count, dtype=np.float32)
+        self._sq_norms = np.empty(count, dtype=np.float32)
+        self._lists = np.empty(count, dtype=np.int32)
+        self._files = np.empty(count, dtype=np.int32)
+        # Read page by page into the arrays, so loading does not hold every row as Python objects
+        cursor = self._conn.execute("SELECT node_id, file_name, scale, sq_norm, code, list FROM vectors ORDER BY rowid")
+        start = 0
+        while page := cursor.fetchmany(page_size):
+            end = start + len(page)
+            node_ids, file_names, scales, sq_norms, codes, lists = zip(*page)
+            self._node_ids.extend(node_ids)
+            self._codes[start:end] = np.frombuffer(b"".join(codes), dtype=np.int8).reshape(len(page), dim)
+            self._scales[start:end] = scales
+            self._sq_norms[start:end] = sq_norms
+            self._lists[start:end] = lists
+            self._files[start:end] = [self._file_number(file_name) for file_name in file_names]
+            start = end
+
+    def _file_number(self, file_name):
+        return self._file_numbers.setdefault(file_name, len(self._file_numbers))
+
+    def count(self):
+        return len(self._node_ids)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, ids, embeddings, metadatas=None, documents=None):
+        """Store vectors with their metadata and text, replacing any stored under the same ids."""
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [None] * len(ids)
+        documents = documents or [None] * len(ids)
+        file_names = [(metadata or {}).get("file_name") for metadata in metadatas]
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        with self._lock:
+            if self._codes.shape[1] == 0 and not self._pending:
+                self._codes = self._codes.reshape(0, vectors.shape[1])
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(vectors.shape[1]),))
+            self._remove_locked(self._select_ids(ids, None))
+            lists = (
+                _nearest_centroids(vectors, self._centroids) if self._centroids is not None
+                else np.full(len(ids), -1, dtype=np.int32)
+            )
+            files = np.array([self._file_number(file_name) for file_name in file_names], dtype=np.int32)
+            self._node_ids.extend(ids)
+            self._pending.append((codes, scales.astype(np.float32), sq_norms, lists, files))
+            self._order = None
+            self._conn.executemany(
+                "INSERT INTO vectors (node_id, file_name, document, metadata, embedding, scale, sq_norm, code, list) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (node_id, file_name, document, json.dumps(metadata) if metadata is not None else None,
+                     vector.tobytes(), float(scale), float(sq_norm), code.tobytes(), int(list_))
+                    for node_id, file_name, document, metadata, vector, scale, sq_norm, code, list_ in zip(
+                        ids, file_names, documents, metadatas, vectors, scales, sq_norms, codes, lists
+                    )
+                ],
+            )
+            self._conn.commit()
+
+    upsert = add
+
+    def _select_ids(self, ids, where):
+        """Stored ids among ``ids`` (None = all) that match ``where``."""
+        conditions, params = _where_sql(where)
+        if ids is None:
+            sql = "SELECT node_id FROM vectors" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+            return [row[0] for row in self._conn.execute(sql, params)]
+        ids = list(ids)
+        selected = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            chunk_conditions = conditions + [f"node_id IN ({','.join('?' * len(chunk))})"]
+            selected += [
+                row[0] for row in self._conn.execute(
+                    "SELECT node_id FROM vectors WHERE " + " AND ".join(chunk_conditions), params + chunk
+                )
+            ]
+        return selected
+
+    def _join_pending(self):
+        if self._pending:
+            codes, scales, sq_norms, lists, files = zip(*self._pending)
+            self._codes = np.concatenate((self._codes, *codes))
+            self._scales = np.concatenate((self._scales, *scales))
+            self._sq_norms = np.concatenate((self._sq_norms, *sq_norms))
+            self._lists = np.concatenate((self._lists, *lists))
+            self._files = np.concatenate((self._files, *files))
+            self._pending = []
+
+    def _remove_locked(self, node_ids):
+        if not node_ids:
+            return
+        self._join_pending()
+        removed = set(node_ids)
+        keep = np.fromiter((node_id not in removed for node_id in self._node_ids), dtype=bool, count=len(self._node_ids))
+        self._node_ids = [node_id for node_id in self._node_ids if node_id not in removed]
+        self._codes, self._scales, self._sq_norms = self._codes[keep], self._scales[keep], self._sq_norms[keep]
+        self._lists, self._files = self._lists[keep], self._files[keep]
+        self._order = None
+        removed = list(removed)
+        for start in range(0, len(removed), 500):
+            chunk = removed[start:start + 500]
+            self._conn.execute(f"DELETE FROM vectors WHERE node_id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def delete(self, ids=None, where=None):
+        """Delete vectors by id and/or metadata filter."""
+        with self._lock:
+            if ids is None and not where:
+                return
+            self._remove_locked(self._select_ids(ids, where))
+            self._conn.commit()
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        """Return stored vectors as Chroma does: {"ids": [...], "documents": [...], ...}."""
+        conditions, params = _where_sql(where)
+        if ids is not None:
+            ids = list(ids)
+            conditions.append(f"node_id IN ({','.join('?' * len(ids))})")
+            params += ids
+        include = [key for key in include if key in COLUMNS]
+        sql = f"SELECT {', '.join(['node_id'] + [COLUMNS[key] for key in include])} FROM vectors"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit if limit is not None else -1, offset or 0]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall() if ids != [] else []
+        result = {"ids": [row[0] for row in rows], "documents": None, "metadatas": None, "embeddings": None}
+        for position, key in enumerate(include, 1):
+            values = [row[position] for row in rows]
+            if key == "metadatas":
+                values = [json.loads(value) if value is not None else None for value in values]
+            elif key == "embeddings":
+                values = np.array([np.frombuffer(value, dtype=np.float32) for value in values])
+            result[key] = values
+        return result
+
+    def needs_training(self):
+        """True once the collection is large enough to partition, or has grown 4x since it was partitioned."""
+        count = self.count()
+        return count >= MIN_TRAIN_VECTORS and (self._centroids is None or count > 4 * self._trained_count)
+
+    def train(self, seed=0):
+        """Partition the vectors into about sqrt(n) k-means lists, trained on a sample."""
+        with self._lock:
+            self._join_pending()
+            count = len(self._node_ids)
+            n_lists = int(math.sqrt(count))
+            if n_lists < 2:
+                return
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(count, min(count, n_lists * TRAIN_SAMPLE_PER_LIST), replace=False)
+            centroids = _kmeans(self._dequantize(np.sort(sample)), n_lists, seed=seed)
+            lists = np.concatenate([
+                _nearest_centroids(self._dequantize(np.arange(start, min(start + SCAN_BLOCK, count))), centroids)
+                for start in range(0, count, SCAN_BLOCK)
+            ])
+            self._centroids, self._lists, self._trained_count = centroids, lists, count
+            self._order = None
+            self._conn.executemany("UPDATE vectors SET list = ? WHERE node_id = ?", zip(lists.tolist(), self._node_ids))
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('centroids', ?)", (centroids.tobytes(),))
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('trained_count', ?)", (str(count),))
+            self._conn.commit()
+        logger.info(f"Partitioned {count} quantized vectors of {self.name} into {n_lists} lists")
+
+    def _dequantize(self, rows):
+        return self._codes[rows].astype(np.float32) * self._scales[rows, None]
+
+    def _candidate_rows(self, query):
+        """Rows of the ``probes`` lists nearest the query, or None to scan every row."""
+        if self._centroids is None or self.probes <= 0 or self.probes >= len(self._centroids):
+            return None
+        if self._order is None:
+            self._order = np.argsort(self._lists, kind="stable")
+            self._offsets = np.searchsorted(self._lists[self._order], np.arange(len(self._centroids) + 1))
+        distances = np.einsum("ij,ij->i", self._centroids, self._centroids) - 2 * self._centroids @ query
+        nearest = np.argpartition(distances, self.probes)[:self.probes]
+        return np.concatenate([self._order[self._offsets[i]:self._offsets[i + 1]] for i in nearest])
+
+    def _matching_rows(self, where):
+        if set(where) == {"file_name"}:
+            value = where["file_name"]
+            number = self._file_numbers.get(value["$eq"] if isinstance(value, dict) else value)
+            return np.flatnonzero(self._files == number) if number is not None else np.empty(0, dtype=np.int64)
+        matching = set(self._select_ids(None, where))
+        return np.flatnonzero(np.fromiter((node_id in matching for node_id in self._node_ids), dtype=bool))
+
+    def _search(self, query, top_k, where=None):
+        """Return [(node_id, approximate squared L2 distance)], nearest first."""
+        with self._lock:
+            self._join_pending()
+            # A filtered query scans every match, so a document's chunks are found wherever they are partitioned
+            rows = self._matching_rows(where) if where else self._candidate_rows(query)
+            if rows is None:
+                rows = np.arange(len(self._node_ids))
+            if not len(rows):
+                return []
+            # |q - v|^2 with v = scale * code
+            dots = np.concatenate([
+                self._codes[rows[start:start + SCAN_BLOCK]].astype(np.float32) @ query
+                for start in range(0, len(rows), SCAN_BLOCK)
+            ])
+            distances = self._sq_norms[rows] - 2 * self._scales[rows] * dots + query @ query
+            top = np.argpartition(distances, top_k)[:top_k] if len(rows) > top_k else np.arange(len(rows))
+            top = top[np.argsort(distances[top])]
+            return [(self._node_ids[rows[i]], float(distances[i])) for i in top]
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        """Nearest vectors of each query, with documents, metadatas and squared L2 distances, as Chroma returns them."""
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query in np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)):
+            candidates = self._search(query, max(n_results, self.rescore_candidates), where)
+            if not candidates:
+                for key in result:
+                    result[key].append([])
+                continue
+            if self.rescore_candidates > 0:
+                stored = self.get(ids=[node_id for node_id, _ in candidates], include=list(COLUMNS))
+                differences = stored["embeddings"].reshape(len(stored["ids"]), -1) - query
+                distances = np.einsum("ij,ij->i", differences, differences)
+                ranked = [(i, float(distances[i])) for i in np.argsort(distances)[:n_results]]
+            else:
+                candidates = candidates[:n_results]
+                stored = self.get(ids=[node_id for node_id, _ in candidates])
+                positions = {node_id: i for i, node_id in enumerate(stored["ids"])}
+                ranked = [(positions[node_id], distance) for node_id, distance in candidates if node_id in positions]
+            result["ids"].append([stored["ids"][i] for i, _ in ranked])
+            result["documents"].append([stored["documents"][i] for i, _ in ranked])
+            result["metadatas"].append([stored["metadatas"][i] for i, _ in ranked])
+            result["distances"].append([distance for _, distance in ranked])
+        return result
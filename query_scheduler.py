@@ -0,0 +1,150 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class QueryQueueFull(Exception):
+    """Raised when more queries are submitted than the scheduler will hold."""
+
+
+class QueryCancelled(Exception):
+    def __str__(self):
+        return "Stopped"
+
+
+class QueryTimeout(Exception):
+    def __init__(self, timeout):
+        super().__init__(f"Timed out after {timeout:g} s")
+
+
+class _QueryRequest:
+    def __init__(self, request_id, on_done):
+        self.request_id = request_id
+        self.on_done = on_done
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.finished = False
+
+
+class QueryScheduler:
+    """Application-wide query executor.
+
+    Queries run on a fixed pool of ``max_workers`` threads with at most
+    ``max_queue`` more waiting. Each query gets an increasing request id,
+    can be cancelled or time out, and its ``on_done(request_id, result,
+    error)`` callback is invoked strictly in submission order.
+
+    The query function receives ``(request_id, cancel_event)`` and should
+    stop work (e.g. close its HTTP stream) once the event is set. A query
+    that timed out or was cancelled is delivered at once but keeps its place
+    against the limit until its function returns, so hung workers are not
+    hidden from admission.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=120.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query")
+        self._lock = threading.Lock()
+        self._delivering = False  # One thread at a time runs callbacks, so they stay in order
+        self._requests = {}  # request id -> request not yet delivered
+        self._outstanding = 0  # Requests whose function is queued or still running
+        self._completed = {}  # request id -> (request, result, error) waiting for earlier requests
+        self._next_id = 1
+        self._next_delivery = 1
+
+    def submit(self, fn, on_done):
+        """Schedule fn(request_id, cancel_event); return the request id."""
+        with self._lock:
+            if self._outstanding >= self.max_workers + self.max_queue:
+                raise QueryQueueFull(f"{self._outstanding} queries already in progress")
+            request = _QueryRequest(self._next_id, on_done)
+            self._next_id += 1
+            self._requests[request.request_id] = request
+            self._outstanding += 1
+            request.future = self._executor.submit(self._run, request, fn)
+        # Runs once _run returns, or at once if the request is cancelled before it starts
+        request.future.add_done_callback(self._release)
+        return request.request_id
+
+    def _release(self, future):
+        with self._lock:
+            self._outstanding -= 1
+
+    def _run(self, request, fn):
+        if request.cancel_event.is_set():
+            return
+        timer = threading.Timer(self.timeout, self._expire, (request,))
+        timer.daemon = True
+        timer.start()
+        try:
+            result, error = fn(request.request_id, request.cancel_event), None
+        except Exception as e:
+            logger.error(f"Query {request.request_id} failed: {e}")
+            result, error = None, e
+        finally:
+            timer.cancel()
+        self._finish(request, result, error)
+
+    def _expire(self, request):
+        logger.warning(f"Query {request.request_id} timed out after {self.timeout} s")
+        request.cancel_event.set()
+        self._finish(request, None, QueryTimeout(self.timeout))
+
+    def cancel(self, request_id):
+        """Cancel a queued or running query; return False if it already finished."""
+        with self._lock:
+            request = self._requests.get(request_id)
+        if request is None or request.finished:
+            return False
+        request.cancel_event.set()
+        request.future.cancel()
+        self._finish(request, None, QueryCancelled())
+        return True
+
+    def cancel_all(self):
+        """Cancel every query that has not finished yet."""
+        with self._lock:
+            request_ids = list(self._requests)
+        for request_id in request_ids:
+            self.cancel(request_id)
+
+    def _finish(self, request, result, error):
+        """Record a result and deliver every result that is next in order.
+
+        Callbacks run without any lock held. Whichever thread finds delivery
+        idle keeps delivering until nothing in order is left, so results
+        that arrive meanwhile are picked up by it rather than delivered
+        concurrently.
+        """
+        with self._lock:
+            if request.finished:
+                return
+            request.finished = True
+            self._completed[request.request_id] = (request, result, error)
+            if self._delivering:
+                return
+            self._delivering = True
+        while True:
+            with self._lock:
+                deliverable = []
+                while self._next_delivery in self._completed:
+                    deliverable.append(self._completed.pop(self._next_delivery))
+                    self._requests.pop(self._next_delivery, None)
+                    self._next_delivery += 1
+                if not deliverable:
+                    self._delivering = False
+                    return
+            for done, result, error in deliverable:
+                try:
+                    done.on_done(done.request_id, result, error)
+                except Exception as e:
+                    logger.error(f"Callback for query {done.request_id} failed: {e}")
+
+    def shutdown(self):
+        """Cancel outstanding queries and stop the worker threads."""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
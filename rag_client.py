@@ -0,0 +1,139 @@
+"""Thin client for the headless RAG server (serve.py).
+
+RAGClient has the same query, chat and document functions as llm_query,
+so the GUI can call either one without knowing where the index lives.
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+from search_index import SearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class RAGServerError(Exception):
+    def __init__(self, status, message):
+        # Errors after a stream has started carry no status of their own
+        super().__init__(f"Server error {status}: {message}" if status else message)
+        self.status = status
+
+
+class RAGClient:
+    """Queries, chats and document updates sent to a RAG server at ``url``."""
+
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # The server keeps conversations per client; this keeps two windows on one machine apart
+        self.session = uuid.uuid4().hex[:12]
+        self._seed_turns = {}  # conversation id -> turns sent with its next question
+
+    def _request(self, method, path, payload=None, data=None, content_type="application/json"):
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, method=method)
+        if data is not None:
+            request.add_header("Content-Type", content_type)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise RAGServerError(e.code, message) from None
+
+    def _json(self, method, path, payload=None, **kwargs):
+        with self._request(method, path, payload, **kwargs) as response:
+            return json.loads(response.read())
+
+    def _chat_payload(self, prompt, role, conversation_id, mode, scope):
+        payload = {
+            "prompt": prompt, "role": role, "mode": mode, "scope": scope,
+            "conversation_id": f"{self.session}-{conversation_id}",
+        }
+        turns = self._seed_turns.pop(conversation_id, None)
+        if turns is not None:
+            payload["turns"] = turns
+        return payload
+
+    def _stream(self, payload, cancel_event):
+        response = self._request("POST", "/query/stream", payload)
+        try:
+            for line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info("Streaming query cancelled.")
+                    return
+                message = json.loads(line)
+                if "error" in message:
+                    raise RAGServerError(None, message["error"])
+                if message.get("done"):
+                    return
+                yield message["token"]
+        finally:
+            response.close()  # The server cancels the query when the connection closes
+
+    def health(self):
+        return self._json("GET", "/health")
+
+    def shard_stats(self):
+        return self.health()["shards"]
+
+    # A blocking request cannot be interrupted; the scheduler drops a cancelled query's answer
+    def hugging_face_query(self, prompt, role, cancel_event=None, mode=None, scope=None):
+        return self._json("POST", "/query", {"prompt": prompt, "role": role, "mode": mode, "scope": scope})["answer"]
+
+    def hugging_face_query_stream(self, prompt, role, cancel_event=None, mode=None, scope=None):
+        return self._stream({"prompt": prompt, "role": role, "mode": mode, "scope": scope}, cancel_event)
+
+    def chat_query(self, prompt, role, conversation_id, cancel_event=None, mode=None, scope=None):
+        return self._json("POST", "/query", self._chat_payload(prompt, role, conversation_id, mode, scope))["answer"]
+
+    def chat_query_stream(self, prompt, role, conversation_id, cancel_event=None, mode=None, scope=None):
+        return self._stream(self._chat_payload(prompt, role, conversation_id, mode, scope), cancel_event)
+
+    def start_chat(self, conversation_id, turns=()):
+        """Restart a conversation; the turns go with its next question, so this never blocks."""
+        self._seed_turns[conversation_id] = [list(turn) for turn in turns]
+
+    def end_chat(self, conversation_id):
+        """Ask the server to forget a conversation, in the background."""
+        self._seed_turns.pop(conversation_id, None)
+
+        def forget():
+            try:
+                self._json("DELETE", f"/chats/{quote(f'{self.session}-{conversation_id}')}")
+            except (OSError, RAGServerError) as e:
+                logger.warning(f"Could not end conversation {conversation_id} on the server: {e}")
+
+        threading.Thread(target=forget, daemon=True).start()
+
+    def upload_documents(self, paths, folder=None):
+        """Upload files, into a shard folder if given; each is indexed before the next is sent.
+
+        Returns [(file_name, error)] for unreadable files.
+        """
+        failed_files = []
+        for path in paths:
+            file_name = f"{folder}/{os.path.basename(path)}" if folder else os.path.basename(path)
+            with open(path, "rb") as file:
+                result = self._json(
+                    "PUT", f"/documents/{quote(file_name)}", data=file.read(), content_type="application/octet-stream"
+                )
+            failed_files += [(file_name, error) for error in result["failed"]]
+        return failed_files
+
+    def delete_document(self, file_name):
+        return self._json("DELETE", f"/documents/{quote(file_name)}")["removed_chunks"]
+
+    def compact_index(self):
+        return self._json("POST", "/compact")
+
+    def search_documents(self, query, limit=50):
+        results = self._json("POST", "/search", {"query": query, "limit": limit})["results"]
+        return [SearchResult(**result) for result in results]
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle, MetadataMode
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def load_cross_encoder(model_name, max_length=512):
+    """Load a sentence-transformers cross-encoder on CPU."""
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+
+class RerankScoreCache:
+    """In-memory LRU cache of cross-encoder scores keyed by (query hash, node id).
+
+    Rephrased or repeated questions, and follow-ups that retrieve the same
+    candidates, only score the chunks they have not seen with that query.
+    """
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (query hash, node id) -> score
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query_key(model_name, query):
+        return hashlib.sha256(f"{model_name}\0{query}".encode("utf-8")).hexdigest()
+
+    def get_many(self, query_key, node_ids):
+        """Return {node_id: score} for the cached pairs."""
+        found = {}
+        with self._lock:
+            for node_id in node_ids:
+                score = self._entries.get((query_key, node_id))
+                if score is not None:
+                    self._entries.move_to_end((query_key, node_id))
+                    found[node_id] = score
+            self.hits += len(found)
+            self.misses += len(node_ids) - len(found)
+        return found
+
+    def put_many(self, query_key, scores):
+        with self._lock:
+            for node_id, score in scores.items():
+                self._entries[(query_key, node_id)] = score
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CrossEncoderReranker(BaseNodePostprocessor):
+    """Second retrieval stage: score a wide candidate pool with a cross-encoder.
+
+    Candidates are scored in batches of ``batch_size`` (cached scores are
+    reused), and the best ``top_n`` that fit in ``token_budget`` tokens are
+    passed on to the LLM.
+    """
+
+    model_name: str = Field(default=DEFAULT_RERANK_MODEL)
+    top_n: int = Field(default=4)
+    token_budget: int = Field(default=1500)
+    batch_size: int = Field(default=16)
+    _model: Any = PrivateAttr()
+    _cache: RerankScoreCache = PrivateAttr()
+    _count_tokens: Callable = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, model, cache, count_tokens, lock=None, **kwargs):
+        super().__init__(**kwargs)
+        self._model = model
+        self._cache = cache
+        self._count_tokens = count_tokens
+        self._lock = lock or threading.Lock()  # One prediction at a time; torch already uses every core
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderReranker"
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if query_bundle is None or not nodes:
+            return nodes
+        with tracing.span("query.rerank", candidates=len(nodes)) as rerank_span:
+            query_key = self._cache.query_key(self.model_name, query_bundle.query_str)
+            scores = self._cache.get_many(query_key, [result.node.node_id for result in nodes])
+            missing = [result for result in nodes if result.node.node_id not in scores]
+            if missing:
+                pairs = [
+                    (query_bundle.query_str, result.node.get_content(metadata_mode=MetadataMode.NONE))
+                    for result in missing
+                ]
+                with self._lock:
+                    predicted = self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                new_scores = {result.node.node_id: float(score) for result, score in zip(missing, predicted)}
+                self._cache.put_many(query_key, new_scores)
+                scores.update(new_scores)
+
+            ranked = sorted(nodes, key=lambda result: scores[result.node.node_id], reverse=True)
+            kept = []
+            context_tokens = 0
+            for result in ranked:
+                if len(kept) == self.top_n:
+                    break
+                node_tokens = self._count_tokens(result.node.get_content(metadata_mode=MetadataMode.LLM))
+                if kept and context_tokens + node_tokens > self.token_budget:
+                    continue  # A shorter, lower-ranked chunk may still fit
+                kept.append(NodeWithScore(node=result.node, score=scores[result.node.node_id]))
+                context_tokens += node_tokens
+            rerank_span.update(scored=len(missing), kept=len(kept), context_tokens=context_tokens)
+        return kept
@@ -0,0 +1,51 @@
+from llama_index.core import PromptTemplate
+
+# Collection of the files directly in the documents folder; each subfolder is a collection (shard) of its own
+DEFAULT_COLLECTION = "doc"
+
+STUDENT_QA_TEMPLATE = PromptTemplate(
+    "You are a patient tutor helping a student understand their course material.\n"
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Using only the context, explain the answer step by step in plain language. "
+    "If the context does not contain the answer, say so.\n"
+    "Question: {query_str}\n"
+    "Answer: "
+)
+
+TEACHER_QA_TEMPLATE = PromptTemplate(
+    "You are an assistant for a teacher preparing and reviewing course material.\n"
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Using only the context, give a concise, precise answer and name the documents it comes from. "
+    "If the context does not contain the answer, say so.\n"
+    "Question: {query_str}\n"
+    "Answer: "
+)
+
+# Per-role prompt and retrieval parameters; switching role only selects a different entry.
+# "collections" lists the shards a role may search, or None for every shard.
+ROLE_PROFILES = {
+    "Student": {
+        "qa_template": STUDENT_QA_TEMPLATE,
+        "similarity_top_k": 3,
+        "response_mode": "compact",
+        "collections": None,
+    },
+    "Teacher": {
+        "qa_template": TEACHER_QA_TEMPLATE,
+        "similarity_top_k": 6,
+        "response_mode": "compact",
+        "collections": None,
+    },
+}
+DEFAULT_ROLE = "Student"
+
+
+def get_role_profile(role):
+    """Return the profile for a role, falling back to the Student profile."""
+    return ROLE_PROFILES.get(role, ROLE_PROFILES[DEFAULT_ROLE])
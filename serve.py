@@ -0,0 +1,590 @@
+"""Headless HTTP service answering from one warm RAG index.
+
+Every client shares the index, models and caches that initialize_rag loads
+once in this process, so a classroom does not need one desktop instance
+(and one chroma_db client) per student:
+
+    python -m serve --config config.yaml --host 0.0.0.0 --port 8765
+
+Endpoints (JSON bodies and responses unless noted):
+
+    GET    /health                  {"ready", "index_version", "shards", "queries_in_flight", "coalesced_queries"}
+    POST   /query                   {"prompt", "role", "mode", "scope", "conversation_id", "turns"} -> {"answer"}
+    POST   /query/stream            same body -> NDJSON lines {"token"}..., then {"done": true} or {"error"}
+    PUT    /documents/<file name>   raw file bytes -> {"file_name", "failed"} once indexed
+    DELETE /documents/<file name>   -> {"removed_chunks"}
+    POST   /ingest                  rescan the documents folder -> {"failed"}
+    POST   /compact                 -> compact_index() result
+    POST   /search                  {"query", "limit"} -> {"results"}: full-text matches in the documents
+    DELETE /chats/<conversation>    forget a conversation
+
+Queries with a ``conversation_id`` are chat turns; the conversation is kept
+per client until it has been idle for CHAT_IDLE_MINUTES (at most
+CHAT_MAX_CONVERSATIONS are kept), and ``turns`` ([[question, answer],
+...]) restarts it from a reopened session before the question is answered. ``scope`` limits the
+search to some shards ({"shards": [...]}) or one document ({"document":
+"folder/file"}); a document name may include its shard folder. Identical one-shot
+queries that arrive while the first is still running share its answer, and
+ingest requests that arrive during an ingest share the next rescan. Every
+endpoint but /health is rate limited per client (peer address, or the
+SERVER_CLIENT_HEADER header when set).
+"""
+import os
+import re
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+from http import HTTPStatus
+from urllib.parse import unquote, urlsplit
+import yaml
+import llm_query
+from llm_query import (
+    initialize_rag, hugging_face_query, hugging_face_query_stream, chat_query, chat_query_stream, start_chat,
+    end_chat, delete_document, compact_index, shard_stats, search_documents, rag_options_from_config, DOCS_PATH,
+    SUPPORTED_EXTENSIONS, RETRIEVAL_MODES
+)
+from shards import document_path, parse_scope
+from query_scheduler import QueryScheduler, QueryQueueFull, QueryTimeout
+from role_profiles import DEFAULT_ROLE
+from log_pipeline import setup_logging
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+MAX_HEADER_BYTES = 16 * 1024
+KEEP_ALIVE_SECONDS = 60  # Idle keep-alive connections are closed after this long
+MAX_SEARCH_RESULTS = 500
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class Request:
+    def __init__(self, method, path, headers, body, client):
+        self.method = method
+        self.path = path
+        self.headers = headers  # Lower-cased names
+        self.body = body
+        self.client = client
+
+    @property
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            payload = json.loads(self.body)
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON body: {e}")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "JSON body must be an object")
+        return payload
+
+
+async def read_request(reader, peer, max_body_bytes, client_header=""):
+    """Read one HTTP/1.1 request; return None when the client closed the connection."""
+    try:
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    header_bytes = 0
+    while True:
+        line = await reader.readline()
+        header_bytes += len(line)
+        if header_bytes > MAX_HEADER_BYTES:
+            raise HTTPError(431, "Request headers too large")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "transfer-encoding" in headers:
+        raise HTTPError(411, "Chunked request bodies are not supported; send Content-Length")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > max_body_bytes:
+        raise HTTPError(413, f"Request body larger than {max_body_bytes // (1024 * 1024)} MB")
+    body = await reader.readexactly(length) if length else b""
+
+    client = (client_header and headers.get(client_header.lower())) or peer
+    return Request(method.upper(), unquote(urlsplit(target).path), headers, body, client)
+
+
+def _response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer, status, payload, keep_alive=True, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(_response_head(status, [
+        ("Content-Type", "application/json"),
+        ("Content-Length", len(body)),
+        ("Connection", "keep-alive" if keep_alive else "close"),
+        *headers,
+    ]) + body)
+    await writer.drain()
+
+
+async def send_lines(writer, lines, keep_alive=True):
+    """Send an async iterator of JSON objects as chunked NDJSON, flushing after every line."""
+    writer.write(_response_head(200, [
+        ("Content-Type", "application/x-ndjson"),
+        ("Transfer-Encoding", "chunked"),
+        ("Cache-Control", "no-cache"),
+        ("Connection", "keep-alive" if keep_alive else "close"),
+    ]))
+    try:
+        async for line in lines:
+            data = (json.dumps(line) + "\n").encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        await lines.aclose()  # Cancels the query if the client went away
+
+
+class RateLimiter:
+    """Per-client token buckets: ``rate_per_minute`` requests with bursts of up to ``burst``.
+
+    Only used from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, rate_per_minute=60, burst=10, max_clients=10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._buckets = {}  # client -> (tokens, monotonic time of the last refill)
+
+    def acquire(self, client):
+        """Take one request token; return 0 or the seconds until the client may retry."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return 0.0
+        self._buckets[client] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # A client idle long enough to have refilled its bucket is no different from a new one
+        refill_seconds = self.burst / self.rate
+        for client, (_, last) in list(self._buckets.items()):
+            if now - last >= refill_seconds:
+                del self._buckets[client]
+
+
+class RAGServer:
+    """HTTP front end over the module-level index in llm_query."""
+
+    ROUTES = [
+        ("GET", re.compile(r"/health"), "handle_health"),
+        ("POST", re.compile(r"/query"), "handle_query"),
+        ("POST", re.compile(r"/query/stream"), "handle_query_stream"),
+        ("PUT", re.compile(r"/documents/(?P<file_name>[^/]+(?:/[^/]+)?)"), "handle_put_document"),
+        ("DELETE", re.compile(r"/documents/(?P<file_name>[^/]+(?:/[^/]+)?)"), "handle_delete_document"),
+        ("POST", re.compile(r"/ingest"), "handle_ingest"),
+        ("POST", re.compile(r"/compact"), "handle_compact"),
+        ("POST", re.compile(r"/search"), "handle_search"),
+        ("DELETE", re.compile(r"/chats/(?P<conversation_id>[^/]+)"), "handle_end_chat"),
+    ]
+
+    def __init__(self, config):
+        self.rag_options = rag_options_from_config(config)
+        self.scheduler = QueryScheduler(
+            max_workers=config.get("SERVER_QUERY_WORKERS", 4),
+            max_queue=config.get("SERVER_QUERY_QUEUE_SIZE", 64),
+            timeout=config.get("QUERY_TIMEOUT", 120),
+        )
+        self.rate_limiter = RateLimiter(config.get("SERVER_RATE_LIMIT", 60), config.get("SERVER_RATE_BURST", 10))
+        self.client_header = config.get("SERVER_CLIENT_HEADER", "") or ""
+        self.max_body_bytes = config.get("SERVER_MAX_UPLOAD_MB", 50) * 1024 * 1024
+        self.ready = None  # Future set once the startup ingest has finished
+        self.queries_in_flight = 0
+        self.coalesced_queries = 0
+        self._shared_queries = {}  # (prompt, role, mode) -> future of the answer shared by identical queries
+        self._current_ingest = None
+        self._next_ingest = None
+
+    # Query scheduling
+
+    def submit(self, fn):
+        """Schedule fn(cancel_event) on the query scheduler; return (request id, future of its result).
+
+        The scheduler delivers on_done in submission order, which would hold a
+        quick answer back behind a slow one, so the worker settles the future
+        itself and on_done only reports queries that never ran to completion
+        (timeouts and cancellations).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(result, error):
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+        def run(request_id, cancel_event):
+            try:
+                result = fn(cancel_event)
+            except Exception as e:
+                loop.call_soon_threadsafe(settle, None, e)
+                raise
+            loop.call_soon_threadsafe(settle, result, None)
+            return result
+
+        def on_done(request_id, result, error):
+            if error is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(settle, None, error)
+
+        request_id = self.scheduler.submit(run, on_done)
+        self.queries_in_flight += 1
+        future.add_done_callback(lambda _: self._query_finished())
+        return request_id, future
+
+    def _query_finished(self):
+        self.queries_in_flight -= 1
+
+    async def run_query(self, fn):
+        """Run fn(cancel_event) on the scheduler; cancel it if the waiting request goes away."""
+        request_id, future = self.submit(fn)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self.scheduler.cancel(request_id)
+            raise
+
+    async def shared_query(self, prompt, role, mode, scope):
+        """Answer a one-shot query; identical queries already in flight wait for its answer instead of running again."""
+        key = (prompt, role, mode or llm_query.retrieval_mode, parse_scope(scope))
+        shared = self._shared_queries.get(key)
+        if shared is None:
+            shared = self._shared_queries[key] = asyncio.ensure_future(
+                self.run_query(lambda cancel_event: hugging_face_query(prompt, role, cancel_event, mode=mode, scope=scope))
+            )
+            shared.add_done_callback(lambda _: self._shared_queries.pop(key, None))
+        else:
+            self.coalesced_queries += 1
+        # One waiter going away must not cancel the answer the others wait for
+        return await asyncio.shield(shared)
+
+    # Index updates
+
+    async def ingest(self):
+        """Rescan the documents folder; requests arriving during a rescan share the next one."""
+        if self._next_ingest is None:
+            self._next_ingest = asyncio.ensure_future(self._ingest_after(self._current_ingest))
+        return await asyncio.shield(self._next_ingest)
+
+    async def _ingest_after(self, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        self._current_ingest, self._next_ingest = self._next_ingest, None
+        return await asyncio.to_thread(initialize_rag, **self.rag_options)
+
+    async def wait_until_ready(self):
+        try:
+            await asyncio.shield(self.ready)
+        except Exception as e:
+            raise HTTPError(503, f"Document index failed to load: {e}")
+
+    async def load_index(self):
+        try:
+            failed_files = await self.ingest()
+        except Exception as e:
+            logger.error(f"Initial index load failed: {e}")
+            self.ready.set_exception(e)
+            return
+        if failed_files:
+            logger.warning(f"Skipped unreadable documents: {failed_files}")
+        logger.info("RAG index ready")
+        self.ready.set_result(True)
+
+    # Handlers
+
+    def _query_args(self, request):
+        body = request.json()
+        prompt = str(body.get("prompt") or "").strip()
+        if not prompt:
+            raise HTTPError(400, "Missing 'prompt'")
+        mode = body.get("mode") or None
+        if mode is not None and mode not in RETRIEVAL_MODES:
+            raise HTTPError(400, f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        conversation_id = body.get("conversation_id")
+        if conversation_id is not None:
+            conversation_id = (request.client, str(conversation_id))  # Clients cannot read each other's chats
+            turns = body.get("turns")
+            if turns is not None:
+                try:
+                    turns = [(str(question), str(answer)) for question, answer in turns]
+                except (TypeError, ValueError):
+                    raise HTTPError(400, "'turns' must be a list of [question, answer] pairs")
+                start_chat(conversation_id, turns)
+        scope = body.get("scope") or None
+        parse_scope(scope)  # A malformed scope is a 400 before the query is queued
+        return prompt, body.get("role") or DEFAULT_ROLE, mode, scope, conversation_id
+
+    @staticmethod
+    def _document_path(file_name):
+        """Path of a document named "file" or "shard folder/file" in the documents folder."""
+        if ("\\" in file_name or any(part.startswith(".") or not part for part in file_name.split("/"))
+                or not file_name.endswith(SUPPORTED_EXTENSIONS)):
+            raise HTTPError(400, f"Invalid document name '{file_name}', expected one of {SUPPORTED_EXTENSIONS}")
+        return document_path(DOCS_PATH, file_name)
+
+    async def handle_health(self, request):
+        return {
+            "ready": self.ready.done() and self.ready.exception() is None,
+            "index_version": llm_query.index_version,
+            "shards": shard_stats() if self.ready.done() and self.ready.exception() is None else {},
+            "queries_in_flight": self.queries_in_flight,
+            "coalesced_queries": self.coalesced_queries,
+        }
+
+    async def handle_query(self, request):
+        prompt, role, mode, scope, conversation_id = self._query_args(request)
+        await self.wait_until_ready()
+        if conversation_id is not None:
+            answer = await self.run_query(
+                lambda cancel_event: chat_query(prompt, role, conversation_id, cancel_event, mode=mode, scope=scope)
+            )
+        else:
+            answer = await self.shared_query(prompt, role, mode, scope)
+        return {"answer": str(answer)}
+
+    async def handle_query_stream(self, request):
+        prompt, role, mode, scope, conversation_id = self._query_args(request)
+        await self.wait_until_ready()
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+
+        def stream(cancel_event):
+            if conversation_id is not None:
+                generator = chat_query_stream(prompt, role, conversation_id, cancel_event, mode=mode, scope=scope)
+            else:
+                generator = hugging_face_query_stream(prompt, role, cancel_event, mode=mode, scope=scope)
+            for token in generator:
+                loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+        # Submitted before the response starts, so a full queue is still a 503
+        request_id, future = self.submit(stream)
+        # Queued after every token, since both are scheduled on the loop from the worker in order
+        future.add_done_callback(lambda _: tokens.put_nowait(None))
+        return self._stream_tokens(request_id, future, tokens)
+
+    async def _stream_tokens(self, request_id, future, tokens):
+        try:
+            while (token := await tokens.get()) is not None:
+                yield {"token": token}
+            if future.cancelled():
+                yield {"error": "Stopped"}
+            elif future.exception() is not None:
+                yield {"error": str(future.exception())}
+            else:
+                yield {"done": True}
+        finally:
+            if not future.done():
+                future.cancel()
+                self.scheduler.cancel(request_id)
+
+    async def handle_put_document(self, request, file_name):
+        path = self._document_path(file_name)
+        folder = os.path.dirname(path)
+        upload_path = os.path.join(folder, f".{os.path.basename(path)}.upload")  # Skipped by the manifest scan
+
+        def write():
+            os.makedirs(folder, exist_ok=True)
+            with open(upload_path, "wb") as file:
+                file.write(request.body)
+            os.replace(upload_path, path)
+
+        await self.wait_until_ready()
+        await asyncio.to_thread(write)
+        logger.info(f"Received {file_name} ({len(request.body)} bytes) from {request.client}")
+        failed_files = await self.ingest()
+        return {"file_name": file_name, "failed": [error for name, error in failed_files if name == file_name]}
+
+    async def handle_delete_document(self, request, file_name):
+        path = self._document_path(file_name)
+        await self.wait_until_ready()
+
+        def delete():
+            # Removing the file and its chunks must not interleave with an ingest
+            with llm_query.index_lock:
+                if not os.path.exists(path):
+                    raise HTTPError(404, f"No document named '{file_name}'")
+                os.remove(path)
+                return delete_document(file_name)
+
+        removed = await asyncio.to_thread(delete)
+        logger.info(f"Deleted {file_name} for {request.client}")
+        return {"removed_chunks": removed}
+
+    async def handle_ingest(self, request):
+        await self.wait_until_ready()
+        return {"failed": await self.ingest()}
+
+    async def handle_compact(self, request):
+        await self.wait_until_ready()
+        return await asyncio.to_thread(compact_index)
+
+    async def handle_search(self, request):
+        body = request.json()
+        query = str(body.get("query") or "").strip()
+        if not query:
+            raise HTTPError(400, "Missing 'query'")
+        limit = body.get("limit", 50)
+        if not isinstance(limit, int) or not 0 < limit <= MAX_SEARCH_RESULTS:
+            raise HTTPError(400, f"'limit' must be between 1 and {MAX_SEARCH_RESULTS}")
+        await self.wait_until_ready()
+        results = await asyncio.to_thread(search_documents, query, limit)
+        return {"results": [result._asdict() for result in results]}
+
+    async def handle_end_chat(self, request, conversation_id):
+        end_chat((request.client, conversation_id))
+        return {"conversation_id": conversation_id}
+
+    # Connections
+
+    def _route(self, request):
+        allowed = []
+        for method, pattern, handler in self.ROUTES:
+            match = pattern.fullmatch(request.path)
+            if match:
+                if method == request.method:
+                    return getattr(self, handler), match.groupdict()
+                allowed.append(method)
+        if allowed:
+            raise HTTPError(405, f"Method {request.method} not allowed", [("Allow", ", ".join(allowed))])
+        raise HTTPError(404, f"No endpoint {request.path}")
+
+    async def dispatch(self, request, writer):
+        start = time.perf_counter()
+        status = 200
+        try:
+            handler, params = self._route(request)
+            if handler != self.handle_health:
+                retry_after = self.rate_limiter.acquire(request.client)
+                if retry_after:
+                    raise HTTPError(429, f"Rate limit exceeded; retry in {retry_after:.1f} s",
+                                    [("Retry-After", math.ceil(retry_after))])
+            result = await handler(request, **params)
+        except HTTPError as e:
+            status, result, headers = e.status, {"error": str(e)}, e.headers
+        except QueryQueueFull as e:
+            status, result, headers = 503, {"error": f"Server busy: {e}"}, [("Retry-After", 1)]
+        except QueryTimeout as e:
+            status, result, headers = 504, {"error": str(e)}, []
+        except ValueError as e:
+            status, result, headers = 400, {"error": str(e)}, []
+        except Exception as e:
+            logger.error(f"{request.method} {request.path} failed: {e}")
+            status, result, headers = 500, {"error": str(e)}, []
+        else:
+            headers = []
+
+        try:
+            if isinstance(result, dict):
+                await send_json(writer, status, result, request.keep_alive, headers)
+            else:
+                await send_lines(writer, result, request.keep_alive)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            logger.debug(f"{request.client} {request.method} {request.path} {status} {elapsed_ms:.0f} ms")
+            tracing.record("server.request", elapsed_ms, method=request.method, path=request.path, status=status)
+
+    async def handle_connection(self, reader, writer):
+        peer = (writer.get_extra_info("peername") or ("unknown",))[0]
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, peer, self.max_body_bytes, self.client_header)
+                except HTTPError as e:
+                    # The rest of the request was not read, so the connection cannot be reused
+                    await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                await self.dispatch(request, writer)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.ready = asyncio.get_running_loop().create_future()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Serving the RAG index on http://{host}:{port}")
+        # Connections are accepted while the index loads; queries wait until it is ready
+        loader = asyncio.ensure_future(self.load_index())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            loader.cancel()
+            self.scheduler.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the RAG index over HTTP.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--host", default=None, help="Defaults to SERVER_HOST")
+    parser.add_argument("--port", type=int, default=None, help="Defaults to SERVER_PORT")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = yaml.safe_load(config_file)
+
+    setup_logging(
+        "server.log",
+        level=config.get("LOG_LEVEL", "INFO"),
+        max_bytes=config.get("LOG_MAX_MB", 5) * 1024 * 1024,
+        backup_count=config.get("LOG_BACKUP_COUNT", 5),
+        rotate_hours=config.get("LOG_ROTATE_HOURS", 24),
+        max_message_chars=config.get("LOG_MAX_MESSAGE_CHARS", 2000),
+        rate_limit=config.get("LOG_RATE_LIMIT", 20),
+    )
+    tracing.configure(enabled=config.get("TRACING", True))
+
+    server = RAGServer(config)
+    host = args.host or config.get("SERVER_HOST", "127.0.0.1")
+    port = args.port if args.port is not None else config.get("SERVER_PORT", DEFAULT_PORT)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import os
+import re
+import hashlib
+import logging
+from typing import List
+from llama_index.core import VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores import MetadataFilters, ExactMatchFilter
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from keyword_index import BM25Index, KeywordRetriever, RRF_K
+from quantized_store import QuantizedCollection
+from role_profiles import DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Files directly in the documents folder; their vectors stay in the original collection
+DEFAULT_SHARD = DEFAULT_COLLECTION
+SCOPE_KEYS = ("document", "shards")
+
+
+def shard_of(file_name):
+    """Return the shard of a document: its subfolder ("course/notes.pdf" -> "course"), or the default shard."""
+    folder, separator, _ = file_name.partition("/")
+    return folder if separator else DEFAULT_SHARD
+
+
+def document_path(directory, file_name):
+    """Path of a document named relative to the documents folder."""
+    return os.path.join(directory, *file_name.split("/"))
+
+
+def collection_name(shard):
+    """Chroma collection of a shard; folder names are made safe and kept apart by a hash."""
+    if shard == DEFAULT_SHARD:
+        return DEFAULT_COLLECTION
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", shard)[:48]
+    return f"{DEFAULT_COLLECTION}_{slug}_{hashlib.sha1(shard.encode('utf-8')).hexdigest()[:8]}"
+
+
+def parse_scope(scope):
+    """Normalize a query scope to a hashable (shards, document) pair.
+
+    ``None`` searches everything; ``{"shards": [...]}`` searches those shards;
+    ``{"document": "course/notes.pdf"}`` searches one document's chunks in its shard.
+    """
+    if not scope:
+        return None, None
+    if not isinstance(scope, dict) or set(scope) - set(SCOPE_KEYS):
+        raise ValueError(f"Invalid scope {scope!r}, expected a dict with keys {SCOPE_KEYS}")
+    document = scope.get("document")
+    if document:
+        return (shard_of(document),), document
+    shards = scope.get("shards")
+    if isinstance(shards, str):
+        shards = [shards]
+    return (tuple(sorted(set(shards))) if shards else None), None
+
+
+class Shard:
+    """A group of documents with its own Chroma collection and BM25 index.
+
+    Shards are opened, built and searched independently, so a query scoped
+    to one shard only searches that shard's vectors.
+
+    ``hnsw`` sets the HNSW parameters of the Chroma collection
+    (max_neighbors, ef_construction, ef_search); the first two only apply
+    when the collection is created. With ``quantization`` "int8" the vectors
+    are kept in a QuantizedCollection at ``quantized_path`` instead, searched
+    with ``probes`` and ``rescore_candidates``. Switching between the two
+    moves the vectors.
+    """
+
+    def __init__(self, chroma_client, name, keyword_index_path, quantized_path, hnsw=None, quantization="none",
+                 probes=16, rescore_candidates=50):
+        self.name = name
+        if quantization == "int8":
+            self.collection = QuantizedCollection(
+                quantized_path, collection_name(name), probes=probes, rescore_candidates=rescore_candidates
+            )
+            self._move_from_chroma(chroma_client)
+            self.finish_build()
+        else:
+            if os.path.exists(quantized_path):
+                self._move_to_chroma(chroma_client, quantized_path, hnsw)
+            self.collection = chroma_client.get_or_create_collection(
+                name=collection_name(name), configuration={"hnsw": hnsw} if hnsw else None
+            )
+            if hnsw:
+                self._apply_hnsw(hnsw)
+        self.vector_store = ChromaVectorStore(chroma_collection=self.collection)
+
+        # Keyword (BM25) index over the same chunks, built from Chroma the first time
+        self.keyword_index = BM25Index(keyword_index_path)
+        if self.keyword_index.count() == 0 and self.collection.count():
+            self.keyword_index.rebuild_from_collection(self.collection)
+
+    def _apply_hnsw(self, hnsw):
+        current = (self.collection.configuration or {}).get("hnsw") or {}
+        if "ef_search" in hnsw and current.get("ef_search") != hnsw["ef_search"]:
+            self.collection.modify(configuration={"hnsw": {"ef_search": hnsw["ef_search"]}})
+        fixed = {key: current.get(key) for key in ("max_neighbors", "ef_construction") if key in hnsw}
+        if any(hnsw[key] != value for key, value in fixed.items()):
+            logger.warning(
+                f"Shard '{self.name}' was built with {fixed}; new HNSW build settings only apply "
+                f"once its collection is rebuilt"
+            )
+
+    # A move only drops its source once every vector has been copied, so a
+    # source that is still there means the move was interrupted: the target
+    # holds a partial copy and is refilled.
+
+    def _move_from_chroma(self, chroma_client):
+        name = collection_name(self.name)
+        if name not in {collection.name for collection in chroma_client.list_collections()}:
+            return
+        source = chroma_client.get_collection(name)
+        if source.count():
+            self.collection.delete(ids=self.collection.get(include=[])["ids"])
+            move_vectors(source, self.collection)
+        chroma_client.delete_collection(name)
+
+    def _move_to_chroma(self, chroma_client, quantized_path, hnsw):
+        name = collection_name(self.name)
+        if name in {collection.name for collection in chroma_client.list_collections()}:
+            chroma_client.delete_collection(name)
+        source = QuantizedCollection(quantized_path, name)
+        target = chroma_client.create_collection(name, configuration={"hnsw": hnsw} if hnsw else None)
+        move_vectors(source, target)
+        source.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(quantized_path + suffix):
+                os.remove(quantized_path + suffix)
+
+    def count(self):
+        return self.collection.count()
+
+    def vector_retriever(self, top_k, file_name=None):
+        """Vector retriever over this shard; ``file_name`` pre-filters to one document's chunks."""
+        filters = None
+        if file_name is not None:
+            filters = MetadataFilters(filters=[ExactMatchFilter(key="file_name", value=file_name)])
+        return VectorStoreIndex.from_vector_store(self.vector_store).as_retriever(
+            similarity_top_k=top_k, filters=filters
+        )
+
+    def keyword_retriever(self, top_k, file_name=None):
+        return KeywordRetriever(self.keyword_index, self.collection, similarity_top_k=top_k, file_name=file_name)
+
+    def finish_build(self):
+        """Repartition a quantized collection once it has grown enough."""
+        if isinstance(self.collection, QuantizedCollection) and self.collection.needs_training():
+            self.collection.train()
+
+    def delete_file_chunks(self, file_name):
+        """Drop every chunk of a file, whether or not the manifest recorded it."""
+        self.collection.delete(where={"file_name": file_name})
+        self.keyword_index.remove_file(file_name)
+
+
+def move_vectors(source, target, page_size=1000):
+    """Copy every vector, with its text and metadata, from one collection to another."""
+    offset = 0
+    while True:
+        page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        target.add(ids=page["ids"], embeddings=page["embeddings"], metadatas=page["metadatas"],
+                   documents=page["documents"])
+        offset += len(page["ids"])
+    logger.info(f"Moved {offset} vectors from {source.name} to {target.name}")
+
+
+class ShardedRetriever(BaseRetriever):
+    """Search several shards and merge their results by score, or by rank with ``fusion="rank"``.
+
+    Each shard returns its own top-k, so the merged top-k is the same as
+    searching one collection holding all of them. BM25 scores use each
+    shard's own term statistics and are not comparable across shards, so
+    keyword results are merged with reciprocal-rank fusion instead. Shards
+    are searched one after another: Chroma holds the GIL while it searches,
+    so threads would not overlap.
+    """
+
+    def __init__(self, retrievers, similarity_top_k=5, fusion="score"):
+        super().__init__()
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+        self._fusion = fusion
+
+    def _retrieve(self, query_bundle) -> List[NodeWithScore]:
+        if len(self._retrievers) == 1:
+            return self._retrievers[0].retrieve(query_bundle)
+        if self._fusion == "rank":
+            # A chunk lives in one shard, so its fused score is its reciprocal rank there
+            results = [
+                NodeWithScore(node=result.node, score=1.0 / (RRF_K + rank + 1))
+                for retriever in self._retrievers
+                for rank, result in enumerate(retriever.retrieve(query_bundle))
+            ]
+        else:
+            results = [result for retriever in self._retrievers for result in retriever.retrieve(query_bundle)]
+        results.sort(key=lambda result: result.score or 0.0, reverse=True)
+        return results[:self._similarity_top_k]
@@ -0,0 +1,142 @@
+import os
+import json
+import datetime
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION, DEFAULT_BATCH_SIZE
+from llama_index.core.storage.kvstore.simple_kvstore import SimpleKVStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store.keyval_index_store import KVIndexStore
+
+logger = logging.getLogger(__name__)
+
+# JSON files written by SimpleDocumentStore / SimpleIndexStore, migrated once
+JSON_STORE_FILES = ("docstore.json", "index_store.json")
+
+
+class SQLiteKVStore(BaseKVStore):
+    """Key-value store backing the docstore and index store with one SQLite table.
+
+    Every put/delete writes just the affected rows, so persisting after an
+    ingest no longer rewrites the whole store, and values are only read
+    when they are asked for by key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (collection, key)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection=collection)
+
+    def put_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        """Write many pairs in a single transaction."""
+        if not kv_pairs:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs],
+            )
+            self._conn.commit()
+
+    async def aput_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION,
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection=collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM kv WHERE collection = ?", (collection,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection=collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key)).rowcount
+            self._conn.commit()
+        return deleted > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection=collection)
+
+    def count(self, collection: str = DEFAULT_COLLECTION) -> int:
+        """Number of keys in a collection, without loading the values."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def get_meta(self, key):
+        """Store-level bookkeeping value (e.g. which JSON files were migrated), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    """Docstore kept in a SQLiteKVStore; nodes are written and loaded one key at a time."""
+
+    def __init__(self, kvstore, namespace=None, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(kvstore, namespace=namespace, batch_size=batch_size)
+
+    def count(self):
+        """Number of stored nodes."""
+        return self._kvstore.count(self._node_collection)
+
+
+class SQLiteIndexStore(KVIndexStore):
+    """Index store kept in a SQLiteKVStore."""
+
+    def __init__(self, kvstore, namespace=None):
+        super().__init__(kvstore, namespace=namespace)
+
+
+def migrate_json_stores(kvstore, persist_dir):
+    """Copy docstore.json / index_store.json into the SQLite store, once.
+
+    The JSON files are left in place (they may be tracked or shared with
+    older versions); the store's meta table records which ones were copied,
+    so later startups skip them.
+    """
+    for file_name in JSON_STORE_FILES:
+        path = os.path.join(persist_dir, file_name)
+        if not os.path.exists(path) or kvstore.get_meta(f"migrated:{file_name}") is not None:
+            continue
+        data = SimpleKVStore.from_persist_path(path).to_dict()
+        for collection, entries in data.items():
+            kvstore.put_all(list(entries.items()), collection=collection)
+        kvstore.set_meta(f"migrated:{file_name}", datetime.datetime.now().isoformat(timespec="seconds"))
+        logger.info(f"Migrated {file_name} to {kvstore.path} ({sum(len(e) for e in data.values())} entries)")
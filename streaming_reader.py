@@ -0,0 +1,80 @@
+import os
+import csv
+import logging
+from llama_index.core import Document, SimpleDirectoryReader
+from llama_index.core.readers.file.base import default_file_metadata_func
+
+logger = logging.getLogger(__name__)
+
+# Rough bytes of resident memory per character of text while it is split and embedded
+# (the str itself, splitter intermediates and the chunk nodes built from it).
+MEMORY_PER_CHAR = 16
+
+
+def block_chars_for_budget(memory_budget_mb):
+    """Characters to read per block so one block stays well inside the memory budget."""
+    return max(64 * 1024, memory_budget_mb * 1024 * 1024 // (MEMORY_PER_CHAR * 4))
+
+
+def _iter_text_blocks(path, block_chars):
+    """Yield blocks of about block_chars characters, cut at line boundaries."""
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        lines, size = [], 0
+        for line in file:
+            lines.append(line)
+            size += len(line)
+            if size >= block_chars:
+                yield "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines)
+
+
+def _iter_csv_blocks(path, block_chars):
+    """Yield blocks of whole CSV rows, repeating the header in every block."""
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as file:
+        reader = csv.reader(file)
+        header = ", ".join(next(reader, []))
+        rows, size = [], 0
+        for row in reader:
+            line = ", ".join(row)
+            rows.append(line)
+            size += len(line) + 1
+            if size >= block_chars:
+                yield "\n".join([header] + rows)
+                rows, size = [], 0
+        if rows:
+            yield "\n".join([header] + rows)
+
+
+def _iter_pdf_pages(path):
+    """Yield (page_label, text) one page at a time."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        yield str(page_number), page.extract_text() or ""
+
+
+def iter_file_documents(path, block_chars):
+    """Yield a file as a sequence of bounded-size Documents instead of loading it whole.
+
+    Text and CSV files are read in blocks of about ``block_chars`` characters
+    and PDFs page by page. Other formats have no incremental reader and are
+    loaded with SimpleDirectoryReader as usual.
+    """
+    metadata = default_file_metadata_func(path)
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".txt":
+        for block in _iter_text_blocks(path, block_chars):
+            yield Document(text=block, metadata=dict(metadata))
+    elif extension == ".csv":
+        for block in _iter_csv_blocks(path, block_chars):
+            yield Document(text=block, metadata=dict(metadata))
+    elif extension == ".pdf":
+        for page_label, text in _iter_pdf_pages(path):
+            yield Document(text=text, metadata=dict(metadata, page_label=page_label))
+    else:
+        logger.info(f"No streaming reader for {extension} files, loading {os.path.basename(path)} whole")
+        yield from SimpleDirectoryReader(input_files=[path]).load_data()
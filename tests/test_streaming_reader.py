@@ -0,0 +1,45 @@
+"""Streaming a large text or CSV file must keep peak memory within the ingest budget."""
+import tracemalloc
+
+import pytest
+
+from streaming_reader import iter_file_documents, block_chars_for_budget
+
+BUDGET_MB = 8
+FILE_MB = 16  # Twice the budget, so loading the file whole would fail
+
+
+def write_text(path, size_mb):
+    line = "course lecture student marketing mix price product place promotion demand.\n"
+    with open(path, "w", encoding="utf-8") as file:
+        for _ in range(size_mb * 1024 * 1024 // len(line)):
+            file.write(line)
+
+
+def write_csv(path, size_mb):
+    row = "econ101,lecture,marketing mix,price,product,place,promotion\n"
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("course,kind,topic,a,b,c,d\n")
+        for _ in range(size_mb * 1024 * 1024 // len(row)):
+            file.write(row)
+
+
+@pytest.mark.parametrize("extension, write", [(".txt", write_text), (".csv", write_csv)])
+def test_peak_memory_stays_under_budget(tmp_path, extension, write):
+    path = tmp_path / f"large{extension}"
+    write(path, FILE_MB)
+    block_chars = block_chars_for_budget(BUDGET_MB)
+
+    tracemalloc.start()
+    try:
+        chars = blocks = 0
+        for document in iter_file_documents(str(path), block_chars):
+            chars += len(document.text)
+            blocks += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert chars >= path.stat().st_size * 0.9  # Every line came through
+    assert blocks > 1
+    assert peak < BUDGET_MB * 1024 * 1024, f"peak {peak / 1024 / 1024:.1f} MB"
@@ -0,0 +1,203 @@
+"""Lightweight spans written as JSONL, and a per-stage latency report.
+
+Each span is one line: timestamp, trace id, span name, duration and any
+attributes (token counts, retrieved nodes, cache hits...). Spans opened
+while another span is active share its trace id, so every stage of one
+query or one ingest run can be grouped. Nothing is written until
+configure() is called (the app and the server do so at startup). Spans are
+queued and written by a background thread, so the caller (often the GUI
+thread) never waits on the disk.
+
+    python tracing.py [traces.jsonl]    # p50/p95/p99 per stage
+"""
+import sys
+import json
+import queue
+import atexit
+import math
+import time
+import uuid
+import logging
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+TRACE_PATH = "traces.jsonl"
+
+_current_trace = contextvars.ContextVar("trace_id", default=None)
+_lock = threading.Lock()
+_queue = queue.Queue()
+_writer = None
+_path = TRACE_PATH
+_enabled = False  # Until the app calls configure(), so benchmarks and scripts importing it write nothing
+
+
+def configure(path=TRACE_PATH, enabled=True):
+    """Set where spans are written, or turn tracing off."""
+    global _path, _enabled
+    with _lock:
+        if not enabled:
+            _queue.put(None)  # The writer closes its file
+        _path = path
+        _enabled = enabled
+
+
+def flush():
+    """Block until every queued span has been written."""
+    if _writer is not None:
+        _queue.join()
+
+
+def _write_spans():
+    """Writer thread: append queued spans, reopening the file when the path changes."""
+    file = None
+    path = None
+    while True:
+        item = _queue.get()
+        try:
+            if item is None:
+                if file is not None:
+                    file.close()
+                file = path = None
+                continue
+            target, entry = item
+            if target != path:
+                if file is not None:
+                    file.close()
+                file = open(target, "a", encoding="utf-8")
+                path = target
+            file.write(json.dumps(entry, default=str) + "\n")
+            if _queue.empty():
+                file.flush()
+        except OSError as e:
+            logger.warning(f"Could not write span to {path or item[0]}: {e}")
+            file = path = None
+        finally:
+            _queue.task_done()
+
+
+def _write(entry):
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_spans, name="tracing-writer", daemon=True)
+                _writer.start()
+                atexit.register(flush)
+    _queue.put((_path, entry))
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def record(name, duration_ms, trace=None, **attributes):
+    """Write a span whose duration was measured by the caller.
+
+    ``trace`` groups the span explicitly, e.g. from a generator that cannot
+    hold a span open across yields; by default the active trace is used.
+    """
+    if not _enabled:
+        return
+    _write({
+        "ts": round(time.time(), 3),
+        "trace": trace or _current_trace.get() or new_trace_id(),
+        "span": name,
+        "ms": round(duration_ms, 3),
+        **attributes,
+    })
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block; the yielded dict can be updated with attributes before the block ends."""
+    token = None
+    if _current_trace.get() is None:
+        token = _current_trace.set(new_trace_id())
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, **attributes)
+        if token is not None:
+            _current_trace.reset(token)
+
+
+def traced(name):
+    """Decorator that records each call of a function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_iter(name, iterable, **attributes):
+    """Yield from an iterable, recording the time spent waiting for each item as a span."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record(name, (time.perf_counter() - start) * 1000, **attributes)
+        yield item
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def stage_percentiles(path=TRACE_PATH):
+    """Return {span name: {count, p50, p95, p99, total_ms}} from a JSONL trace file."""
+    durations = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            durations[entry["span"]].append(entry["ms"])
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "p50": _percentile(values, 0.50),
+            "p95": _percentile(values, 0.95),
+            "p99": _percentile(values, 0.99),
+            "total_ms": sum(values),
+        }
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from a span file.")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH)
+    args = parser.parse_args(argv)
+
+    stats = stage_percentiles(args.path)
+    print(f"{'span':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    for name in sorted(stats):
+        row = stats[name]
+        print(
+            f"{name:<22} {row['count']:>7} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f} "
+            f"{row['total_ms'] / 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())